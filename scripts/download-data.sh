@@ -2,6 +2,8 @@
 #
 # Downloads public parquet files from S3 for local analysis.
 # No AWS credentials required.
+# Files already on disk are only re-downloaded when their checksum
+# differs from the one recorded in the artifact manifest.
 #
 
 set -e
@@ -28,16 +30,49 @@ FILES=(
   "base/analysis_archetype_centroids.parquet"
 )
 
+MANIFEST="${DATA_DIR}/manifest.json"
+
+# Prints "fresh" or "stale" for a local file against the manifest, "unknown" if it is not listed
+manifest_status() {
+  python3 - "$MANIFEST" "$1" "$2" <<'PY'
+import hashlib, json, sys
+from pathlib import Path
+
+manifest_path, key, dest = sys.argv[1:]
+try:
+    expected = json.loads(Path(manifest_path).read_text())["artifacts"][key]["sha256"]
+except (FileNotFoundError, KeyError, ValueError):
+    print("unknown")
+    sys.exit()
+
+digest = hashlib.sha256()
+with Path(dest).open("rb") as f:
+    while block := f.read(1024 * 1024):
+        digest.update(block)
+print("fresh" if digest.hexdigest() == expected else "stale")
+PY
+}
+
 echo "==> Downloading data files to ${DATA_DIR}/"
 
+mkdir -p "$DATA_DIR"
+if ! curl -sfL "${BUCKET}/manifest.json" -o "$MANIFEST"; then
+  echo "  [warn] manifest.json not available, existing files will not be checked"
+  rm -f "$MANIFEST"
+fi
+
 for file in "${FILES[@]}"; do
   dir="${DATA_DIR}/$(dirname "$file")"
   mkdir -p "$dir"
   dest="${DATA_DIR}/${file}"
 
   if [ -f "$dest" ]; then
-    echo "  [skip] ${file} (already exists)"
-    continue
+    status="$(manifest_status "$file" "$dest")"
+    if [ "$status" != "stale" ]; then
+      echo "  [skip] ${file} (already exists, ${status})"
+      continue
+    fi
+    echo "  [stale] ${file} (checksum differs from manifest)"
   fi
 
   echo "  [download] ${file}"
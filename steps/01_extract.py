@@ -1,8 +1,10 @@
 import datetime
-import io
+import json
 import logging
+import shutil
 import zipfile
 from pathlib import Path
+from typing import IO, Iterator
 
 import common_io
 import conf
@@ -33,48 +35,223 @@ def update_readme():
     return
 
 
-def download_and_extract_csv(url) -> str:
+def read_download_state(state_path: str = conf.download_state_file_path) -> dict:
+    "Reads the validators (ETag / Last-Modified) recorded by the last download, empty if there was none"
+    state_file = Path(state_path)
+    if not state_file.exists():
+        return {}
+
+    with state_file.open() as f:
+        return json.load(f)
+
+
+def write_download_state(state: dict, state_path: str = conf.download_state_file_path) -> None:
+    state_file = Path(state_path)
+    state_file.parent.mkdir(parents=True, exist_ok=True)
+    with state_file.open("w") as f:
+        json.dump(state, f, indent=2)
+
+
+def download_zip(
+    url: str,
+    zip_path: str = conf.zip_local_file_path,
+    state_path: str = conf.download_state_file_path,
+) -> bool:
     """
-    Downloads a zip file from a given URL and extracts the CSV file from it.
+    Streams a zip file from a given URL to disk in chunks.
+
+    - A completed download is revalidated with If-None-Match / If-Modified-Since,
+      so an unchanged upstream file is not downloaded again.
+    - An interrupted download is resumed from the partial file with an HTTP Range request.
+      If-Range guards against stitching together two different versions of the file.
+      A partial file the server cannot resume from (416) is discarded and the download restarted.
+
+    Returns True if new content was downloaded, False if the upstream file is unchanged.
     """
+    zip_file = Path(zip_path)
+    part_file = Path(f"{zip_path}.part")
+    zip_file.parent.mkdir(parents=True, exist_ok=True)
+
+    state = read_download_state(state_path)
+    same_source = state.get("url") == url
+    validator = state.get("etag") or state.get("last_modified")
+
+    headers = {}
+    offset = 0
+    if same_source and state.get("complete") and zip_file.exists():
+        if state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
+    elif same_source and validator and part_file.exists():
+        offset = part_file.stat().st_size
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = validator
 
     logging.info(f"Downloading data from {url}")
-    with requests.get(url) as response:
+    with requests.get(url, headers=headers, stream=True, timeout=conf.DOWNLOAD_TIMEOUT_SECONDS) as response:
+        if response.status_code == 304:
+            logging.info("Upstream file unchanged since last download")
+            return False
+
+        if response.status_code == 416:
+            # The partial file is no longer a prefix of the upstream file, resuming it would fail on every run
+            logging.info("Range not satisfiable, discarding the partial download and restarting")
+            part_file.unlink()
+            return download_zip(url, zip_path, state_path)
+
         response.raise_for_status()  # This will raise an error for bad requests
-        zip_data = io.BytesIO(response.content)
 
-    logging.info("Unzipping data")
-    with zipfile.ZipFile(zip_data, "r") as zip_ref:
-        zip_ref.extractall(conf.extract_path)
+        resumed = response.status_code == 206 and response.headers.get("Content-Range", "").startswith(f"bytes {offset}-")
+        if response.status_code == 206 and not resumed:
+            part_file.unlink()
+            raise ValueError(f"Unexpected Content-Range in response: {response.headers.get('Content-Range')}")
+
+        if resumed:
+            logging.info(f"Resuming download from byte {offset}")
+        elif offset:
+            logging.info("Server did not honour the range request, restarting download")
 
-    logging.info("Searching for CSV file")
-    csv_files = [f"{conf.extract_path}/{file}" for file in zip_ref.namelist() if file.lower().endswith(".csv")]
+        # Record the validators before streaming so an interrupted transfer can be resumed
+        if not resumed:
+            state = {
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+        write_download_state({**state, "complete": False, "landing_written": False}, state_path)
 
-    if not csv_files:
+        with part_file.open("ab" if resumed else "wb") as f:
+            for chunk in response.iter_content(chunk_size=conf.DOWNLOAD_CHUNK_SIZE_BYTES):
+                f.write(chunk)
+
+    part_file.replace(zip_file)
+    write_download_state({**state, "complete": True, "landing_written": False}, state_path)
+    logging.info(f"Downloaded {zip_file.stat().st_size} bytes to {zip_path}")
+
+    return True
+
+
+def mark_landing_written(state_path: str = conf.download_state_file_path) -> None:
+    "Records that the landing layer of the downloaded zip is written and uploaded, so an unchanged upstream file skips the extract"
+    write_download_state({**read_download_state(state_path), "landing_written": True}, state_path)
+
+
+def upload_landing(landing_file_path: str, state_path: str = conf.download_state_file_path) -> None:
+    "Uploads the landing layer, then marks it as written"
+    common_io.io_upload_to_s3(landing_file_path, conf.landing_s3_key)
+    if conf.PARTITIONED_LAYOUT:
+        common_io.io_upload_directory_to_s3(conf.landing_partitioned_local_path, conf.landing_partitioned_s3_key)
+    mark_landing_written(state_path)
+
+
+def find_csv_member(zip_ref: zipfile.ZipFile) -> str | None:
+    "Returns the name of the first CSV file inside a zip archive"
+    csv_members = [file for file in zip_ref.namelist() if file.lower().endswith(".csv")]
+
+    if not csv_members:
         logging.error("CSV file not found")
-        return
+        return None
+
+    logging.info(f"CSV file(s) found: {csv_members}, returning first file")
+    return csv_members[0]
+
+
+def iter_csv_chunks(csv_stream: IO[bytes], chunk_size_bytes: int = conf.LANDING_CSV_CHUNK_SIZE_BYTES) -> Iterator[bytes]:
+    """
+    Splits a CSV byte stream into chunks of roughly chunk_size_bytes, cut on line boundaries.
+    Each chunk is prefixed with the header row so it can be parsed on its own.
+    OpenPowerlifting does not quote newlines inside fields, so a line is always a full record.
+    """
+    header = csv_stream.readline()
+    remainder = b""
+
+    while block := csv_stream.read(chunk_size_bytes):
+        block = remainder + block
+        cut = block.rfind(b"\n") + 1
+        remainder = block[cut:]
+        if cut:
+            yield header + block[:cut]
+
+    if remainder:
+        yield header + remainder
+
+
+def read_landing_csv(csv_chunk: bytes) -> pl.DataFrame:
+    "Parses a CSV chunk with the pinned landing schema and renames columns to snake case"
+    df = pl.read_csv(csv_chunk, schema_overrides=conf.landing_schema, infer_schema=False)
+    return df.rename({col: conf.camel_to_snake(col) for col in df.columns})
+
+
+def convert_zipped_csv_to_parquet(zip_path: str, output_path: str, partitioned_path: str | None = None) -> str | None:
+    """
+    Converts the CSV inside a zip archive to parquet without extracting it to disk.
+
+    The CSV is decompressed and parsed one chunk at a time, each chunk is written as a parquet part,
+    then the parts are streamed into a single parquet file. Peak memory is bounded by the chunk size
+    rather than the size of the CSV.
+
+    If partitioned_path is given, each chunk is also written to a hive-partitioned dataset
+    (see conf.landing_partition_schema).
+    """
+    parts_dir = Path(f"{output_path}.parts")
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    parts_dir.mkdir(parents=True)
+    if partitioned_path:
+        shutil.rmtree(partitioned_path, ignore_errors=True)
+
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        csv_member = find_csv_member(zip_ref)
+        if not csv_member:
+            return None
+
+        logging.info(f"Converting {csv_member} to parquet")
+        with zip_ref.open(csv_member) as csv_stream:
+            for i, csv_chunk in enumerate(iter_csv_chunks(csv_stream)):
+                landing_chunk_df = read_landing_csv(csv_chunk)
+                landing_chunk_df.write_parquet(parts_dir / f"part-{i:05d}.parquet")
+                if partitioned_path:
+                    common_io.io_write_partitioned_parquet(
+                        landing_chunk_df,
+                        partitioned_path,
+                        list(conf.landing_partition_schema),
+                        file_name=f"part-{i:05d}.parquet",
+                    )
+
+    pl.scan_parquet(f"{parts_dir}/*.parquet").sink_parquet(output_path)
+    shutil.rmtree(parts_dir)
+    logging.info(f"Parquet file written to {output_path}")
+
+    return output_path
+
+
+def run() -> pl.LazyFrame | None:
+    """
+    Downloads the latest data and writes the landing layer, uploading it in the background.
+    Returns a lazy scan of the local landing file, or None if upstream is unchanged.
+
+    The extract is only skipped once the landing layer of the downloaded zip has been written and uploaded,
+    so a run that failed after the download rebuilds it from the zip on disk.
+    """
+    common_io.io_create_root_data_folder()
+    if not download_zip(conf.zip_url) and read_download_state().get("landing_written"):
+        logging.info("Skipping extract, data is already up to date")
+        return None
+
+    landing_file_path = convert_zipped_csv_to_parquet(
+        conf.zip_local_file_path,
+        conf.landing_local_file_path,
+        partitioned_path=conf.landing_partitioned_local_path if conf.PARTITIONED_LAYOUT else None,
+    )
+    if not landing_file_path:
+        return None
 
-    logging.info(f"CSV file(s) found: {csv_files}, returning first file")
+    common_io.io_run_in_background(upload_landing, landing_file_path)
 
-    return csv_files[0]
+    update_readme()
+    return pl.scan_parquet(landing_file_path)
 
 
 if __name__ == "__main__":
-    csv_file_path = download_and_extract_csv(conf.zip_url)
-    if csv_file_path:
-        # Convert CSV to Parquet
-        logging.info("Converting CSV to Parquet")
-        df = pl.read_csv(csv_file_path, infer_schema_length=None)
-
-        # Rename columns before saving
-        remapping_cols: dict = {col: conf.camel_to_snake(col) for col in df.columns}
-        logging.info("Renaming columns")
-        landing_df = df.rename(mapping=remapping_cols)
-
-        common_io.io_write_from_local_to_s3(
-            landing_df,
-            conf.landing_local_file_path,
-            conf.landing_s3_key,
-        )
-
-        update_readme()
+    run()
+    common_io.io_wait_for_uploads()
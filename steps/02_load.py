@@ -2,7 +2,6 @@ import logging
 from pathlib import Path
 from typing import Iterator
 
-import boto3
 import common_io
 import conf
 import polars as pl
@@ -29,28 +28,23 @@ def convert_reference_tables_to_parquet() -> Iterator[str]:
         yield output_file_path
 
 
-def upload_reference_tables_to_s3(s3_client: boto3.client, parquet_files: list[str]) -> None:
+def upload_reference_tables_to_s3(parquet_files: list[str]) -> None:
     logging.info(f"Uploading {len(parquet_files)} reference tables to S3")
 
     for file in parquet_files:
         paruqet_file_name = file.split("/")[-1]
         reference_s3_key = conf.create_output_file_path(conf.OutputPathType.REFERENCE, conf.FileLocation.S3, file_name=paruqet_file_name)
 
-        s3_client.upload_file(
-            Filename=file,
-            Bucket=conf.bucket_name,
-            Key=reference_s3_key,
-        )
+        common_io.io_upload_to_s3(file, reference_s3_key)
 
-        logging.info(f"Uploaded {paruqet_file_name} to s3://{conf.bucket_name}/{reference_s3_key}")
 
-
-if __name__ == "__main__":
+def run() -> None:
+    "Uploads the reference tables to S3, both as CSV and parquet"
     reference_table_dir = Path(conf.reference_tables_local_folder_name)
     reference_table_files = [f for f in reference_table_dir.iterdir() if f.suffix == ".csv"]
 
     logging.info("Load reference tables into S3")
-    s3 = boto3.client("s3")
+    s3 = common_io.get_s3_client()
 
     logging.info(f"Uploading {len(reference_table_files)} reference tables to S3")
     for file in reference_table_files:
@@ -60,4 +54,8 @@ if __name__ == "__main__":
             Key=f"{conf.reference_tables_local_folder_name}/{file.name}",
         )
 
-    upload_reference_tables_to_s3(s3, list(convert_reference_tables_to_parquet()))
+    upload_reference_tables_to_s3(list(convert_reference_tables_to_parquet()))
+
+
+if __name__ == "__main__":
+    run()
@@ -1,179 +1,209 @@
-import bisect
+import argparse
+import functools
+import hashlib
 import logging
+from pathlib import Path
 
 import common_io
 import conf
+import elo
+import feature_store
+import features
+import glicko
+import memoize
+import percentiles
 import polars as pl
+import polars.selectors as cs
+import strings
+import weight_classes
+from polars.testing import assert_frame_equal
 
 
-# Transformations
-@conf.debug
-def add_powerlifting_progress(df: pl.DataFrame) -> pl.DataFrame:
-    progress_df = df.with_columns(
-        ((pl.col("squat") - pl.col("squat").shift(1)) / pl.col("time_since_last_comp_years")).over("primary_key").alias("squat_progress"),
-        ((pl.col("bench") - pl.col("bench").shift(1)) / pl.col("time_since_last_comp_years")).over("primary_key").alias("bench_progress"),
-        ((pl.col("deadlift") - pl.col("deadlift").shift(1)) / pl.col("time_since_last_comp_years")).over("primary_key").alias("deadlift_progress"),
-        ((pl.col("total") - pl.col("total").shift(1)) / pl.col("time_since_last_comp_years")).over("primary_key").alias("total_progress"),
-        ((pl.col("wilks") - pl.col("wilks").shift(1)) / pl.col("time_since_last_comp_years")).over("primary_key").alias("wilks_progress"),
-    )
+def raw_events_filter() -> pl.Expr:
+    return (pl.col("event") == "SBD") & (pl.col("tested") == "Yes") & (pl.col("equipment") == "Raw")
 
-    return progress_df
+
+def scan_raw() -> pl.LazyFrame:
+    "Lazily reads the raw layer, from the hive-partitioned dataset when conf.PARTITIONED_LAYOUT is set"
+    if conf.PARTITIONED_LAYOUT:
+        return pl.scan_parquet(
+            conf.raw_partitioned_s3_uri,
+            hive_partitioning=True,
+            hive_schema=conf.raw_partition_schema,
+            storage_options=conf.s3_storage_options,
+        )
+    return pl.scan_parquet(conf.raw_s3_http)
 
 
+# Transformations
 @conf.debug
-def order_by_primary_key_and_date(df: pl.DataFrame) -> pl.DataFrame:
-    return df.sort(by=["primary_key", "date"], descending=[False, False])
+def order_by_lifter_and_date(df: pl.LazyFrame) -> pl.LazyFrame:
+    return df.sort(by=conf.base_sort_columns)
 
 
 @conf.debug
-def filter_for_raw_events(df: pl.DataFrame) -> pl.DataFrame:
-    return df.filter((pl.col("event") == "SBD") & (pl.col("tested") == "Yes") & (pl.col("equipment") == "Raw"))
+def filter_for_raw_events(df: pl.LazyFrame) -> pl.LazyFrame:
+    return df.filter(raw_events_filter())
 
 
-@conf.debug
-def add_time_since_last_comp(df: pl.DataFrame) -> pl.DataFrame:
-    time_since_last_comp_df = df.with_columns(((pl.col("date") - pl.col("date").shift(1)).over("primary_key")).alias("time_since_last_comp")).with_columns(
-        pl.col("time_since_last_comp").dt.total_days().alias("time_since_last_comp_days"),
-        (pl.col("time_since_last_comp").dt.total_days() / conf.DAYS_IN_YEAR).alias("time_since_last_comp_years"),
-    )
-    return time_since_last_comp_df
+@functools.cache
+def read_meet_types() -> tuple[pl.DataFrame, pl.DataFrame]:
+    "The meet types with their patterns (conf.meet_type_file_path), and the overrides by meet name with their meet type ID"
+    meet_types_df = pl.read_csv(conf.meet_type_file_path, schema=conf.meet_type_schema)
+    overrides_df = pl.read_csv(conf.meet_type_overrides_file_path, schema=conf.meet_type_overrides_schema)
+    return meet_types_df, overrides_df.join(meet_types_df.select("meet_type", "meet_type_id"), on="meet_type", how="left")
+
+
+def meet_type_expr(meet_names: pl.Expr) -> pl.Expr:
+    "Meet type ID of lowercase meet names: the override of the name, else the first meet type whose pattern it contains"
+    meet_types_df, overrides_df = read_meet_types()
+    meet_type = pl.lit(meet_types_df.filter(pl.col("pattern").is_null())["meet_type_id"].item())
+    for pattern, meet_type_id in reversed(meet_types_df.drop_nulls("pattern").select("pattern", "meet_type_id").rows()):
+        meet_type = pl.when(meet_names.str.contains(pattern)).then(meet_type_id).otherwise(meet_type)
+    return meet_names.replace_strict(overrides_df["meet_name"], overrides_df["meet_type_id"], default=meet_type, return_dtype=pl.Int32)
 
 
 @conf.debug
-def add_meet_type(df: pl.DataFrame) -> pl.DataFrame:
-    "Set meet type to local, state, national or international based on meet name."
-    meet_type_df = df.with_columns(df.with_columns(pl.col("meet_name").fill_null("local"))).with_columns(
-        pl.when(pl.col("meet_name").str.contains("national"))
-        .then(2)
-        .when(pl.col("meet_name").str.contains("international|world|commonwealth"))
-        .then(1)
-        .when(pl.col("meet_name").str.contains("state"))
-        .then(3)
-        .otherwise(4)
-        .alias("meet_type"),
+def add_meet_type(df: pl.LazyFrame) -> pl.LazyFrame:
+    "Set meet type to local, state, national or international based on meet name, classifying each distinct name once"
+    meet_type_df = df.with_columns(pl.col("meet_name").fill_null("local")).with_columns(
+        strings.per_distinct(pl.col("meet_name"), meet_type_expr).alias("meet_type"),
     )
 
     return meet_type_df
 
 
 @conf.debug
-def add_temporal_features(df: pl.DataFrame) -> pl.DataFrame:
+def add_generic_feature_engineering_columns(df: pl.LazyFrame) -> pl.LazyFrame:
     return df.with_columns(
-        pl.col("primary_key").cum_count().over("primary_key").alias("cumulative_comps"),
-        pl.col("time_since_last_comp_days").cum_sum().over("primary_key").alias("tenure"),
+        (pl.col("meet_country") == pl.col("origin_country")).alias("is_origin_country"),
     )
 
 
-@conf.debug
-def add_generic_feature_engineering_columns(df: pl.DataFrame) -> pl.DataFrame:
-    return df.with_columns(
-        (pl.col("meet_country") == pl.col("origin_country")).alias("is_origin_country"),
-    )
+# --- Per-lifter window features ---
 
 
-@conf.debug
-def add_previous_powerlifting_records(df: pl.DataFrame) -> pl.DataFrame:
-    return df.with_columns(
-        (pl.col("squat").shift(1)).over("primary_key").alias("previous_squat"),
-        (pl.col("bench").shift(1)).over("primary_key").alias("previous_bench"),
-        (pl.col("deadlift").shift(1)).over("primary_key").alias("previous_deadlift"),
-        (pl.col("total").shift(1)).over("primary_key").alias("previous_total"),
-    )
+def lifter_lag(expr: pl.Expr, n: int = 1) -> pl.Expr:
+    "expr.shift(n).over('lifter_id') on rows ordered by lifter and date, see add_lifter_window_features"
+    return pl.when(pl.col("comp_index") >= n).then(expr.shift(n))
 
 
 @conf.debug
-def filter_minimum_competitions(df: pl.DataFrame, min_comps: int = conf.MIN_COMPETITIONS) -> pl.DataFrame:
-    return df.filter(pl.col("primary_key").count().over("primary_key") >= min_comps)
+def add_lifter_window_features(df: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Lag, rolling, cumulative and personal best features of each lifter, in a single stage.
+
+    Rows are ordered by lifter and date, so each lifter is a contiguous segment. The position of every row in
+    its segment is computed once, and shifts, differences, cumulative sums and full rolling means become plain
+    column operations masked at the start of each segment, instead of partitioning the frame once per feature.
+    Rolling standard deviations carry state across windows in polars' kernel, partial windows would reach into the
+    previous lifter and cumulative maxima cannot restart at a segment, so those three stay partitioned.
+    Progress rates from back-to-back meets (conf.MIN_DAYS_BETWEEN_COMPS) are unreliable and nulled.
+    """
+    is_first_comp = pl.col("lifter_id").ne_missing(pl.col("lifter_id").shift(1))
+    df = df.with_columns((pl.int_range(pl.len()) - pl.when(is_first_comp).then(pl.int_range(pl.len())).forward_fill()).alias("comp_index"))
 
+    lifts = ["squat", "bench", "deadlift", "total"]
+    time_since_last_comp = pl.col("date") - lifter_lag(pl.col("date"))
+    days = time_since_last_comp.dt.total_days()
+    years = days / conf.DAYS_IN_YEAR
+    running_days = days.fill_null(0).cum_sum()
+    previous = {lift: lifter_lag(pl.col(lift)) for lift in [*lifts, "wilks"]}
+    rolling_avg = {lift: pl.when(pl.col("comp_index") >= 2).then(pl.col(lift).rolling_mean(window_size=3, min_samples=3)) for lift in lifts}
 
-@conf.debug
-def remove_duplicate_names(df: pl.DataFrame) -> pl.DataFrame:
-    """Detect cases where the same lowercase name maps to multiple primary keys
-    with similar birth years (within 3 years). Keep the primary key with the most records."""
-    lifter_info = df.select("primary_key", "name", "birth_year").unique(subset=["primary_key"])
-    lifter_info = lifter_info.with_columns(pl.col("name").str.to_lowercase().alias("name_lower"))
-
-    # Count records per primary_key
-    counts = df.group_by("primary_key").len().rename({"len": "record_count"})
-    lifter_info = lifter_info.join(counts, on="primary_key")
-
-    # Self-join on lowercase name to find potential duplicates
-    dupes = lifter_info.join(lifter_info, on="name_lower", suffix="_other").filter(
-        (pl.col("primary_key") != pl.col("primary_key_other")) & ((pl.col("birth_year") - pl.col("birth_year_other")).abs() <= 3)
+    is_back_to_back = days < conf.MIN_DAYS_BETWEEN_COMPS
+    progress = {lift: pl.when(is_back_to_back).then(None).otherwise((pl.col(lift) - previous[lift]) / years) for lift in [*lifts, "wilks"]}
+    pct_change_total = pl.when(is_back_to_back).then(None).otherwise(pl.when(previous["total"] > 0).then((pl.col("total") - previous["total"]) / previous["total"] * 100).otherwise(None))
+
+    df = df.with_columns(
+        time_since_last_comp.alias("time_since_last_comp"),
+        days.alias("time_since_last_comp_days"),
+        years.alias("time_since_last_comp_years"),
+        (pl.col("comp_index") + 1).cast(pl.UInt32).alias("cumulative_comps"),
+        pl.when(days.is_not_null()).then(running_days - pl.when(is_first_comp).then(running_days).forward_fill()).alias("tenure"),
+        (pl.col("bodyweight") - lifter_lag(pl.col("bodyweight"))).alias("bodyweight_change"),
+        *(rolling_avg[lift].alias(f"rolling_avg_{lift}_3") for lift in lifts),
+        *(previous[lift].alias(f"previous_{lift}") for lift in [*lifts, "wilks"]),
+        *(lifter_lag(rolling_avg[lift]).alias(f"prev_rolling_avg_{lift}_3") for lift in lifts),
+        (previous["total"] - lifter_lag(pl.col("total"), 2)).alias("prev_total_change_kg"),
+        *(progress[lift].alias(f"{lift}_progress") for lift in [*lifts, "wilks"]),
+        pct_change_total.alias("pct_change_total"),
+        lifter_lag(progress["total"]).alias("prev_total_progress"),
+        lifter_lag(pct_change_total).alias("prev_pct_change"),
+    )
+
+    # Partitioned windows, on plain columns so each group is a slice rather than an evaluated expression
+    return (
+        df.with_columns(
+            pl.col("total").rolling_std(window_size=3, min_samples=2).shift(1).over("lifter_id").alias("prev_rolling_std_total_3"),
+            pl.col("previous_total").cum_max().over("lifter_id").alias("prev_personal_best_total"),
+            pl.col("total_progress").rolling_mean(window_size=3, min_samples=2).shift(1).over("lifter_id").alias("prev_avg_progress_3"),
+        )
+        .with_columns(
+            (pl.col("previous_total") / pl.col("prev_personal_best_total")).alias("prev_total_vs_pb"),
+            (pl.col("prev_personal_best_total") - pl.col("previous_total")).alias("prev_distance_from_pb"),
+        )
+        .drop("comp_index")
     )
 
-    if len(dupes) == 0:
-        return df
 
-    # For each duplicate pair, keep the primary key with more records
-    keys_to_drop = dupes.filter(pl.col("record_count") < pl.col("record_count_other")).select("primary_key").unique()
+@conf.debug
+def filter_minimum_competitions(df: pl.LazyFrame, min_comps: int = conf.MIN_COMPETITIONS) -> pl.LazyFrame:
+    return df.filter(pl.col("lifter_id").count().over("lifter_id") >= min_comps)
 
-    logging.info(f"Removing {len(keys_to_drop)} duplicate-name primary keys")
-    return df.filter(~pl.col("primary_key").is_in(keys_to_drop["primary_key"]))
+
+@conf.debug
+def filter_ambiguous_identities(df: pl.LazyFrame, min_confidence: float = conf.MIN_IDENTITY_CONFIDENCE) -> pl.LazyFrame:
+    "Drops the lifters whose rows could belong to another lifter of the same name, see identity.py"
+    return df.filter(pl.col("identity_confidence") >= min_confidence)
 
 
 @conf.debug
-def add_ipf_weight_class(df: pl.DataFrame) -> pl.DataFrame:
-    def classify_weight(sex: str | None, bw: float | None) -> str:
-        if sex is None or bw is None:
-            return "unknown"
-        boundaries = conf.IPF_WEIGHT_CLASSES.get(sex[0].upper(), [])
-        if not boundaries:
-            return "unknown"
-        idx = bisect.bisect_left(boundaries, bw)
-        if idx >= len(boundaries):
-            idx = len(boundaries) - 1
-        upper = boundaries[idx]
-        if upper == float("inf"):
-            prev = boundaries[idx - 1] if idx > 0 else 0
-            return f"{prev}+"
-        return str(int(upper))
-
-    weight_classes = [classify_weight(s, b) for s, b in zip(df["sex"].to_list(), df["bodyweight"].to_list())]
-    return df.with_columns(pl.Series("ipf_weight_class", weight_classes))
+def add_weight_classes(df: pl.LazyFrame, schemes: list[str] = conf.WEIGHT_CLASS_COLUMN_SCHEMES) -> pl.LazyFrame:
+    "Weight class of each row under every scheme requested in one pass, see weight_classes.py"
+    return df.with_columns(weight_classes.weight_class_exprs(schemes))
 
 
 @conf.debug
-def clean_federation_columns(df: pl.DataFrame) -> pl.DataFrame:
+def clean_federation_columns(df: pl.LazyFrame) -> pl.LazyFrame:
     return df.with_columns(
         pl.col("parent_federation").fill_null("Independent"),
     )
 
 
 @conf.debug
-def add_segment_averages(df: pl.DataFrame) -> pl.DataFrame:
+def add_segment_averages(df: pl.LazyFrame) -> pl.LazyFrame:
     """Expanding mean within segment (sex + weight class) sorted by date.
-    Uses shift(1) so current row's total is excluded (no data leakage)."""
-    df = df.sort(["sex", "ipf_weight_class", "date"])
-    df = df.with_columns(
-        (pl.col("total").cum_sum().shift(1).over("sex", "ipf_weight_class") / pl.col("total").cum_count().shift(1).over("sex", "ipf_weight_class")).alias("segment_mean_total"),
-    ).with_columns(
-        (pl.col("total") / pl.col("segment_mean_total")).alias("total_vs_segment_mean"),
+    Uses shift(1) so current row's total is excluded (no data leakage).
+    The frame stays in lifter order: only the columns the mean reads are gathered into segment order, through
+    a permutation of the rows, and the mean is scattered back through the inverse permutation.
+    The permutation is not kept: no other transform reads the rows in segment order (the percentile ranks count
+    order statistics, see percentiles.py), and the rows change between builds."""
+    segment_order = pl.col("segment_order")
+    in_segment_order = df.with_columns(pl.arg_sort_by(SEGMENT_ORDER_COLUMNS).alias("segment_order")).with_columns(
+        *(pl.col(column).gather(segment_order).alias(f"segment_{column}") for column in [*SEGMENT_COLUMNS, "total"]),
+        segment_order.arg_sort().alias("segment_position"),
+    )
+
+    segment = [f"segment_{column}" for column in SEGMENT_COLUMNS]
+    segment_mean_total = pl.col("segment_total").cum_sum().shift(1).over(segment) / pl.col("segment_total").cum_count().shift(1).over(segment)
+    return (
+        in_segment_order.with_columns(segment_mean_total.alias("segment_mean_total"))
+        .with_columns(pl.col("segment_mean_total").gather(pl.col("segment_position")))
+        .with_columns((pl.col("total") / pl.col("segment_mean_total")).alias("total_vs_segment_mean"))
+        .drop("segment_order", "segment_position", *segment, "segment_total")
     )
-    return df.sort(["primary_key", "date"])
 
 
 @conf.debug
-def add_relative_strength(df: pl.DataFrame) -> pl.DataFrame:
+def add_relative_strength(df: pl.LazyFrame) -> pl.LazyFrame:
     return df.with_columns(
         (pl.col("total") / pl.col("bodyweight")).alias("total_per_bw"),
     )
 
 
 @conf.debug
-def add_previous_wilks(df: pl.DataFrame) -> pl.DataFrame:
-    return df.with_columns(
-        pl.col("wilks").shift(1).over("primary_key").alias("previous_wilks"),
-    )
-
-
-@conf.debug
-def add_bodyweight_change(df: pl.DataFrame) -> pl.DataFrame:
-    return df.with_columns((pl.col("bodyweight") - pl.col("bodyweight").shift(1)).over("primary_key").alias("bodyweight_change"))
-
-
-@conf.debug
-def add_lift_ratios(df: pl.DataFrame) -> pl.DataFrame:
+def add_lift_ratios(df: pl.LazyFrame) -> pl.LazyFrame:
     return df.with_columns(
         (pl.col("squat") / pl.col("total")).alias("squat_ratio"),
         (pl.col("bench") / pl.col("total")).alias("bench_ratio"),
@@ -182,17 +212,7 @@ def add_lift_ratios(df: pl.DataFrame) -> pl.DataFrame:
 
 
 @conf.debug
-def add_rolling_averages(df: pl.DataFrame, window: int = 3) -> pl.DataFrame:
-    return df.with_columns(
-        pl.col("total").rolling_mean(window_size=window, min_samples=window).over("primary_key").alias(f"rolling_avg_total_{window}"),
-        pl.col("squat").rolling_mean(window_size=window, min_samples=window).over("primary_key").alias(f"rolling_avg_squat_{window}"),
-        pl.col("bench").rolling_mean(window_size=window, min_samples=window).over("primary_key").alias(f"rolling_avg_bench_{window}"),
-        pl.col("deadlift").rolling_mean(window_size=window, min_samples=window).over("primary_key").alias(f"rolling_avg_deadlift_{window}"),
-    )
-
-
-@conf.debug
-def add_percentile_rank(df: pl.DataFrame) -> pl.DataFrame:
+def add_percentile_rank(df: pl.LazyFrame) -> pl.LazyFrame:
     return df.with_columns(
         (pl.col("total").rank("average").over("sex", "ipf_weight_class") / pl.col("total").count().over("sex", "ipf_weight_class") * 100).alias("total_percentile_rank"),
     )
@@ -202,7 +222,7 @@ def add_percentile_rank(df: pl.DataFrame) -> pl.DataFrame:
 
 
 @conf.debug
-def add_prev_lift_ratios(df: pl.DataFrame) -> pl.DataFrame:
+def add_prev_lift_ratios(df: pl.LazyFrame) -> pl.LazyFrame:
     return df.with_columns(
         (pl.col("previous_squat") / pl.col("previous_total")).alias("prev_squat_ratio"),
         (pl.col("previous_bench") / pl.col("previous_total")).alias("prev_bench_ratio"),
@@ -211,31 +231,40 @@ def add_prev_lift_ratios(df: pl.DataFrame) -> pl.DataFrame:
 
 
 @conf.debug
-def add_prev_rolling_averages(df: pl.DataFrame) -> pl.DataFrame:
+def add_prev_percentile_rank(df: pl.LazyFrame) -> pl.LazyFrame:
     return df.with_columns(
-        pl.col("rolling_avg_total_3").shift(1).over("primary_key").alias("prev_rolling_avg_total_3"),
-        pl.col("rolling_avg_squat_3").shift(1).over("primary_key").alias("prev_rolling_avg_squat_3"),
-        pl.col("rolling_avg_bench_3").shift(1).over("primary_key").alias("prev_rolling_avg_bench_3"),
-        pl.col("rolling_avg_deadlift_3").shift(1).over("primary_key").alias("prev_rolling_avg_deadlift_3"),
+        (pl.col("previous_total").rank("average").over("sex", "ipf_weight_class") / pl.col("previous_total").count().over("sex", "ipf_weight_class") * 100).alias("prev_total_percentile_rank"),
     )
 
 
+# Point-in-time percentile of each value column among the totals of the segment before the meet date
+ASOF_PERCENTILE_COLUMNS = {"total": "asof_total_percentile_rank", "previous_total": "asof_prev_total_percentile_rank"}
+
+
+def compute_asof_percentile_ranks(df: pl.DataFrame) -> pl.DataFrame:
+    """Percentile of the total and previous total among the totals of the segment (sex + weight class) recorded
+    before the meet date, unlike add_percentile_rank which ranks among every total of the segment (leakage).
+    Ties count half, null without earlier totals. See percentiles.py for the order-statistics counting."""
+    return df.hstack(percentiles.asof_percentile_ranks(df, SEGMENT_COLUMNS, ASOF_PERCENTILE_COLUMNS))
+
+
 @conf.debug
-def add_prev_percentile_rank(df: pl.DataFrame) -> pl.DataFrame:
-    return df.with_columns(
-        (pl.col("previous_total").rank("average").over("sex", "ipf_weight_class") / pl.col("previous_total").count().over("sex", "ipf_weight_class") * 100).alias("prev_total_percentile_rank"),
-    )
+def add_asof_percentile_ranks(df: pl.LazyFrame) -> pl.LazyFrame:
+    "Runs eagerly on the materialized input like add_elo_rating"
+    schema = df.collect_schema()
+    schema.update({column: pl.Float64 for column in ASOF_PERCENTILE_COLUMNS.values()})
+    return df.map_batches(compute_asof_percentile_ranks, schema=schema, streamable=False)
 
 
 @conf.debug
-def add_prev_relative_strength(df: pl.DataFrame) -> pl.DataFrame:
+def add_prev_relative_strength(df: pl.LazyFrame) -> pl.LazyFrame:
     return df.with_columns(
         (pl.col("previous_total") / pl.col("bodyweight")).alias("prev_total_per_bw"),
     )
 
 
 @conf.debug
-def add_prev_segment_comparison(df: pl.DataFrame) -> pl.DataFrame:
+def add_prev_segment_comparison(df: pl.LazyFrame) -> pl.LazyFrame:
     return df.with_columns(
         (pl.col("previous_total") / pl.col("segment_mean_total")).alias("prev_total_vs_segment_mean"),
     )
@@ -244,136 +273,137 @@ def add_prev_segment_comparison(df: pl.DataFrame) -> pl.DataFrame:
 # --- Elo rating system ---
 
 
-@conf.debug
-def add_elo_rating(df: pl.DataFrame) -> pl.DataFrame:
+ELO_COLUMNS = ["elo_rating", "elo_change", "meet_field_elo"]
+
+
+def compute_elo_rating(df: pl.DataFrame, state_df: pl.DataFrame | None = None) -> pl.DataFrame:
     """Field-based Elo rating adapted from tennis.
 
     At each meet, lifters are rated against peers in their segment (sex + weight class).
-    The feature stored is the pre-meet Elo (no leakage).
+    The feature stored is the pre-meet Elo (no leakage). See elo.py for the engine.
+    Ratings start from state_df (see elo.rating_state) when given, so df only needs the meets after it.
     """
-    elo_ratings: dict[str, float] = {}  # primary_key -> current elo
-
-    # Pre-allocate output lists
-    n = len(df)
-    out_elo = [None] * n
-    out_change = [None] * n
-    out_field = [None] * n
-
-    # Build a row-index map keyed by (meet_name, date)
-    meet_names = df["meet_name"].to_list()
-    dates = df["date"].to_list()
-    pkeys = df["primary_key"].to_list()
-    sexes = df["sex"].to_list()
-    weight_classes = df["ipf_weight_class"].to_list()
-    totals = df["total"].to_list()
-    meet_types = df["meet_type"].to_list()
-
-    # Group row indices by (meet_name, date), preserving chronological order
-    from collections import OrderedDict
-
-    meet_groups: OrderedDict[tuple, list[int]] = OrderedDict()
-    for i in range(n):
-        key = (meet_names[i], dates[i])
-        if key not in meet_groups:
-            meet_groups[key] = []
-        meet_groups[key].append(i)
-
-    # Sort meet groups chronologically
-    sorted_meets = sorted(meet_groups.items(), key=lambda x: x[0][1])
-
-    for (_meet_name, _date), row_indices in sorted_meets:
-        # Sub-group by segment (sex, ipf_weight_class)
-        segments: dict[tuple, list[int]] = {}
-        for i in row_indices:
-            seg_key = (sexes[i], weight_classes[i])
-            if seg_key not in segments:
-                segments[seg_key] = []
-            segments[seg_key].append(i)
-
-        for _seg_key, seg_indices in segments.items():
-            if len(seg_indices) < 2:
-                # Record pre-meet Elo but skip update for trivial segments
-                for i in seg_indices:
-                    pk = pkeys[i]
-                    pre_elo = elo_ratings.get(pk, conf.ELO_INITIAL)
-                    out_elo[i] = pre_elo
-                    out_field[i] = pre_elo  # field of 1
-                continue
-
-            # Collect pre-meet Elos
-            pre_elos = {}
-            for i in seg_indices:
-                pk = pkeys[i]
-                pre_elos[i] = elo_ratings.get(pk, conf.ELO_INITIAL)
-
-            field_avg = sum(pre_elos.values()) / len(pre_elos)
-
-            # Rank lifters by total within this meet+segment (percentile 0-1)
-            seg_totals = [(i, totals[i] if totals[i] is not None else 0.0) for i in seg_indices]
-            seg_totals.sort(key=lambda x: x[1])
-            num_lifters = len(seg_totals)
-            for rank_pos, (i, _total) in enumerate(seg_totals):
-                actual_score = rank_pos / (num_lifters - 1) if num_lifters > 1 else 0.5
-
-                lifter_elo = pre_elos[i]
-                expected_score = 1.0 / (1.0 + 10.0 ** ((field_avg - lifter_elo) / 400.0))
-
-                mt = meet_types[i] if meet_types[i] is not None else 4
-                k = conf.ELO_BASE_K * conf.ELO_MEET_TYPE_MULTIPLIER.get(mt, 0.6)
-                elo_change = k * (actual_score - expected_score)
-
-                out_elo[i] = lifter_elo
-                out_change[i] = elo_change
-                out_field[i] = field_avg
-
-                # Update Elo for future meets
-                pk = pkeys[i]
-                elo_ratings[pk] = lifter_elo + elo_change
+    plan = elo.plan_elo(df)
+    pre_elo, elo_change, field_elo = elo.replay_elo(plan, elo.initial_ratings(df["lifter_id"], state_df))
 
     return df.with_columns(
-        pl.Series("elo_rating", out_elo, dtype=pl.Float64),
-        pl.Series("elo_change", out_change, dtype=pl.Float64),
-        pl.Series("meet_field_elo", out_field, dtype=pl.Float64),
+        pl.Series("elo_rating", pre_elo, dtype=pl.Float64),
+        pl.Series("elo_change", elo_change, dtype=pl.Float64).fill_nan(None),
+        pl.Series("meet_field_elo", field_elo, dtype=pl.Float64),
     )
 
 
-# --- Iteration 2: High-impact features ---
+@memoize.stage
+@conf.debug
+def add_elo_rating(df: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    The rating is sequential over the whole history, so it runs eagerly on the materialized input.
+    No optimization is pushed through it, the plans above and below it are still optimized.
+    """
+    schema = df.collect_schema()
+    schema.update({column: pl.Float64 for column in ELO_COLUMNS})
+    return df.map_batches(compute_elo_rating, schema=schema, streamable=False)
+
+
+def compute_elo_rating_from_checkpoint(df: pl.DataFrame, elo_state_df: pl.DataFrame, previous_base_df: pl.DataFrame) -> pl.DataFrame:
+    """
+    compute_elo_rating resumed from the latest checkpoint of elo_state_df still valid for df (see elo.latest_valid_checkpoint):
+    rows up to the checkpoint keep their Elo columns from previous_base_df, only the meets after it are replayed.
+    Replays every meet when no checkpoint is valid, e.g. a late-arriving meet older than all of them.
+    """
+    checkpoint = elo.latest_valid_checkpoint(elo_state_df, df)
+    if checkpoint is None:
+        logging.info("No valid Elo checkpoint, replaying every meet")
+        return compute_elo_rating(df)
+
+    as_of, state_df = checkpoint
+    df = df.with_row_index("input_row")
+    history_df = df.filter(pl.col("date") <= as_of).join(previous_base_df.select(*conf.base_sort_columns, *ELO_COLUMNS), on=conf.base_sort_columns, how="left", nulls_equal=True, maintain_order="left")
+    if history_df["elo_rating"].null_count() > 0:
+        logging.info("The previous base layer does not match the Elo checkpoint, replaying every meet")
+        return compute_elo_rating(df.drop("input_row"))
+
+    new_df = df.filter(pl.col("date") > as_of)
+    logging.info(f"Resuming Elo from the {as_of} checkpoint: replaying {new_df.height} of {df.height} rows")
+    return pl.concat([history_df, compute_elo_rating(new_df, state_df)]).sort("input_row").drop("input_row")
 
 
 @conf.debug
-def add_personal_best_features(df: pl.DataFrame) -> pl.DataFrame:
-    return df.with_columns(
-        pl.col("previous_total").cum_max().over("primary_key").alias("prev_personal_best_total"),
-    ).with_columns(
-        (pl.col("previous_total") / pl.col("prev_personal_best_total")).alias("prev_total_vs_pb"),
-        (pl.col("prev_personal_best_total") - pl.col("previous_total")).alias("prev_distance_from_pb"),
-    )
+def resume_elo_rating(df: pl.LazyFrame, elo_state_df: pl.DataFrame, previous_base_df: pl.DataFrame) -> pl.LazyFrame:
+    "add_elo_rating for incremental builds, see compute_elo_rating_from_checkpoint"
+    schema = df.collect_schema()
+    schema.update({column: pl.Float64 for column in ELO_COLUMNS})
+    return df.map_batches(lambda batch: compute_elo_rating_from_checkpoint(batch, elo_state_df, previous_base_df), schema=schema, streamable=False)
+
+
+# --- Glicko-2 rating system ---
+
+
+GLICKO_COLUMNS = ["glicko_rating", "glicko_rd", "glicko_volatility"]
+
+
+def compute_glicko_rating(df: pl.DataFrame, state_df: pl.DataFrame | None = None) -> pl.DataFrame:
+    """Glicko-2 rating, deviation and volatility of each lifter before the rating period of the meet (no leakage).
+
+    Within a period every lifter plays every other lifter of their segment (sex + weight class) at each meet.
+    See glicko.py for the engine. Ratings start from state_df (see glicko.state_as_of) when given.
+    """
+    features_df, _ = glicko.glicko_ratings(df, state_df)
+    return df.hstack(features_df)
 
 
+@memoize.stage
 @conf.debug
-def add_prev_progress_rate(df: pl.DataFrame) -> pl.DataFrame:
-    return df.with_columns(
-        pl.col("total_progress").shift(1).over("primary_key").alias("prev_total_progress"),
-        pl.col("total_progress").rolling_mean(window_size=3, min_samples=2).shift(1).over("primary_key").alias("prev_avg_progress_3"),
+def add_glicko_rating(df: pl.LazyFrame) -> pl.LazyFrame:
+    "Runs eagerly on the materialized input like add_elo_rating"
+    schema = df.collect_schema()
+    schema.update({column: pl.Float64 for column in GLICKO_COLUMNS})
+    return df.map_batches(compute_glicko_rating, schema=schema, streamable=False)
+
+
+def compute_glicko_rating_from_checkpoint(df: pl.DataFrame, glicko_state_df: pl.DataFrame, previous_base_df: pl.DataFrame) -> pl.DataFrame:
+    """
+    compute_glicko_rating resumed from the latest period of glicko_state_df still valid for df (see glicko.latest_valid_period):
+    rows up to that period keep their Glicko columns from previous_base_df, only the periods after it are replayed.
+    """
+    period = glicko.latest_valid_period(glicko_state_df, glicko.period_fingerprints(df))
+    if period is None:
+        logging.info("No valid Glicko checkpoint, replaying every period")
+        return compute_glicko_rating(df)
+
+    df = df.with_row_index("input_row")
+    history_df = df.filter(glicko.period_expr() <= period).join(
+        previous_base_df.select(*conf.base_sort_columns, *GLICKO_COLUMNS), on=conf.base_sort_columns, how="left", nulls_equal=True, maintain_order="left"
     )
+    if history_df["glicko_rating"].null_count() > 0:
+        logging.info("The previous base layer does not match the Glicko checkpoint, replaying every period")
+        return compute_glicko_rating(df.drop("input_row"))
+
+    new_df = df.filter(glicko.period_expr() > period)
+    logging.info(f"Resuming Glicko from the {period} period: replaying {new_df.height} of {df.height} rows")
+    return pl.concat([history_df, compute_glicko_rating(new_df, glicko.state_as_of(glicko_state_df, period))]).sort("input_row").drop("input_row")
 
 
 @conf.debug
-def add_competition_density(df: pl.DataFrame) -> pl.DataFrame:
-    return df.with_columns(
-        pl.when(pl.col("tenure") > 0).then(pl.col("cumulative_comps") / (pl.col("tenure") / conf.DAYS_IN_YEAR)).otherwise(None).alias("comps_per_year"),
-    )
+def resume_glicko_rating(df: pl.LazyFrame, glicko_state_df: pl.DataFrame, previous_base_df: pl.DataFrame) -> pl.LazyFrame:
+    "add_glicko_rating for incremental builds, see compute_glicko_rating_from_checkpoint"
+    schema = df.collect_schema()
+    schema.update({column: pl.Float64 for column in GLICKO_COLUMNS})
+    return df.map_batches(lambda batch: compute_glicko_rating_from_checkpoint(batch, glicko_state_df, previous_base_df), schema=schema, streamable=False)
+
+
+# --- Iteration 2: High-impact features ---
 
 
 @conf.debug
-def add_rolling_variability(df: pl.DataFrame) -> pl.DataFrame:
+def add_competition_density(df: pl.LazyFrame) -> pl.LazyFrame:
     return df.with_columns(
-        pl.col("total").rolling_std(window_size=3, min_samples=2).shift(1).over("primary_key").alias("prev_rolling_std_total_3"),
+        pl.when(pl.col("tenure") > 0).then(pl.col("cumulative_comps") / (pl.col("tenure") / conf.DAYS_IN_YEAR)).otherwise(None).alias("comps_per_year"),
     )
 
 
 @conf.debug
-def add_age_lifecycle_features(df: pl.DataFrame) -> pl.DataFrame:
+def add_age_lifecycle_features(df: pl.LazyFrame) -> pl.LazyFrame:
     return (
         df.with_columns(
             (pl.col("date").dt.year() - pl.col("birth_year")).alias("approx_age"),
@@ -388,17 +418,16 @@ def add_age_lifecycle_features(df: pl.DataFrame) -> pl.DataFrame:
 
 
 @conf.debug
-def add_prev_absolute_change(df: pl.DataFrame) -> pl.DataFrame:
+def add_interaction_features(df: pl.LazyFrame) -> pl.LazyFrame:
     return df.with_columns(
-        (pl.col("previous_total") - pl.col("previous_total").shift(1).over("primary_key")).alias("prev_total_change_kg"),
+        (pl.col("previous_total") * pl.col("time_since_last_comp_years")).alias("prev_total_x_time_gap"),
+        (pl.col("previous_total") / pl.col("cumulative_comps")).alias("prev_total_per_comp"),
     )
 
 
 @conf.debug
-def add_interaction_features(df: pl.DataFrame) -> pl.DataFrame:
+def add_elo_gap_vs_field(df: pl.LazyFrame) -> pl.LazyFrame:
     return df.with_columns(
-        (pl.col("previous_total") * pl.col("time_since_last_comp_years")).alias("prev_total_x_time_gap"),
-        (pl.col("previous_total") / pl.col("cumulative_comps")).alias("prev_total_per_comp"),
         (pl.col("elo_rating") - pl.col("meet_field_elo")).alias("elo_gap_vs_field"),
     )
 
@@ -407,7 +436,7 @@ def add_interaction_features(df: pl.DataFrame) -> pl.DataFrame:
 
 
 @conf.debug
-def add_time_gap_category(df: pl.DataFrame) -> pl.DataFrame:
+def add_time_gap_category(df: pl.LazyFrame) -> pl.LazyFrame:
     return df.with_columns(
         pl.when(pl.col("time_since_last_comp_days") <= conf.TIME_GAP_SHORT_UPPER)
         .then(conf.TIME_GAP_CATEGORIES["short"])
@@ -419,85 +448,355 @@ def add_time_gap_category(df: pl.DataFrame) -> pl.DataFrame:
 
 
 @conf.debug
-def add_log_experience(df: pl.DataFrame) -> pl.DataFrame:
+def add_log_experience(df: pl.LazyFrame) -> pl.LazyFrame:
     return df.with_columns(
         pl.col("cumulative_comps").log().alias("log_cumulative_comps"),
     )
 
 
 @conf.debug
-def add_years_competing(df: pl.DataFrame) -> pl.DataFrame:
+def add_years_competing(df: pl.LazyFrame) -> pl.LazyFrame:
     return df.with_columns(
         (pl.col("tenure") / conf.DAYS_IN_YEAR).alias("years_competing"),
     )
 
 
-@conf.debug
-def add_pct_change_total(df: pl.DataFrame) -> pl.DataFrame:
-    return df.with_columns(
-        pl.when(pl.col("previous_total") > 0).then((pl.col("total") - pl.col("previous_total")) / pl.col("previous_total") * 100).otherwise(None).alias("pct_change_total"),
-    )
+# Features computed per segment (sex + ipf_weight_class) rather than per lifter
+SEGMENT_COLUMNS = ["sex", "ipf_weight_class"]
+SEGMENT_ORDER_COLUMNS = [*SEGMENT_COLUMNS, "date", "lifter_id", "meet_name"]  # unique, so the order is the same in every build
+
+# --- Feature registry ---
+
+# Columns of the base input once renamed, see select_base_input
+BASE_INPUT_COLUMNS = [conf.base_renamed_columns.get(column, column) for column in conf.base_columns]
+LIFTS = ["squat", "bench", "deadlift", "total"]
+
+# Every transform with the columns it reads and writes, in the order they run, see features.py
+LIFTER_TRANSFORMS = {
+    "clean_federation_columns": features.Transform(clean_federation_columns, ["parent_federation"], ["parent_federation"], features.ROW_WISE),
+    "order_by_lifter_and_date": features.Transform(order_by_lifter_and_date, conf.base_sort_columns, [], features.WINDOW),
+    "filter_for_raw_events": features.Transform(filter_for_raw_events, ["event", "tested", "equipment"], [], features.ROW_WISE),
+    "filter_ambiguous_identities": features.Transform(filter_ambiguous_identities, ["identity_confidence"], [], features.ROW_WISE),
+    "filter_minimum_competitions": features.Transform(filter_minimum_competitions, ["lifter_id"], [], features.WINDOW),
+    "add_lifter_window_features": features.Transform(
+        add_lifter_window_features,
+        ["lifter_id", "date", "bodyweight", *LIFTS, "wilks"],
+        [
+            "time_since_last_comp",
+            "time_since_last_comp_days",
+            "time_since_last_comp_years",
+            "cumulative_comps",
+            "tenure",
+            "bodyweight_change",
+            *(f"rolling_avg_{lift}_3" for lift in LIFTS),
+            *(f"previous_{lift}" for lift in [*LIFTS, "wilks"]),
+            *(f"prev_rolling_avg_{lift}_3" for lift in LIFTS),
+            "prev_total_change_kg",
+            *(f"{lift}_progress" for lift in [*LIFTS, "wilks"]),
+            "pct_change_total",
+            "prev_total_progress",
+            "prev_pct_change",
+            "prev_rolling_std_total_3",
+            "prev_personal_best_total",
+            "prev_avg_progress_3",
+            "prev_total_vs_pb",
+            "prev_distance_from_pb",
+        ],
+        features.WINDOW,
+    ),
+    "add_time_gap_category": features.Transform(add_time_gap_category, ["time_since_last_comp_days"], ["time_gap_category"], features.ROW_WISE),
+    "add_log_experience": features.Transform(add_log_experience, ["cumulative_comps"], ["log_cumulative_comps"], features.ROW_WISE),
+    "add_years_competing": features.Transform(add_years_competing, ["tenure"], ["years_competing"], features.ROW_WISE),
+    "add_meet_type": features.Transform(add_meet_type, ["meet_name"], ["meet_name", "meet_type"], features.ROW_WISE),
+    "add_weight_classes": features.Transform(
+        add_weight_classes,
+        ["sex", "bodyweight", "date", "federation", "parent_federation"],
+        [f"{scheme}_weight_class" for scheme in conf.WEIGHT_CLASS_COLUMN_SCHEMES],
+        features.ROW_WISE,
+    ),
+    "add_generic_feature_engineering_columns": features.Transform(add_generic_feature_engineering_columns, ["meet_country", "origin_country"], ["is_origin_country"], features.ROW_WISE),
+    "add_relative_strength": features.Transform(add_relative_strength, ["total", "bodyweight"], ["total_per_bw"], features.ROW_WISE),
+    "add_lift_ratios": features.Transform(add_lift_ratios, LIFTS, ["squat_ratio", "bench_ratio", "deadlift_ratio"], features.ROW_WISE),
+    "add_prev_lift_ratios": features.Transform(add_prev_lift_ratios, [f"previous_{lift}" for lift in LIFTS], ["prev_squat_ratio", "prev_bench_ratio", "prev_deadlift_ratio"], features.ROW_WISE),
+    "add_prev_relative_strength": features.Transform(add_prev_relative_strength, ["previous_total", "bodyweight"], ["prev_total_per_bw"], features.ROW_WISE),
+    "add_age_lifecycle_features": features.Transform(add_age_lifecycle_features, ["date", "birth_year"], ["approx_age", "years_from_peak_age", "abs_years_from_peak_age"], features.ROW_WISE),
+    "add_competition_density": features.Transform(add_competition_density, ["tenure", "cumulative_comps"], ["comps_per_year"], features.ROW_WISE),
+}
+SEGMENT_TRANSFORMS = {
+    "add_segment_averages": features.Transform(add_segment_averages, [*SEGMENT_ORDER_COLUMNS, "total"], ["segment_mean_total", "total_vs_segment_mean"], features.WINDOW),
+    "add_percentile_rank": features.Transform(add_percentile_rank, [*SEGMENT_COLUMNS, "total"], ["total_percentile_rank"], features.WINDOW),
+    "add_prev_percentile_rank": features.Transform(add_prev_percentile_rank, [*SEGMENT_COLUMNS, "previous_total"], ["prev_total_percentile_rank"], features.WINDOW),
+    "add_asof_percentile_ranks": features.Transform(add_asof_percentile_ranks, [*SEGMENT_COLUMNS, "date", *ASOF_PERCENTILE_COLUMNS], list(ASOF_PERCENTILE_COLUMNS.values()), features.WINDOW),
+    "add_prev_segment_comparison": features.Transform(add_prev_segment_comparison, ["previous_total", "segment_mean_total"], ["prev_total_vs_segment_mean"], features.ROW_WISE),
+}
+RATING_TRANSFORMS = {
+    "add_elo_rating": features.Transform(add_elo_rating, elo.ELO_INPUT_COLUMNS, ELO_COLUMNS, features.REPLAY),
+    "add_glicko_rating": features.Transform(add_glicko_rating, glicko.GLICKO_INPUT_COLUMNS, GLICKO_COLUMNS, features.REPLAY),
+    "add_interaction_features": features.Transform(
+        add_interaction_features, ["previous_total", "time_since_last_comp_years", "cumulative_comps"], ["prev_total_x_time_gap", "prev_total_per_comp"], features.ROW_WISE
+    ),
+    "add_elo_gap_vs_field": features.Transform(add_elo_gap_vs_field, ["elo_rating", "meet_field_elo"], ["elo_gap_vs_field"], features.ROW_WISE),
+}
+BASE_TRANSFORMS = {**LIFTER_TRANSFORMS, **SEGMENT_TRANSFORMS, **RATING_TRANSFORMS}
+
+SEGMENT_FEATURE_COLUMNS = [column for transform in SEGMENT_TRANSFORMS.values() for column in transform.outputs]
+RATING_FEATURE_COLUMNS = [column for transform in RATING_TRANSFORMS.values() for column in transform.outputs]
+
+# Feature groups of the feature store, the other columns of the base layer form the "meet" group, see feature_groups
+TEMPORAL_COLUMNS = [
+    "time_since_last_comp",
+    "time_since_last_comp_days",
+    "time_since_last_comp_years",
+    "cumulative_comps",
+    "tenure",
+    "time_gap_category",
+    "log_cumulative_comps",
+    "years_competing",
+    "comps_per_year",
+]
+FEATURE_GROUP_COLUMNS = {
+    "temporal": TEMPORAL_COLUMNS,
+    "lag": [
+        *(column for column in LIFTER_TRANSFORMS["add_lifter_window_features"].outputs if column not in TEMPORAL_COLUMNS),
+        *LIFTER_TRANSFORMS["add_prev_lift_ratios"].outputs,
+        *LIFTER_TRANSFORMS["add_prev_relative_strength"].outputs,
+        *RATING_TRANSFORMS["add_interaction_features"].outputs,
+    ],
+    "rating": [*ELO_COLUMNS, *GLICKO_COLUMNS, "elo_gap_vs_field"],
+    "segment": SEGMENT_FEATURE_COLUMNS,
+    "lifecycle": LIFTER_TRANSFORMS["add_age_lifecycle_features"].outputs,
+}
+
+
+def feature_groups(columns: list[str]) -> dict[str, feature_store.FeatureGroup]:
+    """
+    Feature groups of a base layer with the given columns: FEATURE_GROUP_COLUMNS and the "meet" group of its other columns.
+    A group's version is a hash of its columns and of the code of the transforms writing them.
+    """
+    group_columns = {name: [column for column in group if column in columns] for name, group in FEATURE_GROUP_COLUMNS.items()}
+    grouped = {column for group in group_columns.values() for column in group}
+    group_columns["meet"] = [column for column in columns if column not in grouped and column not in conf.feature_store_entity_columns]
 
+    groups = {}
+    for name, group in group_columns.items():
+        writers = [transform.func for transform in BASE_TRANSFORMS.values() if set(transform.outputs) & set(group)]
+        digest = hashlib.sha256(repr(group).encode())
+        for func in writers:
+            digest.update(memoize.code_fingerprint(func).encode())
+        groups[name] = feature_store.FeatureGroup(group, digest.hexdigest()[:12])
+    return groups
 
-@conf.debug
-def add_prev_pct_change(df: pl.DataFrame) -> pl.DataFrame:
-    return df.with_columns(
-        pl.col("pct_change_total").shift(1).over("primary_key").alias("prev_pct_change"),
-    )
 
+def select_base_input(raw_lf: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Tested raw SBD rows of the raw layer, projected to the base columns.
+    The filter and projection are pushed into the scan, which prunes partitions on the
+    hive-partitioned dataset and row groups via their statistics on the single file.
+    """
+    return raw_lf.filter(raw_events_filter()).select(conf.base_columns)
 
-if __name__ == "__main__":
-    df = (
-        pl.read_parquet(source=conf.raw_s3_http)
-        .select(conf.base_columns)
-        .rename(conf.base_renamed_columns)
-        .pipe(clean_federation_columns)
-        .pipe(order_by_primary_key_and_date)
-        .pipe(filter_for_raw_events)
-        .pipe(remove_duplicate_names)
-        .pipe(filter_minimum_competitions)
-        .pipe(add_time_since_last_comp)
-        .pipe(add_time_gap_category)
-        .pipe(add_temporal_features)
-        .pipe(add_log_experience)
-        .pipe(add_years_competing)
-        .pipe(add_meet_type)
-        .pipe(add_ipf_weight_class)
-        .pipe(add_segment_averages)
-        .pipe(add_generic_feature_engineering_columns)
-        .pipe(add_bodyweight_change)
-        .pipe(add_relative_strength)
-        .pipe(add_lift_ratios)
-        .pipe(add_rolling_averages)
-        .pipe(add_rolling_variability)
-        .pipe(add_percentile_rank)
-        .pipe(add_previous_powerlifting_records)
-        .pipe(add_previous_wilks)
-        .pipe(add_personal_best_features)
-        .pipe(add_prev_lift_ratios)
-        .pipe(add_prev_rolling_averages)
-        .pipe(add_prev_percentile_rank)
-        .pipe(add_prev_relative_strength)
-        .pipe(add_prev_segment_comparison)
-        .pipe(add_prev_absolute_change)
-        .pipe(add_elo_rating)
-        .pipe(add_age_lifecycle_features)
-        .pipe(add_competition_density)
-        .pipe(add_interaction_features)
-        .pipe(add_powerlifting_progress)
-        .pipe(add_pct_change_total)
-    )
 
-    # Guard: null out unreliable progress rates from back-to-back meets
-    progress_cols = ["squat_progress", "bench_progress", "deadlift_progress", "total_progress", "wilks_progress", "pct_change_total"]
-    df = df.with_columns(pl.when(pl.col("time_since_last_comp_days") < conf.MIN_DAYS_BETWEEN_COMPS).then(None).otherwise(pl.col(c)).alias(c) for c in progress_cols)
+# Float columns kept in double precision: the ratings are the state resumed builds and snapshots replay from
+FLOAT64_COLUMNS = [*ELO_COLUMNS, *GLICKO_COLUMNS]
+
+
+def widen_floats(lf: pl.LazyFrame) -> pl.LazyFrame:
+    "Float32 columns in Float64, an exact cast, so every stage computes in double precision (see narrow_floats)"
+    return lf.with_columns(cs.by_dtype(pl.Float32).cast(pl.Float64))
+
+
+def narrow_floats(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Float columns but FLOAT64_COLUMNS in Float32, the precision of the raw measurements (see 03_raw.encode_dtypes).
+    Every stage ends with it, so a row gets the same values whether its stage ran in this build or a previous one.
+    """
+    return lf.with_columns((cs.float() - cs.by_name(FLOAT64_COLUMNS, require_all=False)).cast(pl.Float32))
+
 
-    # Features that depend on guarded progress values
-    df = df.pipe(add_prev_progress_rate)
-    df = df.pipe(add_prev_pct_change)
+@memoize.stage
+def add_lifter_features(input_lf: pl.LazyFrame, transforms: list[str] | None = None) -> pl.LazyFrame:
+    """
+    Features computed from each lifter's own history (or the row alone), the selected transforms only when given (see features.resolve).
+    A lifter only needs its own rows.
+    """
+    return features.apply(input_lf.rename(conf.base_renamed_columns).pipe(widen_floats), LIFTER_TRANSFORMS, transforms).pipe(narrow_floats)
+
+
+@memoize.stage
+def add_segment_features(lf: pl.LazyFrame, transforms: list[str] | None = None) -> pl.LazyFrame:
+    "Expanding and ranking features over each segment, which change whenever any row of the segment does"
+    return features.apply(lf.pipe(widen_floats), SEGMENT_TRANSFORMS, transforms).pipe(narrow_floats)
+
+
+def add_rating_features(lf: pl.LazyFrame, transforms: list[str] | None = None) -> pl.LazyFrame:
+    "Elo, Glicko-2 and the features built on them, replays of every meet in date order"
+    return features.apply(lf.pipe(widen_floats), RATING_TRANSFORMS, transforms).pipe(narrow_floats)
+
+
+def plan_base(raw_lf: pl.LazyFrame, columns: list[str] | None = None) -> pl.LazyFrame:
+    """
+    Lazy plan of the base layer. With columns, only the transforms they need run (see features.resolve),
+    and the plan has the base input columns and the columns of those transforms.
+    """
+    transforms = None if columns is None else features.resolve(BASE_TRANSFORMS, BASE_INPUT_COLUMNS, columns)
+    return select_base_input(raw_lf).pipe(add_lifter_features, transforms).pipe(add_segment_features, transforms).pipe(add_rating_features, transforms)
 
-    common_io.io_write_from_local_to_s3(
-        df,
-        conf.base_local_file_path,
-        conf.base_s3_key,
+
+def build_base(raw_lf: pl.LazyFrame, columns: list[str] | None = None) -> pl.DataFrame:
+    "Transforms the raw layer into the base layer, as a single lazy plan collected once, see plan_base"
+    return plan_base(raw_lf, columns).collect()
+
+
+# --- Incremental builds ---
+
+
+def find_touched_lifters(input_df: pl.DataFrame, previous_input_df: pl.DataFrame) -> pl.Series:
+    "Lifter IDs with new, changed or removed rows between two base inputs"
+    row_hash = pl.struct(conf.base_columns).hash().alias("row_hash")
+    rows = input_df.select("lifter_id", row_hash)
+    previous_rows = previous_input_df.select("lifter_id", row_hash)
+
+    changed = pl.concat(
+        [
+            rows.join(previous_rows, on=["lifter_id", "row_hash"], how="anti"),
+            previous_rows.join(rows, on=["lifter_id", "row_hash"], how="anti"),
+        ]
     )
+    return changed["lifter_id"].unique()
+
+
+def build_base_incremental(
+    input_df: pl.DataFrame, previous_input_df: pl.DataFrame, previous_base_df: pl.DataFrame, elo_state_df: pl.DataFrame | None = None, glicko_state_df: pl.DataFrame | None = None
+) -> pl.DataFrame:
+    """
+    Updates the previous base layer to a new base input (see select_base_input), producing the same output as a full build.
+    - Lifter features are recomputed only for lifters with new or changed rows, including a changed identity confidence
+      when a lifter of the same name changes (see identity.py), the rows of every other lifter are reused from the
+      previous base layer.
+    - Segment features are recomputed for the segments those lifters have rows in, before or after the update.
+    - Elo is a replay of every meet in date order: from the latest checkpoint of elo_state_df (see elo.rating_checkpoints)
+      still valid for the new rows when given, otherwise from the first meet. Glicko-2 likewise from glicko_state_df
+      (see glicko.rating_checkpoints), period by period.
+    """
+    base_schema = plan_base(input_df.clear().lazy()).collect_schema()
+    if dict(previous_base_df.schema) != dict(base_schema):
+        logging.info("The previous base layer has a different schema, building it in full")
+        return build_base(input_df.lazy())
+
+    affected = find_touched_lifters(input_df, previous_input_df)
+    logging.info(f"Recomputing {len(affected)} of {input_df['lifter_id'].n_unique()} lifters")
+    if len(affected) == 0:
+        return previous_base_df.select(base_schema.names())
+
+    affected_df = affected.to_frame("lifter_id")
+    lifter_df = add_lifter_features(input_df.lazy().join(affected_df.lazy(), on="lifter_id", how="semi")).collect()
+    lifter_columns = lifter_df.columns
+
+    kept_df = previous_base_df.join(affected_df, on="lifter_id", how="anti")
+    affected_segments = pl.concat(
+        [
+            lifter_df.select(SEGMENT_COLUMNS),
+            previous_base_df.join(affected_df, on="lifter_id", how="semi").select(SEGMENT_COLUMNS),
+        ]
+    ).unique()
+
+    segment_lf = pl.concat(
+        [
+            kept_df.join(affected_segments, on=SEGMENT_COLUMNS, how="semi", nulls_equal=True).select(lifter_columns).lazy(),
+            lifter_df.lazy(),
+        ]
+    ).pipe(add_segment_features)
+    unaffected_segment_lf = kept_df.join(affected_segments, on=SEGMENT_COLUMNS, how="anti", nulls_equal=True).select(lifter_columns + SEGMENT_FEATURE_COLUMNS).lazy()
+
+    base_lf = pl.concat([segment_lf, unaffected_segment_lf]).pipe(order_by_lifter_and_date)
+    elo_lf = base_lf.pipe(add_elo_rating) if elo_state_df is None else base_lf.pipe(resume_elo_rating, elo_state_df, previous_base_df)
+    glicko_lf = elo_lf.pipe(add_glicko_rating) if glicko_state_df is None else elo_lf.pipe(resume_glicko_rating, glicko_state_df, previous_base_df)
+    base_lf = glicko_lf.pipe(widen_floats).pipe(add_interaction_features).pipe(add_elo_gap_vs_field).pipe(narrow_floats)
+    return base_lf.select(base_schema.names()).collect()
+
+
+def verify_incremental(base_df: pl.DataFrame, input_df: pl.DataFrame) -> None:
+    "Checks an incremental build against a full rebuild from the same input, raises AssertionError on any difference"
+    full_df = build_base(input_df.lazy())
+    assert_frame_equal(base_df.sort(conf.base_sort_columns), full_df.sort(conf.base_sort_columns))
+    logging.info("Incremental base layer matches a full rebuild")
+
+
+def read_previous_base() -> tuple[pl.DataFrame, pl.DataFrame] | None:
+    """
+    Reads the previous base input and base layer, the local copies when both exist, otherwise S3.
+
+    Returns:
+        tuple[pl.DataFrame, pl.DataFrame] | None: (previous input, previous base), None when either is missing.
+    """
+    if Path(conf.base_input_snapshot_local_file_path).exists() and Path(conf.base_local_file_path).exists():
+        sources = (conf.base_input_snapshot_local_file_path, conf.base_local_file_path)
+    else:
+        sources = (conf.base_input_snapshot_s3_http, conf.base_s3_http)
+
+    try:
+        return pl.read_parquet(sources[0]), pl.read_parquet(sources[1])
+    except (OSError, pl.exceptions.PolarsError) as e:
+        logging.info(f"No previous base layer to update ({e})")
+        return None
+
+
+def read_rating_state(local_file_path: str, s3_http: str) -> pl.DataFrame | None:
+    "Reads rating checkpoints of the previous build (see elo.rating_checkpoints, glicko.rating_checkpoints), the local copy when it exists, otherwise S3"
+    source = local_file_path if Path(local_file_path).exists() else s3_http
+    try:
+        return pl.read_parquet(source)
+    except (OSError, pl.exceptions.PolarsError) as e:
+        logging.info(f"No rating checkpoints to resume from ({e})")
+        return None
+
+
+def run(raw_df: pl.DataFrame | None = None, incremental: bool = conf.BASE_INCREMENTAL, verify: bool = False) -> pl.DataFrame:
+    """
+    Builds the base layer and persists it in the background.
+    Raw is read from S3 unless it is handed in by an upstream stage.
+    Incremental builds update the previous base layer, and also persist the input it was built from and its rating checkpoints for the next one.
+    The base layer is also written to the local feature store (see feature_groups), where training reads it from.
+    """
+    raw_lf = scan_raw() if raw_df is None else raw_df.lazy()
+
+    if not incremental:
+        base_df = build_base(raw_lf)
+        common_io.io_write_to_s3_in_background(base_df, conf.base_local_file_path, conf.base_s3_key)
+        common_io.io_run_in_background(feature_store.write, base_df, feature_groups(base_df.columns))
+        return base_df
+
+    input_df = select_base_input(raw_lf).collect()
+    previous = read_previous_base()
+    glicko_state_df = None if previous is None else read_rating_state(conf.glicko_state_local_file_path, conf.glicko_state_s3_http)
+    if previous is None:
+        logging.info("Building the base layer in full")
+        base_df = build_base(input_df.lazy())
+    else:
+        base_df = build_base_incremental(
+            input_df,
+            *previous,
+            elo_state_df=read_rating_state(conf.elo_state_local_file_path, conf.elo_state_s3_http),
+            glicko_state_df=glicko_state_df,
+        )
+
+    if verify:
+        verify_incremental(base_df, input_df)
+
+    common_io.io_write_to_s3_in_background(base_df, conf.base_local_file_path, conf.base_s3_key)
+    common_io.io_run_in_background(feature_store.write, base_df, feature_groups(base_df.columns))
+    common_io.io_write_to_s3_in_background(input_df, conf.base_input_snapshot_local_file_path, conf.base_input_snapshot_s3_key)
+    common_io.io_write_to_s3_in_background(elo.rating_checkpoints(base_df), conf.elo_state_local_file_path, conf.elo_state_s3_key)
+    common_io.io_write_to_s3_in_background(glicko.rating_checkpoints(base_df, glicko_state_df), conf.glicko_state_local_file_path, conf.glicko_state_s3_key)
+
+    return base_df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the base layer")
+    parser.add_argument("--incremental", action="store_true", default=conf.BASE_INCREMENTAL, help="only recompute lifters changed since the previous build")
+    parser.add_argument("--verify", action="store_true", help="check the incremental build against a full rebuild")
+    args = parser.parse_args()
+
+    run(incremental=args.incremental or args.verify, verify=args.verify)
+    common_io.io_wait_for_uploads()
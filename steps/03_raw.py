@@ -1,30 +1,47 @@
 import logging
+from pathlib import Path
 
 import common_io
 import conf
+import identity
+import memoize
 import polars as pl
+import polars.selectors as cs
+
+
+def scan_landing() -> pl.LazyFrame:
+    "Lazily reads the landing layer, from the hive-partitioned dataset when conf.PARTITIONED_LAYOUT is set"
+    if conf.PARTITIONED_LAYOUT:
+        return pl.scan_parquet(
+            conf.landing_partitioned_s3_uri,
+            hive_partitioning=True,
+            hive_schema=conf.landing_partition_schema,
+            storage_options=conf.s3_storage_options,
+        )
+    return pl.scan_parquet(conf.landing_s3_http)
 
 
 @conf.debug
-def filter_non_numeric_place(df: pl.DataFrame) -> pl.DataFrame:
+def filter_non_numeric_place(df: pl.LazyFrame) -> pl.LazyFrame:
     return df.filter(pl.col("place").str.contains(r"^\d+$"))
 
 
 @conf.debug
-def type_cast(df: pl.DataFrame) -> pl.DataFrame:
+def type_cast(df: pl.LazyFrame) -> pl.LazyFrame:
     return df.with_columns(
         pl.col("date").str.strptime(pl.Date, "%Y-%m-%d").alias("date"),
-        pl.col("place").cast(pl.Int64).alias("place"),
+        pl.col("place").cast(pl.Int32).alias("place"),
     )
 
 
 @conf.debug
-def to_lowercase(df: pl.DataFrame) -> pl.DataFrame:
+def to_lowercase(df: pl.LazyFrame) -> pl.LazyFrame:
     "In place modification of column values to lowercase"
     return df.with_columns(pl.col("meet_name").str.to_lowercase())
 
 
-def add_age_rounded_up_half(df: pl.DataFrame) -> pl.DataFrame:
+@conf.debug
+def add_age_rounded_up_half(df: pl.LazyFrame) -> pl.LazyFrame:
     """
     Rounds ages ending in .0 to up to the next 0.5 year.
     Used that to calculate year of birth
@@ -33,12 +50,12 @@ def add_age_rounded_up_half(df: pl.DataFrame) -> pl.DataFrame:
 
 
 @conf.debug
-def add_event_year(df: pl.DataFrame) -> pl.DataFrame:
+def add_event_year(df: pl.LazyFrame) -> pl.LazyFrame:
     return df.with_columns((pl.col("date").dt.strftime("%Y").cast(pl.Int32)).alias("event_year"))
 
 
 @conf.debug
-def add_birth_year(df: pl.DataFrame) -> pl.DataFrame:
+def add_birth_year(df: pl.LazyFrame) -> pl.LazyFrame:
     """
     Edge cases exist when the age ends in .0, so we round down to the nearest 0.5 year
     Test cases:
@@ -58,63 +75,63 @@ def add_birth_year(df: pl.DataFrame) -> pl.DataFrame:
 
 
 @conf.debug
-def add_primary_key(df: pl.DataFrame) -> pl.DataFrame:
+def add_primary_key(df: pl.LazyFrame) -> pl.LazyFrame:
     """
-    Primary key column is snake case of name plus year of birth
+    Primary key of the lifter of each row: snake case of name, sex and year of birth, resolved from every row of the
+    same name and sex, with the confidence of the resolution (see identity.py)
     Deduplicate on primary key, date, and meet name
-
-    Test case:
-    - Elizabeth Nguyen for three different lifters
     """
-    logging.info("Creating primary key")
-    primary_key_df = df.with_columns(
-        pl.concat_str(
-            [
-                pl.col("name").str.to_lowercase().str.replace(" ", "-"),
-                pl.col("sex").str.to_lowercase(),
-                pl.col("birth_year").cast(pl.Utf8),
-            ],
-            separator="-",
-        ).alias("primary_key")
-    )
+    logging.info("Resolving lifter identities")
+    # No sort here: deduplication and origin country do not depend on the row order, and the layer is sorted once
+    # for row-group pruning at the end
+    schema = df.collect_schema()
+    schema.update({"primary_key": pl.Utf8, "identity_confidence": pl.Float64})
+    return df.map_batches(lambda batch: batch.hstack(identity.resolve_identities(batch)), schema=schema, streamable=False)
 
-    # Sort by primary key and date descending
-    # Records need to be sorted to ensure that the origin country is the first country that the lifter competed in
-    primary_key_df_sorted = primary_key_df.sort(by=["primary_key", "date"], descending=[False, False])
 
-    return primary_key_df_sorted
-
-
-def filter_for_unique_primary_key(df: pl.DataFrame) -> pl.DataFrame:
-    return df.unique(subset=["primary_key", "date", "meet_name"])
+@conf.debug
+def filter_for_unique_primary_key(df: pl.LazyFrame) -> pl.LazyFrame:
+    # Of the rows sharing a primary key, date and meet name, the first in landing order is kept. Before the sort by
+    # primary key and date was dropped, it was whichever of them that (unstable) sort placed first
+    return df.unique(subset=["primary_key", "date", "meet_name"], keep="first", maintain_order=True)
 
 
 @conf.debug
-def create_origin_country_df(df: pl.DataFrame) -> pl.DataFrame:
-    lifter_country_df = df.group_by(["primary_key"]).agg(pl.first("meet_country").alias("origin_country"))
+def create_origin_country_df(df: pl.LazyFrame) -> pl.LazyFrame:
+    # Country of the first meet, in landing order among meets on the same date
+    lifter_country_df = df.group_by(["primary_key"]).agg(pl.col("meet_country").get(pl.col("date").arg_min()).alias("origin_country"))
     return lifter_country_df
 
 
 @conf.debug
-def add_origin_country(df: pl.DataFrame, lifter_country_df: pl.DataFrame) -> pl.DataFrame:
-    logging.info(f"Row count (df): {len(df)}")
-    logging.info(f"Row count (lifter_country_df): {len(lifter_country_df)}")
+def add_origin_country(df: pl.LazyFrame, lifter_country_df: pl.LazyFrame) -> pl.LazyFrame:
+    # One row per primary key on the right, so the left join keeps the row count
     return df.join(lifter_country_df, on="primary_key", how="left")
 
 
-def test_counts(df_1, df_2):
-    logging.info(f"Row count (df_1): {len(df_1)}")
-    logging.info(f"Row count (df_2): {len(df_2)}")
-    assert len(df_1) == len(df_2)
+@conf.debug
+def encode_dtypes(df: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Enums and categoricals for the low-cardinality columns (conf.raw_enum_dtypes, conf.raw_categorical_columns),
+    whose values are stored once in a shared dictionary, and Float32 for the measurements, recorded to the 0.01 kg.
+    """
+    return df.with_columns(
+        *(pl.col(column).cast(dtype) for column, dtype in conf.raw_enum_dtypes.items()),
+        cs.by_name(conf.raw_categorical_columns, require_all=False).cast(pl.Categorical),
+        cs.float().cast(pl.Float32),
+    )
+
 
+@conf.debug
+def order_for_row_group_pruning(df: pl.LazyFrame) -> pl.LazyFrame:
+    "Clusters rows by the columns downstream filters use, so parquet row-group statistics can skip them"
+    return df.sort(by=conf.raw_sort_columns)
 
-if __name__ == "__main__":
-    logging.info("Loading data from S3")
-    logging.info(f"Source: {conf.landing_s3_http}")
 
-    df = (
-        pl.read_parquet(source=conf.landing_s3_http)
-        .pipe(filter_non_numeric_place)
+@memoize.stage
+def plan_raw(landing_lf: pl.LazyFrame) -> pl.LazyFrame:
+    lf = (
+        landing_lf.pipe(filter_non_numeric_place)
         .pipe(type_cast)
         .pipe(to_lowercase)
         .pipe(add_event_year)
@@ -124,13 +141,85 @@ if __name__ == "__main__":
         .pipe(filter_for_unique_primary_key)
     )
 
-    # Origin country requires a self-join, breaks the chain
-    lifter_country_df = create_origin_country_df(df)
-    raw_df = add_origin_country(df, lifter_country_df)
-    test_counts(raw_df, df)
+    # Origin country is a self-join on the same plan, polars computes the shared input once
+    lifter_country_lf = create_origin_country_df(lf)
+    raw_lf = add_origin_country(lf, lifter_country_lf)
+
+    return raw_lf.pipe(encode_dtypes).pipe(order_for_row_group_pruning)
+
 
-    common_io.io_write_from_local_to_s3(
+def assign_lifter_ids(primary_keys: pl.Series, lifter_ids_df: pl.DataFrame | None = None) -> pl.DataFrame:
+    """
+    Lifter ID lookup (conf.lifter_ids_schema) of the primary keys, starting from the lookup of the previous build when given:
+    its IDs are kept, new primary keys get the next IDs in key order. The IDs of primary keys no longer in the data
+    are not reused, so an ID names the same lifter in every build.
+    """
+    if lifter_ids_df is None:
+        lifter_ids_df = pl.DataFrame(schema=conf.lifter_ids_schema)
+    next_id = 0 if lifter_ids_df.is_empty() else lifter_ids_df["lifter_id"].max() + 1
+    new_keys_df = primary_keys.drop_nulls().unique().sort().to_frame("primary_key").join(lifter_ids_df, on="primary_key", how="anti", maintain_order="left")
+    new_ids_df = new_keys_df.with_columns((pl.int_range(pl.len(), dtype=pl.UInt32) + next_id).alias("lifter_id"))
+    return pl.concat([lifter_ids_df, new_ids_df]).cast(conf.lifter_ids_schema)
+
+
+def add_lifter_id(raw_df: pl.DataFrame, lifter_ids_df: pl.DataFrame) -> pl.DataFrame:
+    # One row per primary key on the right, so the left join keeps the row count and the row order
+    return raw_df.join(lifter_ids_df, on="primary_key", how="left", maintain_order="left")
+
+
+def build_raw(landing_lf: pl.LazyFrame, lifter_ids_df: pl.DataFrame | None = None) -> pl.DataFrame:
+    """
+    Transforms the landing layer into the raw layer, as a single lazy plan collected once.
+    Lifter IDs are assigned from the lookup of the previous build when given, see assign_lifter_ids.
+    """
+    raw_df = plan_raw(landing_lf).collect()
+    return add_lifter_id(raw_df, assign_lifter_ids(raw_df["primary_key"], lifter_ids_df))
+
+
+def read_lifter_ids() -> pl.DataFrame | None:
+    "Reads the lifter ID lookup of the previous build, the local copy when it exists, otherwise S3"
+    source = conf.lifter_ids_local_file_path if Path(conf.lifter_ids_local_file_path).exists() else conf.lifter_ids_s3_http
+    try:
+        return pl.read_parquet(source)
+    except (OSError, pl.exceptions.PolarsError) as e:
+        logging.info(f"No lifter IDs to keep, assigning them from scratch ({e})")
+        return None
+
+
+def run(landing_lf: pl.LazyFrame | None = None) -> pl.DataFrame:
+    """
+    Builds the raw layer and persists it and the lifter ID lookup in the background.
+    Landing is read from S3 unless it is handed in by an upstream stage.
+    """
+    if landing_lf is None:
+        logging.info("Loading data from S3")
+        logging.info(f"Source: {conf.landing_partitioned_s3_uri if conf.PARTITIONED_LAYOUT else conf.landing_s3_http}")
+        landing_lf = scan_landing()
+
+    previous_lifter_ids_df = read_lifter_ids()
+    raw_df = build_raw(landing_lf, previous_lifter_ids_df)
+
+    common_io.io_write_to_s3_in_background(
         raw_df,
         conf.raw_local_file_path,
         conf.raw_s3_key,
+        row_group_size=conf.RAW_ROW_GROUP_SIZE,
     )
+    # Same assignment as the one of build_raw, the lookup also keeps the primary keys no longer in the data
+    common_io.io_write_to_s3_in_background(assign_lifter_ids(raw_df["primary_key"], previous_lifter_ids_df), conf.lifter_ids_local_file_path, conf.lifter_ids_s3_key)
+
+    if conf.PARTITIONED_LAYOUT:
+        common_io.io_run_in_background(
+            common_io.io_write_partitioned_from_local_to_s3,
+            raw_df,
+            conf.raw_partitioned_local_path,
+            conf.raw_partitioned_s3_key,
+            list(conf.raw_partition_schema),
+        )
+
+    return raw_df
+
+
+if __name__ == "__main__":
+    run()
+    common_io.io_wait_for_uploads()
@@ -132,15 +132,15 @@ def wilks_trajectory(df: pl.DataFrame) -> pl.DataFrame:
 def survival_analysis(df: pl.DataFrame) -> pl.DataFrame:
     """Fraction of lifters reaching total milestones by competition N."""
     filtered = _base_filter(df).filter(pl.col("cumulative_comps") <= conf.MAX_CUMULATIVE_COMPS_FOR_INDEXING)
-    filtered = filtered.with_columns(pl.col("total").cum_max().over("primary_key").alias("best_total_so_far"))
+    filtered = filtered.with_columns(pl.col("total").cum_max().over("lifter_id").alias("best_total_so_far"))
 
     results = []
     for sex, milestones in [("M", conf.SURVIVAL_MILESTONES_M), ("F", conf.SURVIVAL_MILESTONES_F)]:
         sex_df = filtered.filter(pl.col("sex") == sex)
-        total_lifters = sex_df.group_by("ipf_weight_class").agg(pl.col("primary_key").n_unique().alias("total_lifters"))
+        total_lifters = sex_df.group_by("ipf_weight_class").agg(pl.col("lifter_id").n_unique().alias("total_lifters"))
 
         for milestone in milestones:
-            reached = sex_df.filter(pl.col("best_total_so_far") >= milestone).group_by(["ipf_weight_class", "cumulative_comps"]).agg(pl.col("primary_key").n_unique().alias("lifters_reached"))
+            reached = sex_df.filter(pl.col("best_total_so_far") >= milestone).group_by(["ipf_weight_class", "cumulative_comps"]).agg(pl.col("lifter_id").n_unique().alias("lifters_reached"))
             # Cumulative: at comp N, count all who reached by comp N or earlier
             reached = reached.sort(["ipf_weight_class", "cumulative_comps"]).with_columns(pl.col("lifters_reached").cum_max().over("ipf_weight_class").alias("lifters_reached"))
             reached = reached.join(total_lifters, on="ipf_weight_class").with_columns(
@@ -157,7 +157,7 @@ def archetype_clustering(df: pl.DataFrame) -> tuple[pl.DataFrame, pl.DataFrame]:
     """Cluster lifters into archetypes based on career summary features."""
     filtered = _base_filter(df)
     career = (
-        filtered.group_by("primary_key")
+        filtered.group_by("lifter_id")
         .agg(
             pl.col("sex").first().alias("sex"),
             pl.col("cumulative_comps").max().alias("total_comps"),
@@ -190,41 +190,50 @@ def archetype_clustering(df: pl.DataFrame) -> tuple[pl.DataFrame, pl.DataFrame]:
     return archetypes, centroids_df
 
 
-if __name__ == "__main__":
-    logging.info("Loading base data")
-    df = pl.read_parquet(conf.base_local_file_path)
+def run(df: pl.DataFrame | None = None) -> None:
+    """
+    Computes the analyses and persists them in the background.
+    The base layer is read from local disk unless it is handed in by an upstream stage.
+    """
+    if df is None:
+        logging.info("Loading base data")
+        df = pl.read_parquet(conf.base_local_file_path)
 
     logging.info("=== Career Trajectory ===")
     ct = career_trajectory(df)
-    common_io.io_write_from_local_to_s3(ct, conf.analysis_career_trajectory_local, conf.analysis_career_trajectory_s3_key)
+    common_io.io_write_to_s3_in_background(ct, conf.analysis_career_trajectory_local, conf.analysis_career_trajectory_s3_key)
 
     logging.info("=== Competition-Indexed Growth ===")
     cig = comp_indexed_growth(df)
-    common_io.io_write_from_local_to_s3(cig, conf.analysis_comp_indexed_growth_local, conf.analysis_comp_indexed_growth_s3_key)
+    common_io.io_write_to_s3_in_background(cig, conf.analysis_comp_indexed_growth_local, conf.analysis_comp_indexed_growth_s3_key)
 
     logging.info("=== Percentile Rank Movement ===")
     pm = percentile_movement(df)
-    common_io.io_write_from_local_to_s3(pm, conf.analysis_percentile_movement_local, conf.analysis_percentile_movement_s3_key)
+    common_io.io_write_to_s3_in_background(pm, conf.analysis_percentile_movement_local, conf.analysis_percentile_movement_s3_key)
 
     logging.info("=== Rolling Average Summary ===")
     ras = rolling_average_summary(df)
-    common_io.io_write_from_local_to_s3(ras, conf.analysis_rolling_averages_local, conf.analysis_rolling_averages_s3_key)
+    common_io.io_write_to_s3_in_background(ras, conf.analysis_rolling_averages_local, conf.analysis_rolling_averages_s3_key)
 
     logging.info("=== Lift Ratio Analysis ===")
     lra = lift_ratio_analysis(df)
-    common_io.io_write_from_local_to_s3(lra, conf.analysis_lift_ratios_local, conf.analysis_lift_ratios_s3_key)
+    common_io.io_write_to_s3_in_background(lra, conf.analysis_lift_ratios_local, conf.analysis_lift_ratios_s3_key)
 
     logging.info("=== Wilks Trajectory ===")
     wt = wilks_trajectory(df)
-    common_io.io_write_from_local_to_s3(wt, conf.analysis_wilks_trajectory_local, conf.analysis_wilks_trajectory_s3_key)
+    common_io.io_write_to_s3_in_background(wt, conf.analysis_wilks_trajectory_local, conf.analysis_wilks_trajectory_s3_key)
 
     logging.info("=== Survival Analysis ===")
     sa = survival_analysis(df)
-    common_io.io_write_from_local_to_s3(sa, conf.analysis_survival_local, conf.analysis_survival_s3_key)
+    common_io.io_write_to_s3_in_background(sa, conf.analysis_survival_local, conf.analysis_survival_s3_key)
 
     logging.info("=== Lifter Archetype Clustering ===")
     archetypes, centroids = archetype_clustering(df)
-    common_io.io_write_from_local_to_s3(archetypes, conf.analysis_archetypes_local, conf.analysis_archetypes_s3_key)
-    common_io.io_write_from_local_to_s3(centroids, conf.analysis_archetype_centroids_local, conf.analysis_archetype_centroids_s3_key)
+    common_io.io_write_to_s3_in_background(archetypes, conf.analysis_archetypes_local, conf.analysis_archetypes_s3_key)
+    common_io.io_write_to_s3_in_background(centroids, conf.analysis_archetype_centroids_local, conf.analysis_archetype_centroids_s3_key)
+
 
+if __name__ == "__main__":
+    run()
+    common_io.io_wait_for_uploads()
     logging.info("All analyses written successfully")
@@ -71,10 +71,10 @@ def progress_by_sex_weight_class_and_experience(df: pl.DataFrame) -> pl.DataFram
 
 def data_quality_report(df: pl.DataFrame) -> pl.DataFrame:
     total_records = len(df)
-    unique_lifters = df["primary_key"].n_unique()
+    unique_lifters = df["lifter_id"].n_unique()
     date_min = df["date"].min()
     date_max = df["date"].max()
-    mean_comps = df.group_by("primary_key").len().select(pl.col("len").mean().alias("mean_comps_per_lifter"))
+    mean_comps = df.group_by("lifter_id").len().select(pl.col("len").mean().alias("mean_comps_per_lifter"))
 
     null_rates = {col: df[col].null_count() / total_records for col in df.columns}
     high_null_cols = {k: round(v, 4) for k, v in null_rates.items() if v > 0.01}
@@ -102,30 +102,38 @@ def data_quality_report(df: pl.DataFrame) -> pl.DataFrame:
     return report
 
 
-if __name__ == "__main__":
-    logging.info("Loading base data")
-    df = pl.read_parquet(conf.base_local_file_path)
+def run(df: pl.DataFrame | None = None) -> None:
+    """
+    Computes the summary tables and persists them in the background.
+    The base layer is read from local disk unless it is handed in by an upstream stage.
+    """
+    if df is None:
+        logging.info("Loading base data")
+        df = pl.read_parquet(conf.base_local_file_path)
 
+    # Each summary table is written locally + uploaded to S3 in the background while the next one is computed
     logging.info("=== Data Quality Report ===")
     quality = data_quality_report(df)
     logging.info("\n%s", quality)
+    common_io.io_write_to_s3_in_background(quality, conf.describe_quality_local, conf.describe_quality_s3_key)
 
     logging.info("=== Progress by Sex & Weight Class ===")
     by_weight = progress_by_sex_and_weight_class(df)
     logging.info("\n%s", by_weight)
+    common_io.io_write_to_s3_in_background(by_weight, conf.describe_by_weight_class_local, conf.describe_by_weight_class_s3_key)
 
     logging.info("=== Progress by Experience Level ===")
     by_experience = progress_by_experience_level(df)
     logging.info("\n%s", by_experience)
+    common_io.io_write_to_s3_in_background(by_experience, conf.describe_by_experience_local, conf.describe_by_experience_s3_key)
 
     logging.info("=== Progress by Sex, Weight Class & Experience ===")
     by_sex_wc_exp = progress_by_sex_weight_class_and_experience(df)
     logging.info("\n%s", by_sex_wc_exp)
+    common_io.io_write_to_s3_in_background(by_sex_wc_exp, conf.describe_by_sex_wc_exp_local, conf.describe_by_sex_wc_exp_s3_key)
 
-    # Write summary tables locally + upload to S3
-    common_io.io_write_from_local_to_s3(by_weight, conf.describe_by_weight_class_local, conf.describe_by_weight_class_s3_key)
-    common_io.io_write_from_local_to_s3(by_experience, conf.describe_by_experience_local, conf.describe_by_experience_s3_key)
-    common_io.io_write_from_local_to_s3(by_sex_wc_exp, conf.describe_by_sex_wc_exp_local, conf.describe_by_sex_wc_exp_s3_key)
-    common_io.io_write_from_local_to_s3(quality, conf.describe_quality_local, conf.describe_quality_s3_key)
 
+if __name__ == "__main__":
+    run()
+    common_io.io_wait_for_uploads()
     logging.info("Descriptive statistics written to %s", conf.base_local_file_path.rsplit("/", 1)[0])
@@ -2,12 +2,17 @@
 Machine Learning Training
 """
 
+import argparse
+import importlib
 import logging
 import math
 import os
 from datetime import datetime
+from functools import partial
 
 import conf
+import feature_set
+import feature_store
 import matplotlib.pyplot as plt
 import mlflow
 import numpy as np
@@ -30,6 +35,8 @@ os.environ["AWS_ACCESS_KEY_ID"] = os.environ.get("MINIO_ROOT_USER")
 os.environ["AWS_SECRET_ACCESS_KEY"] = os.environ.get("MINIO_ROOT_PASSWORD")
 
 MAX_TRIALS = 500
+RANDOM_SEED = 7
+columns_to_exclude = ["name", "date", feature_set.TARGET]
 
 
 # override Optuna's default logging to ERROR only
@@ -85,7 +92,7 @@ def champion_callback(study, frozen_trial):
             logging.info(f"Initial trial {frozen_trial.number} achieved value: {frozen_trial.value}")
 
 
-def objective(trial):
+def objective(trial, dtrain: xgb.DMatrix, dval: xgb.DMatrix, y_val: pd.DataFrame):
     trial_name = f"trial_{trial.number:03d}"
     with mlflow.start_run(nested=True, run_name=trial_name):
         params = {
@@ -200,100 +207,28 @@ def plot_residuals(model, dvalid, valid_y, save_path=None):
     return fig
 
 
-if __name__ == "__main__":
-    RANDOM_SEED = 7
-    FEATURE_SET_VERSION = 8
-    TARGET = "pct_change_total"
-    columns_to_exclude = ["name", "date", TARGET]
-
-    # Load data
-    logging.info("Loading data")
-    base_df = pl.read_parquet(conf.base_local_file_path)
-
+def prepare_modelling_df(base_df: pl.DataFrame) -> pl.DataFrame:
+    "Filters and winsorizes the base layer, then encodes it into the modelling columns (see feature_set.modelling_features)"
     # Filter: drop rows without progress (first comp per lifter)
-    base_df = base_df.filter(pl.col(TARGET).is_not_null() & pl.col(TARGET).is_finite())
+    base_df = base_df.filter(pl.col(feature_set.TARGET).is_not_null() & pl.col(feature_set.TARGET).is_finite())
 
     # Tighter time gap filter: require >= 55 days between comps for reliable progress rates
     base_df = base_df.filter(pl.col("time_since_last_comp_years") >= 0.15)
 
     # Winsorize target to p1/p99 instead of hard clip — reduces outlier influence while keeping data
-    p1 = base_df[TARGET].quantile(0.01)
-    p99 = base_df[TARGET].quantile(0.99)
-    base_df = base_df.with_columns(pl.col(TARGET).clip(p1, p99))
-
-    # Encode categoricals as numeric features
-    AGE_CLASS_MAP = {
-        "5-12": 9.0,
-        "13-15": 14.0,
-        "16-17": 16.5,
-        "18-19": 18.5,
-        "20-23": 21.5,
-        "24-34": 29.0,
-        "35-39": 37.0,
-        "40-44": 42.0,
-        "45-49": 47.0,
-        "50-54": 52.0,
-        "55-59": 57.0,
-        "60-64": 62.0,
-        "65-69": 67.0,
-        "70-74": 72.0,
-        "75-79": 77.0,
-        "80-999": 85.0,
-    }
-    base_df = base_df.with_columns(
-        pl.col("sex").replace_strict({"M": 1, "F": 0, "Mx": 0}, return_dtype=pl.Int32).alias("sex_encoded"),
-        pl.col("age_class").replace_strict(AGE_CLASS_MAP, return_dtype=pl.Float64).alias("age_class_encoded"),
-        pl.col("ipf_weight_class").str.replace(r"\+", "").str.replace("unknown", "0").cast(pl.Float64).alias("ipf_wc_numeric"),
-        pl.col("is_origin_country").cast(pl.Int32).alias("is_origin_country_int"),
-    )
+    p1 = base_df[feature_set.TARGET].quantile(0.01)
+    p99 = base_df[feature_set.TARGET].quantile(0.99)
+    base_df = base_df.with_columns(pl.col(feature_set.TARGET).clip(p1, p99))
+
+    return feature_set.modelling_features(base_df)
+
 
-    modelling_cols = [
-        "name",
-        "date",
-        "bodyweight",
-        "age_class_encoded",
-        "sex_encoded",
-        "ipf_wc_numeric",
-        "parent_federation",
-        "time_since_last_comp_years",
-        "bodyweight_change",
-        "cumulative_comps",
-        "tenure",
-        "is_origin_country_int",
-        "prev_total_percentile_rank",
-        "prev_total_per_bw",
-        "segment_mean_total",
-        "previous_squat",
-        "previous_bench",
-        "previous_deadlift",
-        "previous_total",
-        "previous_wilks",
-        "elo_rating",
-        "elo_change",
-        # v6: high-impact features
-        "prev_distance_from_pb",
-        "prev_total_progress",
-        "prev_avg_progress_3",
-        "comps_per_year",
-        "prev_rolling_std_total_3",
-        "approx_age",
-        "abs_years_from_peak_age",
-        "prev_total_change_kg",
-        # v7: interaction features
-        "prev_total_x_time_gap",
-        "prev_total_per_comp",
-        # v8: new features
-        "log_cumulative_comps",
-        "years_competing",
-        "prev_pct_change",
-        "time_gap_category",
-        TARGET,
-    ]
-
-    modelling_df = base_df.select(modelling_cols)
+def train(base_df: pl.DataFrame, feature_group_versions: dict[str, str] | None = None) -> None:
+    "Tunes, trains and evaluates the XGBoost model on the base layer, logging everything to MLflow with the feature store groups it was read from"
+    modelling_df = prepare_modelling_df(base_df)
 
     # Namings
-    run_name = f"pct_change_total_v{FEATURE_SET_VERSION}"
+    run_name = f"pct_change_total_v{feature_set.FEATURE_SET_VERSION}"
     today_date = datetime.today().strftime("%Y-%m-%d")
     experiment_id = get_or_create_experiment(today_date)
 
@@ -323,7 +258,7 @@ if __name__ == "__main__":
         X = df.select(pl.exclude(columns_to_exclude)).to_pandas()
         for col in X.select_dtypes(include="object").columns:
             X[col] = X[col].astype("category")
-        y = df.select([TARGET]).to_pandas()
+        y = df.select([feature_set.TARGET]).to_pandas()
         return X, y
 
     X_train, y_train = prepare_Xy(train_df)
@@ -347,7 +282,7 @@ if __name__ == "__main__":
         study = optuna.create_study(direction="minimize", pruner=optuna.pruners.MedianPruner(n_warmup_steps=50))
 
         # Execute the hyperparameter optimization trials.
-        study.optimize(objective, n_trials=MAX_TRIALS, callbacks=[champion_callback])
+        study.optimize(partial(objective, dtrain=dtrain, dval=dval, y_val=y_val), n_trials=MAX_TRIALS, callbacks=[champion_callback])
 
         n_pruned = len([t for t in study.trials if t.state == optuna.trial.TrialState.PRUNED])
         n_complete = len([t for t in study.trials if t.state == optuna.trial.TrialState.COMPLETE])
@@ -411,8 +346,9 @@ if __name__ == "__main__":
                 "project": "powerlifting-ml-progress",
                 "optimizer_engine": "optuna",
                 "model_family": "xgboost",
-                "feature_set_version": FEATURE_SET_VERSION,
-                "target": TARGET,
+                "feature_set_version": feature_set.FEATURE_SET_VERSION,
+                "feature_groups": ", ".join(f"{group}@{version}" for group, version in (feature_group_versions or {}).items()),
+                "target": feature_set.TARGET,
                 "min_competitions": conf.MIN_COMPETITIONS,
                 "min_days_between_comps": conf.MIN_DAYS_BETWEEN_COMPS,
                 "split_method": "temporal",
@@ -483,8 +419,48 @@ if __name__ == "__main__":
                 name=artifact_path,
                 input_example=X_train.iloc[[0]],
                 model_format="ubj",
-                metadata={"model_data_version": FEATURE_SET_VERSION},
+                metadata={"model_data_version": feature_set.FEATURE_SET_VERSION},
             )
-            model_uri = mlflow.get_artifact_uri(artifact_path)
+            logging.info("Model logged to %s", mlflow.get_artifact_uri(artifact_path))
         except Exception as e:
             logging.warning("Artifact logging failed (is MinIO running?): %s", e)
+
+
+def read_features() -> tuple[pl.DataFrame, dict[str, str] | None]:
+    """
+    The base layer columns of the feature set, from the feature groups of the local feature store holding them,
+    or from the base layer file when there is no store yet.
+
+    Returns:
+        tuple[pl.DataFrame, dict[str, str] | None]: (features, version of every feature group read, None from the base layer file).
+    """
+    try:
+        return feature_store.read(feature_set.BASE_FEATURE_COLUMNS), feature_store.group_versions(feature_set.BASE_FEATURE_COLUMNS)
+    except FileNotFoundError as e:
+        logging.info(f"Reading the base layer file instead ({e})")
+        return pl.read_parquet(conf.base_local_file_path, columns=feature_set.BASE_FEATURE_COLUMNS), None
+
+
+def run(base_df: pl.DataFrame | None = None, from_raw: bool = False) -> None:
+    """
+    Trains on the base layer, read from the local feature store unless it is handed in by an upstream stage.
+    from_raw builds it from the raw layer instead, computing only the features of this feature set version.
+    """
+    feature_group_versions = None
+    if base_df is None and from_raw:
+        logging.info("Building the features from the raw layer")
+        base = importlib.import_module("03_base")
+        base_df = base.build_base(base.scan_raw(), feature_set.BASE_FEATURE_COLUMNS)
+    elif base_df is None:
+        logging.info("Loading data")
+        base_df, feature_group_versions = read_features()
+
+    train(base_df, feature_group_versions)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the model")
+    parser.add_argument("--from-raw", action="store_true", help="build only the features of the feature set from the raw layer instead of reading the base layer")
+    args = parser.parse_args()
+
+    run(from_raw=args.from_raw)
@@ -0,0 +1,121 @@
+"""
+Benchmarks the pipeline on synthetic data (see synthetic_data.py), offline.
+
+Times every transform of 03_raw and 03_base on its own (see profiling.profile_transform), the raw and base builds
+as single fused plans, every table of 04_describe and 04_analyses and the training data preparation of 05_train.
+Results are appended to conf.benchmark_results_local_file_path, tagged with the git commit and the data scale,
+and --compare ranks the latest run against the previous one at the same scale.
+
+Usage:
+    uv run python steps/benchmark.py --scale 1 [--groups raw base describe analyses train]
+    uv run python steps/benchmark.py --scale 1 --compare
+"""
+
+import argparse
+import importlib
+import inspect
+import logging
+import subprocess
+from pathlib import Path
+
+import conf
+import polars as pl
+import profiling
+import synthetic_data
+
+GROUPS = ["raw", "base", "describe", "analyses", "train"]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def table_functions(module) -> list:
+    "Public functions of a module that compute a table from the base layer, i.e. everything but run"
+    return [
+        func
+        for name, func in inspect.getmembers(module, inspect.isfunction)
+        if func.__module__ == module.__name__ and not name.startswith("_") and name != "run" and len(inspect.signature(func).parameters) == 1
+    ]
+
+
+def run_benchmarks(landing_path: str, groups: list[str]) -> pl.DataFrame:
+    "Runs the selected benchmark groups, upstream steps of a selected group run unrecorded"
+    conf.STAGE_CACHE = False
+    raw = importlib.import_module("03_raw")
+    base = importlib.import_module("03_base")
+
+    # Fused builds first, then every transform on its own
+    raw_df = profiling.profile_transform(raw.build_raw, pl.scan_parquet(landing_path))
+    if "raw" in groups:
+        conf.PROFILE = True
+        raw.build_raw(pl.scan_parquet(landing_path))
+        conf.PROFILE = False
+
+    base_df = profiling.profile_transform(base.build_base, raw_df.lazy())
+    if "base" in groups:
+        conf.PROFILE = True
+        base.build_base(raw_df.lazy())
+        conf.PROFILE = False
+
+    metrics_df = profiling.take_metrics()
+    if "raw" not in groups:
+        metrics_df = metrics_df.filter(pl.col("transform") != "build_raw")
+    if "base" not in groups:
+        metrics_df = metrics_df.filter(pl.col("transform") != "build_base")
+
+    for group, module_name in [("describe", "04_describe"), ("analyses", "04_analyses")]:
+        if group in groups:
+            for func in table_functions(importlib.import_module(module_name)):
+                profiling.profile_transform(func, base_df)
+
+    if "train" in groups:
+        # Importing 05_train needs the MLflow / MinIO .env, like training does
+        profiling.profile_transform(importlib.import_module("05_train").prepare_modelling_df, base_df)
+
+    return pl.concat([metrics_df, profiling.take_metrics()])
+
+
+def write_results(metrics_df: pl.DataFrame, scale: float, seed: int) -> None:
+    results_df = metrics_df.with_columns(
+        pl.lit(git_commit()).alias("commit"),
+        pl.lit(scale).alias("scale"),
+        pl.lit(seed).alias("seed"),
+    )
+
+    path = Path(conf.benchmark_results_local_file_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        results_df = pl.concat([pl.read_parquet(path), results_df], how="diagonal_relaxed")
+    results_df.write_parquet(path)
+    logging.info(f"Benchmark results written: {path} (run {profiling.RUN_ID})")
+
+
+def compare(scale: float, threshold: float) -> pl.DataFrame:
+    "Ranks the latest run at a scale against the previous one, see profiling.report"
+    results_df = pl.read_parquet(conf.benchmark_results_local_file_path).filter(pl.col("scale") == scale)
+    runs = results_df.select("run_id", "run_started_at", "commit").unique().sort("run_started_at", descending=True)
+    logging.info(f"Comparing commit {runs['commit'][0]} against {runs['commit'][1] if runs.height > 1 else 'nothing'} at {scale:g}x")
+    return profiling.report(results_df, threshold=threshold)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic data")
+    parser.add_argument("--scale", type=float, default=1, help="multiple of the real data size, e.g. 1, 10 or 100")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--groups", nargs="*", default=GROUPS, choices=GROUPS)
+    parser.add_argument("--compare", action="store_true", help="only compare the latest run against the previous one")
+    parser.add_argument("--threshold", type=float, default=conf.PROFILE_REGRESSION_THRESHOLD, help="relative wall time increase flagged as a regression")
+    args = parser.parse_args()
+
+    if not args.compare:
+        landing_path = synthetic_data.synthetic_landing_path(args.scale, args.seed)
+        if not Path(landing_path).exists():
+            Path(landing_path).parent.mkdir(parents=True, exist_ok=True)
+            synthetic_data.generate_landing(args.scale, landing_path, seed=args.seed)
+        write_results(run_benchmarks(landing_path, args.groups), args.scale, args.seed)
+
+    profiling.log_report(compare(args.scale, args.threshold))
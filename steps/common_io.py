@@ -2,13 +2,48 @@
 A set of common IO functions to be used across all steps.
 """
 
+import io
+import json
 import logging
 import shutil
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import cache
 from pathlib import Path
 
 import boto3
 import conf
+import manifest
 import polars as pl
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+# Guards the in-memory artifact manifest, which background uploads update concurrently
+_manifest_lock = threading.Lock()
+
+# Background uploads, drained with io_wait_for_uploads()
+_upload_executor = ThreadPoolExecutor(max_workers=conf.S3_UPLOAD_WORKERS, thread_name_prefix="s3-upload")
+_pending_uploads: list[Future] = []
+
+s3_transfer_config = TransferConfig(
+    multipart_threshold=conf.S3_MULTIPART_THRESHOLD_BYTES,
+    multipart_chunksize=conf.S3_MULTIPART_CHUNK_SIZE_BYTES,
+    max_concurrency=conf.S3_MULTIPART_MAX_CONCURRENCY,
+)
+
+
+@cache
+def get_s3_client():
+    """
+    Shared S3 client, so connections are pooled across uploads rather than re-established per call.
+    boto3 clients are thread safe, the pool is sized for concurrent multipart uploads.
+    Set S3_ENDPOINT_URL to point it at a local stand-in such as MinIO.
+    """
+    return boto3.client(
+        "s3",
+        endpoint_url=conf.s3_endpoint_url,
+        config=Config(max_pool_connections=conf.S3_MAX_POOL_CONNECTIONS),
+    )
 
 
 # IO functions
@@ -58,27 +93,185 @@ def io_remove_root_data_folder() -> bool:
         return False
 
 
-def io_write_from_local_to_s3(df: pl.DataFrame, local_path: str, s3_key: str, debug: bool = True) -> None:
+@cache
+def io_load_manifest() -> dict:
+    "Fetches the artifact manifest from S3 once per process, empty if none has been written yet"
+    s3_client = get_s3_client()
+    try:
+        body = s3_client.get_object(Bucket=conf.bucket_name, Key=conf.manifest_s3_key)["Body"].read()
+    except s3_client.exceptions.NoSuchKey:
+        logging.info("No artifact manifest found, starting a new one")
+        return {}
+
+    return json.loads(body)
+
+
+def io_save_manifest() -> None:
+    "Writes the artifact manifest locally and to S3. Callers must hold _manifest_lock."
+    body = json.dumps(io_load_manifest(), indent=2, sort_keys=True)
+    manifest_file = Path(conf.manifest_local_file_path)
+    manifest_file.parent.mkdir(parents=True, exist_ok=True)
+    manifest_file.write_text(body)
+
+    get_s3_client().put_object(Bucket=conf.bucket_name, Key=conf.manifest_s3_key, Body=body.encode(), ContentType="application/json")
+
+
+def _is_unchanged(s3_key: str, sha256: str) -> bool:
+    with _manifest_lock:
+        if manifest.is_unchanged(io_load_manifest(), s3_key, sha256):
+            logging.info(f"Skipping upload, s3://{conf.bucket_name}/{s3_key} is unchanged ({sha256[:12]})")
+            return True
+    return False
+
+
+def _record_upload(s3_key: str, sha256: str, parquet_source, save_manifest: bool) -> None:
+    with _manifest_lock:
+        manifest.record_artifact(io_load_manifest(), s3_key, sha256, parquet_source)
+        if save_manifest:
+            io_save_manifest()
+
+
+def io_upload_to_s3(local_path: str, s3_key: str, save_manifest: bool = True) -> bool:
     """
-    Saves a dataframe to local and then uploads it to S3.
-    Performs the clean up of the local file after the upload.
+    Uploads a local parquet file to S3, unless the manifest shows the same content is already there.
+
+    Returns:
+        bool: True if the file was uploaded, False if it was skipped as unchanged.
     """
-    logging.info("Writing to parquet")
-    # Need to generate root data folder to ensure it can be written out to
-    io_create_root_data_folder()
-    df.write_parquet(local_path)
+    sha256 = manifest.file_sha256(local_path)
+    if _is_unchanged(s3_key, sha256):
+        return False
 
-    logging.info("Writing to S3")
-    s3_client = boto3.client("s3")
-    s3_client.upload_file(
+    logging.info(f"Writing {local_path} to S3")
+    get_s3_client().upload_file(
         local_path,
         conf.bucket_name,
         s3_key,
+        Config=s3_transfer_config,
     )
-    logging.info("Parquet file uploaded to S3 successfully")
+    logging.info(f"Uploaded to s3://{conf.bucket_name}/{s3_key}")
+    _record_upload(s3_key, sha256, local_path, save_manifest)
+
+    return True
+
+
+def io_write_from_memory_to_s3(df: pl.DataFrame, s3_key: str) -> bool:
+    "Serialises a dataframe to parquet in memory and uploads it to S3 if changed, without a local file."
+    buffer = io.BytesIO()
+    df.write_parquet(buffer)
+    parquet_bytes = buffer.getvalue()
+    sha256 = manifest.bytes_sha256(parquet_bytes)
+    if _is_unchanged(s3_key, sha256):
+        return False
+
+    logging.info(f"Writing {len(parquet_bytes)} bytes from memory to S3")
+    # upload_fileobj closes the file object it is given, so hand it its own buffer
+    get_s3_client().upload_fileobj(io.BytesIO(parquet_bytes), conf.bucket_name, s3_key, Config=s3_transfer_config)
+    logging.info(f"Uploaded to s3://{conf.bucket_name}/{s3_key}")
+    _record_upload(s3_key, sha256, io.BytesIO(parquet_bytes), save_manifest=True)
+
+    return True
+
+
+def io_write_partitioned_parquet(df: pl.DataFrame, root: str, partition_by: list[str], file_name: str = "part-00000.parquet") -> list[str]:
+    """
+    Writes a dataframe as a hive-partitioned dataset, i.e. root/<col>=<value>/.../file_name.
+    Partition columns are encoded in the directory names and dropped from the files.
+
+    Returns:
+        list[str]: Paths of the parquet files written.
+    """
+    written = []
+    for keys, partition_df in df.partition_by(partition_by, as_dict=True, include_key=False).items():
+        partition_dir = Path(root).joinpath(*[f"{col}={conf.HIVE_NULL_PARTITION if value is None else value}" for col, value in zip(partition_by, keys)])
+        partition_dir.mkdir(parents=True, exist_ok=True)
+        partition_df.write_parquet(partition_dir / file_name, statistics=True)
+        written.append(str(partition_dir / file_name))
+
+    return written
+
+
+def io_upload_directory_to_s3(local_dir: str, s3_prefix: str) -> None:
+    """
+    Syncs the parquet files of a local directory to an S3 prefix.
+    Unchanged files are skipped, and objects with no local counterpart are removed
+    so partitions from a previous run do not linger.
+
+    New files are uploaded before stale objects are removed, so a failed upload leaves the previous
+    dataset in place rather than a partial one.
+    """
+    local_files = sorted(Path(local_dir).rglob("*.parquet"))
+    s3_keys = {f"{s3_prefix}/{local_file.relative_to(local_dir).as_posix()}": str(local_file) for local_file in local_files}
+
+    logging.info(f"Syncing {len(local_files)} parquet files from {local_dir} to s3://{conf.bucket_name}/{s3_prefix}")
+    # A dedicated pool, this may itself be running as a background upload on the shared one
+    with ThreadPoolExecutor(max_workers=conf.S3_UPLOAD_WORKERS) as directory_executor:
+        uploads = [directory_executor.submit(io_upload_to_s3, local_file, s3_key, save_manifest=False) for s3_key, local_file in s3_keys.items()]
+        uploaded = sum(upload.result() for upload in uploads)
+    logging.info(f"Uploaded {uploaded}, skipped {len(uploads) - uploaded} unchanged files")
+
+    s3_client = get_s3_client()
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=conf.bucket_name, Prefix=f"{s3_prefix}/"):
+        stale_objects = [{"Key": obj["Key"]} for obj in page.get("Contents", []) if obj["Key"] not in s3_keys]
+        if stale_objects:
+            s3_client.delete_objects(Bucket=conf.bucket_name, Delete={"Objects": stale_objects})
+            with _manifest_lock:
+                for stale_object in stale_objects:
+                    io_load_manifest().get("artifacts", {}).pop(stale_object["Key"], None)
+
+    with _manifest_lock:
+        io_save_manifest()
+
+
+def io_write_partitioned_from_local_to_s3(df: pl.DataFrame, local_path: str, s3_key: str, partition_by: list[str]) -> None:
+    "Saves a dataframe as a hive-partitioned dataset locally, then replaces the S3 prefix with it."
+    logging.info(f"Writing partitioned parquet by {partition_by}")
+    shutil.rmtree(local_path, ignore_errors=True)
+    io_write_partitioned_parquet(df, local_path, partition_by)
+    io_upload_directory_to_s3(local_path, s3_key)
+
+
+def io_write_from_local_to_s3(df: pl.DataFrame, local_path: str, s3_key: str, debug: bool = True, row_group_size: int | None = None) -> None:
+    """
+    Saves a dataframe to local and then uploads it to S3.
+    Performs the clean up of the local file after the upload.
+    """
+    logging.info("Writing to parquet")
+    # Need to generate the output folder to ensure it can be written out to
+    Path(local_path).parent.mkdir(parents=True, exist_ok=True)
+    df.write_parquet(local_path, row_group_size=row_group_size)
+
+    io_upload_to_s3(local_path, s3_key)
 
     if debug:
         logging.info(f"Parquet file can be found at: {local_path}")
     else:
         logging.info("Cleaning up local files")
         io_remove_root_data_folder()
+
+
+def io_run_in_background(fn, *args, **kwargs) -> Future:
+    """
+    Queues any write / upload function on the shared upload pool, so computation can continue while it runs.
+    Call io_wait_for_uploads() before exiting to surface any errors.
+    """
+    upload = _upload_executor.submit(fn, *args, **kwargs)
+    _pending_uploads.append(upload)
+    return upload
+
+
+def io_write_to_s3_in_background(df: pl.DataFrame, local_path: str | None, s3_key: str, **write_options) -> Future:
+    """
+    Queues a parquet write and upload on the shared upload pool.
+    Writes to local_path first if given, if it is None streams the parquet straight from memory.
+    """
+    if local_path:
+        return io_run_in_background(io_write_from_local_to_s3, df, local_path, s3_key, **write_options)
+    return io_run_in_background(io_write_from_memory_to_s3, df, s3_key)
+
+
+def io_wait_for_uploads() -> None:
+    "Blocks until every background upload has finished, re-raising the first failure."
+    while _pending_uploads:
+        _pending_uploads.pop(0).result()
@@ -1,4 +1,7 @@
+import datetime
+import functools
 import logging
+import os
 import re
 from enum import Enum
 
@@ -39,9 +42,17 @@ artifact_location = "s3://mlflow"
 
 # Reference tables
 reference_tables_local_file_path_parquet = f"{root_data_folder}/{reference_tables_local_folder_name}"
+# Meet type of a meet name: the type of the first pattern the lowercase name contains, the one without a pattern
+# otherwise, unless the name has an override, see 03_base.add_meet_type. The IDs are the keys of ELO_MEET_TYPE_MULTIPLIER.
+meet_type_file_path = f"{reference_tables_local_folder_name}/meet-type.csv"
+meet_type_schema = {"meet_type": pl.Utf8, "meet_type_id": pl.Int32, "pattern": pl.Utf8}
+meet_type_overrides_file_path = f"{reference_tables_local_folder_name}/meet-type-overrides.csv"
+meet_type_overrides_schema = {"meet_name": pl.Utf8, "meet_type": pl.Utf8}
 
 # Magic numbers
 AGE_TOLERANCE_YEARS = 2  # used to determine if a lifter is the same person
+IDENTITY_SEPARATION_YEARS = 2 * AGE_TOLERANCE_YEARS  # birth-year gap from which same-name lifters are surely different people
+MIN_IDENTITY_CONFIDENCE = 0.25  # lifters closer to another of the same name are dropped for modelling, see identity.py
 DAYS_IN_YEAR = 365.25
 MIN_COMPETITIONS = 3  # minimum comps required per lifter for modelling
 MIN_DAYS_BETWEEN_COMPS = 30  # avoid inflated progress rates from back-to-back meets
@@ -78,6 +89,32 @@ IPF_WEIGHT_CLASSES = {
     "F": [47, 52, 57, 63, 69, 76, 84, float("inf")],
 }
 
+# Weight class schemes (upper bounds in kg per sex, the last class is open ended), see steps/weight_classes.py
+WEIGHT_CLASS_SCHEMES = {
+    "ipf": IPF_WEIGHT_CLASSES,  # since 2011
+    "ipf_historical": {
+        "M": [52, 56, 60, 67.5, 75, 82.5, 90, 100, 110, 125, float("inf")],
+        "F": [44, 48, 52, 56, 60, 67.5, 75, 82.5, 90, float("inf")],
+    },
+    "usapl": {  # IPF classes, with the 53 / 43 kg classes open to every division
+        "M": [53, 59, 66, 74, 83, 93, 105, 120, float("inf")],
+        "F": [43, 47, 52, 57, 63, 69, 76, 84, float("inf")],
+    },
+    "wrpf": {
+        "M": [52, 56, 60, 67.5, 75, 82.5, 90, 100, 110, 125, 140, float("inf")],
+        "F": [44, 48, 52, 56, 60, 67.5, 75, 82.5, 90, 100, 110, float("inf")],
+    },
+}
+# Schemes by federation (or else parent federation) and the date from which they applied, the default for any other
+FEDERATION_WEIGHT_CLASS_SCHEMES = {
+    "USAPL": [(datetime.date(1900, 1, 1), "ipf_historical"), (datetime.date(2011, 1, 1), "usapl")],
+    "WRPF": [(datetime.date(1900, 1, 1), "wrpf")],
+    "IPF": [(datetime.date(1900, 1, 1), "ipf_historical"), (datetime.date(2011, 1, 1), "ipf")],
+}
+DEFAULT_WEIGHT_CLASS_SCHEME = "ipf"
+# Weight class columns of the base layer, <scheme>_weight_class ("federation": the scheme of each meet's federation)
+WEIGHT_CLASS_COLUMN_SCHEMES = ["ipf", "federation"]
+
 
 # Functions
 def camel_to_snake(camel_str):
@@ -85,13 +122,36 @@ def camel_to_snake(camel_str):
     return snake_str
 
 
-# A debug decorator to log the head of the dataframe and the row count
+# Opt-in inspector for the transformations, enabled with PIPELINE_DEBUG=1
+# Disabled it returns the result untouched, so lazy plans are not executed stage by stage
+DEBUG = os.environ.get("PIPELINE_DEBUG", "0") == "1"
+DEBUG_SAMPLE_ROWS = 2
+
+# Per-transform performance metrics, enabled with PIPELINE_PROFILE=1, see profiling.py
+PROFILE = os.environ.get("PIPELINE_PROFILE", "0") == "1"
+run_metrics_local_file_path = f"{root_data_folder}/metrics/run_metrics.parquet"
+PROFILE_REGRESSION_THRESHOLD = 0.2  # relative wall time increase against the previous run
+PROFILE_REGRESSION_MIN_SECONDS = 0.5
+
+
 def debug(func):
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        result_df: pl.DataFrame = func(*args, **kwargs)
-        logging.info(result_df.head(2))
-
-        logging.info(f"Row count: {len(result_df)}")
+        if PROFILE:
+            import profiling  # imports conf, so it can only be imported once conf is loaded
+
+            result_df: pl.DataFrame | pl.LazyFrame = profiling.profile_transform(func, *args, **kwargs)
+        else:
+            result_df = func(*args, **kwargs)
+        if not DEBUG:
+            return result_df
+
+        # Only a sample of a lazy plan is collected, the row count would execute all of it
+        if isinstance(result_df, pl.LazyFrame):
+            logging.info(f"{func.__name__}:\n{result_df.head(DEBUG_SAMPLE_ROWS).collect()}")
+        else:
+            logging.info(f"{func.__name__}:\n{result_df.head(DEBUG_SAMPLE_ROWS)}")
+            logging.info(f"Row count: {len(result_df)}")
         return result_df
 
     return wrapper
@@ -116,6 +176,13 @@ def create_output_file_path(
 
 extract_path = f"{root_data_folder}/{OutputPathType.EXTRACT.value}"
 
+# Download
+zip_local_file_path = f"{extract_path}/openpowerlifting-latest.zip"
+download_state_file_path = f"{extract_path}/download_state.json"  # ETag / Last-Modified of the last completed download
+DOWNLOAD_CHUNK_SIZE_BYTES = 8 * 1024 * 1024
+DOWNLOAD_TIMEOUT_SECONDS = 60
+LANDING_CSV_CHUNK_SIZE_BYTES = 64 * 1024 * 1024  # bounds memory while converting the CSV to parquet
+
 # Local
 landing_local_file_path = create_output_file_path(
     OutputPathType.LANDING,
@@ -149,8 +216,172 @@ raw_s3_http = create_output_file_path(OutputPathType.RAW, FileLocation.S3, as_ht
 
 base_s3_http = create_output_file_path(OutputPathType.BASE, FileLocation.S3, as_http=True)
 
+# Lifter IDs (steps/03_raw.py): lookup of the UInt32 ID of every primary key ever seen, which the base layer identifies lifters by
+# Kept from build to build so an ID always names the same lifter, see 03_raw.assign_lifter_ids
+lifter_ids_file_name = "lifter_ids.parquet"
+lifter_ids_local_file_path = create_output_file_path(OutputPathType.RAW, FileLocation.LOCAL, file_name=lifter_ids_file_name)
+lifter_ids_s3_key = create_output_file_path(OutputPathType.RAW, FileLocation.S3, file_name=lifter_ids_file_name)
+lifter_ids_s3_http = create_output_file_path(OutputPathType.RAW, FileLocation.S3, as_http=True, file_name=lifter_ids_file_name)
+lifter_ids_schema = {"primary_key": pl.Utf8, "lifter_id": pl.UInt32}
+
+# Incremental base builds (steps/03_base.py --incremental)
+# Only lifters with new or changed rows since the previous build are recomputed, see 03_base.build_base_incremental
+BASE_INCREMENTAL = os.environ.get("BASE_INCREMENTAL", "0") == "1"
+base_sort_columns = ["lifter_id", "date", "meet_name"]  # unique, so every build orders rows (and ties of the window features) the same
+base_input_snapshot_file_name = "base_input_snapshot.parquet"  # raw rows the previous base layer was built from
+base_input_snapshot_local_file_path = create_output_file_path(OutputPathType.BASE, FileLocation.LOCAL, file_name=base_input_snapshot_file_name)
+base_input_snapshot_s3_key = create_output_file_path(OutputPathType.BASE, FileLocation.S3, file_name=base_input_snapshot_file_name)
+base_input_snapshot_s3_http = create_output_file_path(OutputPathType.BASE, FileLocation.S3, as_http=True, file_name=base_input_snapshot_file_name)
+# Elo ratings of every lifter after the latest meet date, and at the end of each of the ELO_CHECKPOINT_YEARS years before it
+# Incremental builds replay only the meets after the latest of them still valid for the new data, see 03_base.resume_elo_rating
+elo_state_file_name = "elo_state.parquet"
+elo_state_local_file_path = create_output_file_path(OutputPathType.BASE, FileLocation.LOCAL, file_name=elo_state_file_name)
+elo_state_s3_key = create_output_file_path(OutputPathType.BASE, FileLocation.S3, file_name=elo_state_file_name)
+elo_state_s3_http = create_output_file_path(OutputPathType.BASE, FileLocation.S3, as_http=True, file_name=elo_state_file_name)
+ELO_CHECKPOINT_YEARS = 10
+
+# Glicko-2 rating system (steps/glicko.py)
+GLICKO_RATING_PERIOD = "1mo"  # polars duration, the meets of a period are rated together from the ratings before it
+GLICKO_INITIAL_RATING = 1500
+GLICKO_INITIAL_RD = 350  # also the cap of the rating deviation of inactive lifters
+GLICKO_INITIAL_VOLATILITY = 0.06
+GLICKO_TAU = 0.5  # constrains the change in volatility
+GLICKO_SCALE = 173.7178  # Glicko to Glicko-2 scale
+GLICKO_VOLATILITY_TOLERANCE = 1e-6
+# Per-period Glicko-2 state of every lifter rated in it, incremental builds replay only the periods after the latest still valid
+glicko_state_file_name = "glicko_state.parquet"
+glicko_state_local_file_path = create_output_file_path(OutputPathType.BASE, FileLocation.LOCAL, file_name=glicko_state_file_name)
+glicko_state_s3_key = create_output_file_path(OutputPathType.BASE, FileLocation.S3, file_name=glicko_state_file_name)
+glicko_state_s3_http = create_output_file_path(OutputPathType.BASE, FileLocation.S3, as_http=True, file_name=glicko_state_file_name)
+
+# Stage cache (steps/memoize.py)
+STAGE_CACHE = os.environ.get("STAGE_CACHE", "0") == "1"
+stage_cache_folder = f"{root_data_folder}/stage-cache"
+STAGE_CACHE_MAX_BYTES = 4 * 1024 * 1024 * 1024  # least recently used entries are evicted above it
+
+# Feature store (steps/feature_store.py): the entity keys of the base layer and its feature groups in separate row-aligned files
+feature_store_folder = f"{root_data_folder}/feature-store"
+feature_store_entity_columns = base_sort_columns  # unique, one entity per row of the base layer
+
+# As-of snapshots of the base layer for backtesting (steps/snapshots.py), one file per cutoff date
+snapshots_folder = f"{root_data_folder}/snapshots"
+
+# Synthetic data and benchmarks (steps/synthetic_data.py, steps/benchmark.py)
+synthetic_data_folder = f"{root_data_folder}/synthetic"
+benchmark_results_local_file_path = f"{root_data_folder}/benchmarks/benchmark_results.parquet"
+SYNTHETIC_ROWS_1X = 3_000_000  # about the size of the OpenPowerlifting CSV
+SYNTHETIC_CHUNK_ROWS = 1_000_000
+SYNTHETIC_MEAN_COMPS_PER_LIFTER = 3.5
+SYNTHETIC_MEAN_MEET_SIZE = 80
+SYNTHETIC_MEAN_DAYS_BETWEEN_MEETS = 240
+SYNTHETIC_NULL_AGE_RATE = 0.05
+SYNTHETIC_DQ_RATE = 0.04
+
+# Pipeline (steps/pipeline.py)
+PIPELINE_MAX_WORKERS = 4  # stages run concurrently
+
+# S3 transfers
+s3_endpoint_url = os.environ.get("S3_ENDPOINT_URL")  # e.g. http://localhost:9000 for the MinIO in docker-compose.yml
+S3_MAX_POOL_CONNECTIONS = 32
+S3_UPLOAD_WORKERS = 4  # concurrent background uploads
+S3_MULTIPART_THRESHOLD_BYTES = 16 * 1024 * 1024
+S3_MULTIPART_CHUNK_SIZE_BYTES = 16 * 1024 * 1024
+S3_MULTIPART_MAX_CONCURRENCY = 8  # parts uploaded in parallel per file
+
+# Compact dtypes of the raw layer, see 03_raw.encode_dtypes
+# Enums for the closed OpenPowerlifting vocabularies, categories in lexical order so rows sort as the strings did
+# (a value outside them fails the raw build), categoricals for the other low-cardinality columns
+raw_enum_dtypes = {
+    "sex": pl.Enum(["F", "M", "Mx"]),
+    "event": pl.Enum(["B", "BD", "D", "S", "SB", "SBD", "SD"]),
+    "equipment": pl.Enum(["Multi-ply", "Raw", "Single-ply", "Straps", "Unlimited", "Wraps"]),
+    "tested": pl.Enum(["No", "Yes"]),
+}
+raw_categorical_columns = [
+    "age_class",
+    "birth_year_class",
+    "division",
+    "weight_class_kg",
+    "country",
+    "state",
+    "federation",
+    "parent_federation",
+    "meet_country",
+    "meet_state",
+    "meet_town",
+    "sanctioned",
+    "origin_country",
+]
+
+# Hive-partitioned layout (opt in with PARTITIONED_LAYOUT=1)
+# Written alongside the single parquet files so readers can prune partitions instead of reading every row
+PARTITIONED_LAYOUT = os.environ.get("PARTITIONED_LAYOUT", "0") == "1"
+HIVE_NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"  # directory value polars reads back as null
+partitioned_folder_name = "partitioned"
+landing_partition_schema = {"event": pl.Utf8, "equipment": pl.Utf8}
+raw_partition_schema = {"event": raw_enum_dtypes["event"], "equipment": raw_enum_dtypes["equipment"], "event_year": pl.Int32}
+
+landing_partitioned_local_path = create_output_file_path(OutputPathType.LANDING, FileLocation.LOCAL, file_name=partitioned_folder_name)
+raw_partitioned_local_path = create_output_file_path(OutputPathType.RAW, FileLocation.LOCAL, file_name=partitioned_folder_name)
+
+landing_partitioned_s3_key = create_output_file_path(OutputPathType.LANDING, FileLocation.S3, file_name=partitioned_folder_name)
+raw_partitioned_s3_key = create_output_file_path(OutputPathType.RAW, FileLocation.S3, file_name=partitioned_folder_name)
+
+landing_partitioned_s3_uri = f"s3://{bucket_name}/{landing_partitioned_s3_key}/"
+raw_partitioned_s3_uri = f"s3://{bucket_name}/{raw_partitioned_s3_key}/"
+s3_storage_options = {"aws_region": s3_region}
+raw_sort_columns = ["event", "equipment", "tested", "date"]  # clusters rows so row-group statistics can skip them
+RAW_ROW_GROUP_SIZE = 100_000
+
 # Columns
 # Landing
+# Pinned dtypes for every OpenPowerlifting CSV column, avoids a full pass over the CSV to infer them.
+# Columns not listed here (e.g. newly added upstream) are read as strings.
+landing_schema = {
+    "Name": pl.Utf8,
+    "Sex": pl.Utf8,
+    "Event": pl.Utf8,
+    "Equipment": pl.Utf8,
+    "Age": pl.Float64,
+    "AgeClass": pl.Utf8,
+    "BirthYearClass": pl.Utf8,
+    "Division": pl.Utf8,
+    "BodyweightKg": pl.Float64,
+    "WeightClassKg": pl.Utf8,  # e.g. "120+"
+    "Squat1Kg": pl.Float64,
+    "Squat2Kg": pl.Float64,
+    "Squat3Kg": pl.Float64,
+    "Squat4Kg": pl.Float64,
+    "Best3SquatKg": pl.Float64,
+    "Bench1Kg": pl.Float64,
+    "Bench2Kg": pl.Float64,
+    "Bench3Kg": pl.Float64,
+    "Bench4Kg": pl.Float64,
+    "Best3BenchKg": pl.Float64,
+    "Deadlift1Kg": pl.Float64,
+    "Deadlift2Kg": pl.Float64,
+    "Deadlift3Kg": pl.Float64,
+    "Deadlift4Kg": pl.Float64,
+    "Best3DeadliftKg": pl.Float64,
+    "TotalKg": pl.Float64,
+    "Place": pl.Utf8,  # e.g. "DQ", "G"
+    "Dots": pl.Float64,
+    "Wilks": pl.Float64,
+    "Glossbrenner": pl.Float64,
+    "Goodlift": pl.Float64,
+    "Tested": pl.Utf8,
+    "Country": pl.Utf8,
+    "State": pl.Utf8,
+    "Federation": pl.Utf8,
+    "ParentFederation": pl.Utf8,
+    "Date": pl.Utf8,  # parsed in the raw layer
+    "MeetCountry": pl.Utf8,
+    "MeetState": pl.Utf8,
+    "MeetTown": pl.Utf8,
+    "MeetName": pl.Utf8,
+    "Sanctioned": pl.Utf8,
+}
+
 _required_landing_column_names = [
     "Date",
     "Name",
@@ -186,10 +417,10 @@ renamed_landing_column_names = {
 
 # TODO: Remove this from the raw layer as it is not best practice
 # raw columns created from transformations
-additional_raw_columns = ["origin_country", "primary_key", "birth_year"]
+additional_raw_columns = ["origin_country", "primary_key", "lifter_id", "birth_year", "identity_confidence"]
 
-# Base layer
-_base_column_names = _required_landing_column_names + additional_raw_columns
+# Base layer, lifters are identified by their lifter ID rather than the primary key string (see lifter_ids_schema)
+_base_column_names = _required_landing_column_names + [column for column in additional_raw_columns if column != "primary_key"]
 base_columns = [camel_to_snake(col) for col in _base_column_names]
 
 base_renamed_columns = {camel_to_snake(key): camel_to_snake(value) for key, value in renamed_landing_column_names.items()}
@@ -245,3 +476,36 @@ analysis_archetypes_s3_http = create_output_file_path(OutputPathType.BASE, FileL
 analysis_archetype_centroids_local = create_output_file_path(OutputPathType.BASE, FileLocation.LOCAL, file_name="analysis_archetype_centroids.parquet")
 analysis_archetype_centroids_s3_key = create_output_file_path(OutputPathType.BASE, FileLocation.S3, file_name="analysis_archetype_centroids.parquet")
 analysis_archetype_centroids_s3_http = create_output_file_path(OutputPathType.BASE, FileLocation.S3, as_http=True, file_name="analysis_archetype_centroids.parquet")
+
+# Artifact manifest
+# Records checksum, row count, schema hash and lineage of every artifact uploaded to S3, see manifest.py
+manifest_file_name = "manifest.json"
+manifest_local_file_path = f"{root_data_folder}/{manifest_file_name}"
+manifest_s3_key = manifest_file_name
+manifest_s3_http = f"https://{bucket_name}.s3.{s3_region}.amazonaws.com/{manifest_file_name}"
+
+# Upstream artifacts each artifact is built from (S3 keys)
+_describe_s3_keys = [describe_by_weight_class_s3_key, describe_by_experience_s3_key, describe_by_sex_wc_exp_s3_key, describe_quality_s3_key]
+_analysis_s3_keys = [
+    analysis_career_trajectory_s3_key,
+    analysis_comp_indexed_growth_s3_key,
+    analysis_percentile_movement_s3_key,
+    analysis_rolling_averages_s3_key,
+    analysis_lift_ratios_s3_key,
+    analysis_wilks_trajectory_s3_key,
+    analysis_survival_s3_key,
+    analysis_archetypes_s3_key,
+    analysis_archetype_centroids_s3_key,
+]
+artifact_upstreams = {
+    landing_s3_key: [],
+    landing_partitioned_s3_key: [],
+    raw_s3_key: [landing_s3_key],
+    raw_partitioned_s3_key: [landing_s3_key],
+    lifter_ids_s3_key: [landing_s3_key],
+    base_s3_key: [raw_s3_key],
+    base_input_snapshot_s3_key: [raw_s3_key],
+    elo_state_s3_key: [base_s3_key],
+    glicko_state_s3_key: [base_s3_key],
+    **{s3_key: [base_s3_key] for s3_key in _describe_s3_keys + _analysis_s3_keys},
+}
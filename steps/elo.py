@@ -0,0 +1,244 @@
+"""
+Array-backed field Elo engine, see 03_base.add_elo_rating.
+
+At each meet, lifters are rated against their segment (sex + weight class): the expected score comes from the
+segment's average pre-meet Elo, the actual score from the lifter's rank by total within the segment.
+
+Everything that only depends on the data (processing order, segments, ranks, K factors) is computed once in
+plan_elo, and ratings are held in a dense array indexed by lifter. Segments only depend on each other through
+the previous segments of their lifters, so instead of walking the meets one by one, replay_elo updates a whole
+level of that dependency graph at once: a few hundred vectorized steps for the full history.
+Field averages are summed in row order and every float operation matches the per-row formulation, so the
+results are identical to it, not just close.
+
+The rating state of every lifter can be saved at checkpoint dates (rating_checkpoints) and the replay resumed
+from it, see 03_base.resume_elo_rating. A checkpoint is only valid while the rows up to its date are unchanged,
+which history_fingerprint records.
+"""
+
+import datetime
+import hashlib
+import itertools
+
+import conf
+import memoize
+import numpy as np
+import polars as pl
+
+# Columns the ratings are computed from, any change in them up to a checkpoint invalidates it
+ELO_INPUT_COLUMNS = ["lifter_id", "meet_name", "date", "sex", "ipf_weight_class", "total", "meet_type"]
+
+state_schema = {
+    "as_of_date": pl.Date,
+    "history_fingerprint": pl.Utf8,
+    "lifter_id": pl.UInt32,
+    "elo_rating": pl.Float64,
+    "last_meet_date": pl.Date,
+    "meet_count": pl.UInt32,
+}
+
+
+def segment_levels(segments: np.ndarray, previous_segments: np.ndarray, n_segments: int) -> np.ndarray:
+    """
+    Level of every segment in the dependency graph of the ratings: 0 when none of its lifters competed before,
+    else one more than the highest level among the previous segments of its lifters.
+    A segment only reads ratings written at lower levels, and a lifter has at most one segment per level.
+    Computed level by level (Kahn's algorithm), so every edge is visited once.
+
+    Args:
+        segments, previous_segments: one edge per lifter appearance that has a previous one.
+    """
+    order = np.argsort(previous_segments, kind="stable")
+    sources, targets = previous_segments[order], segments[order]
+    first_edge = np.searchsorted(sources, np.arange(n_segments + 1))
+    pending_edges = np.bincount(segments, minlength=n_segments)
+
+    levels = np.zeros(n_segments, dtype=np.int64)
+    ready = np.flatnonzero(pending_edges == 0)
+    level = 0
+    while len(ready):
+        levels[ready] = level
+        # Edges out of the ready segments
+        counts = first_edge[ready + 1] - first_edge[ready]
+        edges = np.repeat(first_edge[ready] - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+        reached = targets[edges]
+        np.subtract.at(pending_edges, reached, 1)
+        ready = np.unique(reached[pending_edges[reached] == 0])
+        level += 1
+
+    return levels
+
+
+def plan_elo(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Adds the static part of the Elo computation to the rows of df and orders them for replay_elo.
+
+    The rating history is the one of processing meets by date then by first appearance in df, and within a meet
+    segment by segment, each segment seeing the ratings left by all the ones before it.
+    Returns one row per input row, ordered by level, segment then row, with:
+    - row: position in df, lifter_index: dense index of the lifter ID among the lifters of df
+    - level: see segment_levels, segment: dense ID in processing order
+    - segment_size, actual_score: rank by total within the segment scaled to 0-1 (ties by row), k: K factor
+    """
+    multipliers = conf.ELO_MEET_TYPE_MULTIPLIER
+    meet = ["meet_name", "date"]
+
+    plan = df.select(
+        pl.int_range(pl.len(), dtype=pl.Int64).alias("row"),
+        (pl.col("lifter_id").rank("dense") - 1).cast(pl.Int64).alias("lifter_index"),
+        *meet,
+        "sex",
+        "ipf_weight_class",
+        # Missing totals rank as 0, missing meet types as local meets
+        pl.col("total").fill_null(0.0).alias("rank_total"),
+        (conf.ELO_BASE_K * pl.col("meet_type").fill_null(4).replace_strict(multipliers, default=0.6, return_dtype=pl.Float64)).alias("k"),
+    )
+
+    plan = plan.with_columns(pl.col("row").min().over(meet).alias("meet_first_row")).drop("meet_name")
+    plan = plan.sort(["date", "meet_first_row", "sex", "ipf_weight_class", "row"], nulls_last=True)
+
+    is_new_segment = pl.any_horizontal(pl.col(c).ne_missing(pl.col(c).shift(1)) for c in ["date", "meet_first_row", "sex", "ipf_weight_class"]).fill_null(True)
+    segment_start = pl.when(is_new_segment).then(pl.int_range(pl.len(), dtype=pl.Int64)).forward_fill()
+    plan = plan.with_columns(is_new_segment.cum_sum().cast(pl.Int64).sub(1).alias("segment"), segment_start.alias("segment_start"))
+
+    plan = plan.with_columns(
+        pl.len().over("segment").alias("segment_size"),
+        # One global sort instead of one per segment, the row breaks ties
+        (pl.struct("segment", "rank_total", "row").rank("ordinal").cast(pl.Int64) - 1 - pl.col("segment_start")).alias("rank_position"),
+    ).with_columns(
+        pl.when(pl.col("segment_size") > 1).then(pl.col("rank_position") / (pl.col("segment_size") - 1)).otherwise(0.5).alias("actual_score"),
+    )
+
+    # Consecutive segments of a lifter, a lifter has at most one row per meet (03_raw.filter_for_unique_primary_key)
+    edges = (
+        plan.select("lifter_index", "segment")
+        .sort("lifter_index", maintain_order=True)
+        .select("segment", pl.col("segment").shift(1).alias("previous_segment"), (pl.col("lifter_index") == pl.col("lifter_index").shift(1)).alias("is_repeat"))
+        .filter("is_repeat")
+    )
+    levels = segment_levels(edges["segment"].to_numpy(), edges["previous_segment"].to_numpy(), n_segments=(plan["segment"].max() or 0) + 1)
+
+    return plan.select("row", "lifter_index", "segment", "segment_size", "actual_score", "k").with_columns(pl.Series("level", levels[plan["segment"].to_numpy()])).sort(["level", "segment", "row"])
+
+
+def replay_elo(plan: pl.DataFrame, ratings: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Replays the meets of a plan (see plan_elo), updating ratings (indexed by lifter_index) in place.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: Pre-meet Elo, Elo change (NaN for segments of one lifter)
+        and average pre-meet Elo of the segment, in the row order of the frame the plan was made from.
+    """
+    n = plan.height
+    rows = plan["row"].to_numpy()
+    lifter_indexes = plan["lifter_index"].to_numpy()
+    segment_sizes = plan["segment_size"].to_numpy()
+    actual_scores = plan["actual_score"].to_numpy()
+    k_factors = plan["k"].to_numpy()
+
+    level_bounds = np.append(np.flatnonzero(np.diff(plan["level"].to_numpy(), prepend=-1)), n)
+    is_segment_start = np.diff(plan["segment"].to_numpy(), prepend=-1) != 0
+
+    pre_elo = np.empty(n)
+    elo_change = np.full(n, np.nan)
+    field_elo = np.empty(n)
+
+    for start, end in itertools.pairwise(level_bounds):
+        level_lifters = lifter_indexes[start:end]
+        pre = ratings[level_lifters]
+
+        # Segment sums in row order: one vectorized step per position within the segments
+        starts = np.flatnonzero(is_segment_start[start:end])
+        sizes = segment_sizes[start + starts]
+        sums = np.zeros(len(starts))
+        for position in range(sizes.max()):
+            in_segment = sizes > position
+            sums[in_segment] += pre[starts[in_segment] + position]
+        field = np.repeat(sums / sizes, sizes)
+
+        # numpy's vectorized power can differ from libm's pow in the last bit, take the scalar one
+        exponent = (field - pre) / 400.0
+        expected = 1.0 / (1.0 + np.fromiter((10.0**x for x in exponent.tolist()), dtype=np.float64, count=len(exponent)))
+        change = k_factors[start:end] * (actual_scores[start:end] - expected)
+
+        # Segments of one lifter record the pre-meet Elo only
+        rated = segment_sizes[start:end] > 1
+        level_rows = rows[start:end]
+        pre_elo[level_rows] = pre
+        field_elo[level_rows] = np.where(rated, field, pre)
+        elo_change[level_rows] = np.where(rated, change, np.nan)
+        ratings[level_lifters[rated]] = pre[rated] + change[rated]
+
+    return pre_elo, elo_change, field_elo
+
+
+def initial_ratings(lifter_ids: pl.Series, state_df: pl.DataFrame | None = None) -> np.ndarray:
+    "Ratings to replay from, indexed by lifter_index (see plan_elo): from a rating state when given, ELO_INITIAL for new lifters"
+    lifters = lifter_ids.unique().sort().to_frame("lifter_id")
+    if state_df is None:
+        return np.full(lifters.height, conf.ELO_INITIAL, dtype=np.float64)
+    ratings = lifters.join(state_df.select("lifter_id", "elo_rating"), on="lifter_id", how="left", maintain_order="left")["elo_rating"]
+    return ratings.fill_null(conf.ELO_INITIAL).to_numpy(writable=True)
+
+
+def history_fingerprint(df: pl.DataFrame, as_of: datetime.date) -> str:
+    "Hash of the Elo inputs of the rows of df up to as_of (in any order) and of the Elo code and constants"
+    digest = hashlib.sha256("".join(memoize.code_fingerprint(func) for func in [plan_elo, replay_elo, initial_ratings]).encode())
+    row_hashes = df.filter(pl.col("date") <= as_of).select(pl.struct(ELO_INPUT_COLUMNS).hash(seed=0)).to_series().sort()
+    digest.update(row_hashes.to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def rating_state(df: pl.DataFrame, as_of: datetime.date) -> pl.DataFrame:
+    """
+    Rating of every lifter after their last meet up to as_of, from the rows of a frame with the Elo columns,
+    in the order the ratings were computed from.
+    """
+    return (
+        df.with_row_index("row")
+        .filter(pl.col("date") <= as_of)
+        .with_columns(pl.col("row").min().over("meet_name", "date").alias("meet_first_row"))
+        .group_by("lifter_id")
+        .agg(
+            # Same operation as the update in replay_elo, lifters alone in their segment keep their rating
+            (pl.col("elo_rating") + pl.col("elo_change").fill_null(0.0)).sort_by("date", "meet_first_row").last().alias("elo_rating"),
+            pl.col("date").max().alias("last_meet_date"),
+            pl.len().alias("meet_count"),
+        )
+    )
+
+
+def checkpoint_dates(dates: pl.Series) -> list[datetime.date]:
+    "The latest date (the watermark) and the end of each of the conf.ELO_CHECKPOINT_YEARS years before it"
+    first, watermark = dates.min(), dates.max()
+    if watermark is None:
+        return []
+    year_ends = [datetime.date(year, 12, 31) for year in range(watermark.year - conf.ELO_CHECKPOINT_YEARS, watermark.year)]
+    return [as_of for as_of in year_ends if as_of >= first] + [watermark]
+
+
+def rating_checkpoints(df: pl.DataFrame) -> pl.DataFrame:
+    "Rating states of a frame with the Elo columns at its checkpoint dates, with the fingerprint of the history behind each"
+    checkpoints = [
+        rating_state(df, as_of).select(
+            pl.lit(as_of).alias("as_of_date"),
+            pl.lit(history_fingerprint(df, as_of)).alias("history_fingerprint"),
+            pl.all(),
+        )
+        for as_of in checkpoint_dates(df["date"])
+    ]
+    return pl.concat([pl.DataFrame(schema=state_schema), *checkpoints], how="vertical_relaxed").cast(state_schema)
+
+
+def latest_valid_checkpoint(state_df: pl.DataFrame, df: pl.DataFrame) -> tuple[datetime.date, pl.DataFrame] | None:
+    """
+    The latest checkpoint of state_df (see rating_checkpoints) whose history is unchanged in df.
+
+    Returns:
+        tuple[datetime.date, pl.DataFrame] | None: (checkpoint date, rating state), None when no checkpoint is valid.
+    """
+    for as_of in state_df["as_of_date"].unique().sort(descending=True):
+        checkpoint_df = state_df.filter(pl.col("as_of_date") == as_of)
+        if checkpoint_df["history_fingerprint"][0] == history_fingerprint(df, as_of):
+            return as_of, checkpoint_df
+    return None
@@ -0,0 +1,92 @@
+"""
+The feature set the model is trained on, shared by 05_train and the point-in-time features of point_in_time.py.
+"""
+
+import polars as pl
+
+FEATURE_SET_VERSION = 10
+TARGET = "pct_change_total"
+
+# Age class midpoints, used to encode age_class as a numeric feature
+AGE_CLASS_MAP = {
+    "5-12": 9.0,
+    "13-15": 14.0,
+    "16-17": 16.5,
+    "18-19": 18.5,
+    "20-23": 21.5,
+    "24-34": 29.0,
+    "35-39": 37.0,
+    "40-44": 42.0,
+    "45-49": 47.0,
+    "50-54": 52.0,
+    "55-59": 57.0,
+    "60-64": 62.0,
+    "65-69": 67.0,
+    "70-74": 72.0,
+    "75-79": 77.0,
+    "80-999": 85.0,
+}
+
+# Columns of the modelling frame, see modelling_features
+MODELLING_COLUMNS = [
+    "name",
+    "date",
+    "bodyweight",
+    "age_class_encoded",
+    "sex_encoded",
+    "ipf_wc_numeric",
+    "parent_federation",
+    "time_since_last_comp_years",
+    "bodyweight_change",
+    "cumulative_comps",
+    "tenure",
+    "is_origin_country_int",
+    "prev_total_per_bw",
+    "segment_mean_total",
+    "previous_squat",
+    "previous_bench",
+    "previous_deadlift",
+    "previous_total",
+    "previous_wilks",
+    "elo_rating",
+    "elo_change",
+    # v6: high-impact features
+    "prev_distance_from_pb",
+    "prev_total_progress",
+    "prev_avg_progress_3",
+    "comps_per_year",
+    "prev_rolling_std_total_3",
+    "approx_age",
+    "abs_years_from_peak_age",
+    "prev_total_change_kg",
+    # v7: interaction features
+    "prev_total_x_time_gap",
+    "prev_total_per_comp",
+    # v8: new features
+    "log_cumulative_comps",
+    "years_competing",
+    "prev_pct_change",
+    "time_gap_category",
+    # v9: Glicko-2 ratings
+    "glicko_rating",
+    "glicko_rd",
+    "glicko_volatility",
+    # v10: point-in-time percentile, replaces prev_total_percentile_rank which ranked among future totals too
+    "asof_prev_total_percentile_rank",
+    TARGET,
+]
+
+# Base layer column each encoded modelling column is computed from, see modelling_features
+ENCODED_COLUMNS = {"age_class_encoded": "age_class", "sex_encoded": "sex", "ipf_wc_numeric": "ipf_weight_class", "is_origin_country_int": "is_origin_country"}
+# Base layer columns training reads, the only features a build from the raw layer computes (see 05_train.run)
+BASE_FEATURE_COLUMNS = [ENCODED_COLUMNS.get(column, column) for column in MODELLING_COLUMNS]
+
+
+def modelling_features(base_df: pl.DataFrame) -> pl.DataFrame:
+    "Encodes the categoricals of base layer rows as numeric features (see AGE_CLASS_MAP) and selects the modelling columns"
+    return base_df.with_columns(
+        pl.col("sex").cast(pl.Utf8).replace_strict({"M": 1, "F": 0, "Mx": 0}, return_dtype=pl.Int32).alias("sex_encoded"),
+        pl.col("age_class").cast(pl.Utf8).replace_strict(AGE_CLASS_MAP, return_dtype=pl.Float64).alias("age_class_encoded"),
+        pl.col("ipf_weight_class").cast(pl.Utf8).str.replace(r"\+", "").str.replace("unknown", "0").cast(pl.Float64).alias("ipf_wc_numeric"),
+        pl.col("is_origin_country").cast(pl.Int32).alias("is_origin_country_int"),
+    ).select(MODELLING_COLUMNS)
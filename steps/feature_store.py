@@ -0,0 +1,131 @@
+"""
+Local columnar feature store of the base layer, see 03_base.feature_groups.
+
+The entity keys of every row (conf.feature_store_entity_columns) are stored once, and each feature group in its own
+parquet file whose rows align with them, so a consumer reads the keys and only the groups holding the columns it needs.
+Groups are versioned individually: the version of a group is a hash of its columns and of the code writing them,
+and its file is named after it, so a training run can record the exact groups it read.
+A write only rewrites the entities and the groups whose content changed, adding a group leaves the other files untouched.
+The manifest records, for the entities and every group, its file and the fingerprint of its content, and for every
+group its version, its columns and the entities it is aligned with.
+"""
+
+import json
+import logging
+from pathlib import Path
+from typing import NamedTuple
+
+import conf
+import memoize
+import polars as pl
+
+MANIFEST_FILE_NAME = "manifest.json"
+ENTITY_FILE_NAME = "entities.parquet"
+
+
+class FeatureGroup(NamedTuple):
+    columns: list[str]
+    version: str
+
+
+def load_manifest(folder: str = conf.feature_store_folder) -> dict:
+    "The manifest of the store, empty if nothing has been written yet"
+    path = Path(folder) / MANIFEST_FILE_NAME
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def write_parquet(df: pl.DataFrame, path: Path) -> None:
+    "Writes through a temporary file, so readers never see a partial file"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    df.write_parquet(tmp_path)
+    tmp_path.replace(path)
+
+
+def write(df: pl.DataFrame, groups: dict[str, FeatureGroup], folder: str = conf.feature_store_folder) -> dict:
+    """
+    Stores the rows of df as its entity keys and feature groups, see the module docstring.
+    Every column of df other than the entity keys must be in exactly one group, raises ValueError otherwise.
+
+    Returns:
+        dict: The new manifest.
+    """
+    entity_columns = conf.feature_store_entity_columns
+    grouped = [column for group in groups.values() for column in group.columns]
+    ungrouped = [column for column in df.columns if column not in entity_columns and column not in grouped]
+    duplicated = {column for column in grouped if grouped.count(column) > 1}
+    if ungrouped or duplicated or not set(grouped) <= set(df.columns):
+        raise ValueError(f"Feature groups must partition the columns: ungrouped {ungrouped}, in several groups {sorted(duplicated)}, missing {sorted(set(grouped) - set(df.columns))}")
+
+    root = Path(folder)
+    previous = load_manifest(folder)
+    manifest = {"entities": {"file": ENTITY_FILE_NAME, "fingerprint": memoize.frame_fingerprint(df.select(entity_columns))}, "groups": {}}
+    if previous.get("entities") != manifest["entities"]:
+        write_parquet(df.select(entity_columns), root / ENTITY_FILE_NAME)
+
+    for name, group in groups.items():
+        entry = {
+            "version": group.version,
+            "columns": group.columns,
+            "file": f"{name}/{group.version}.parquet",
+            "fingerprint": memoize.frame_fingerprint(df.select(group.columns)),
+            "entities": manifest["entities"]["fingerprint"],
+        }
+        manifest["groups"][name] = entry
+        if previous.get("groups", {}).get(name) == entry:
+            logging.info(f"Feature group {name} unchanged ({group.version})")
+            continue
+
+        logging.info(f"Writing feature group {name} ({group.version})")
+        write_parquet(df.select(group.columns), root / entry["file"])
+
+    (root / MANIFEST_FILE_NAME).write_text(json.dumps(manifest, indent=2, sort_keys=True))
+
+    # Files of previous versions and of removed groups, once the manifest no longer points at them
+    current_files = {entry["file"] for entry in manifest["groups"].values()}
+    for entry in previous.get("groups", {}).values():
+        if entry["file"] not in current_files:
+            (root / entry["file"]).unlink(missing_ok=True)
+    return manifest
+
+
+def groups_of(manifest: dict, columns: list[str]) -> dict[str, list[str]]:
+    "The requested columns of each group holding some of them, raises ValueError for columns of no group"
+    group_of_column = {column: name for name, entry in manifest.get("groups", {}).items() for column in entry["columns"]}
+    unknown = [column for column in columns if column not in group_of_column and column not in conf.feature_store_entity_columns]
+    if unknown:
+        raise ValueError(f"Columns in no feature group: {unknown}")
+
+    groups: dict[str, list[str]] = {}
+    for column in columns:
+        if column in group_of_column:
+            groups.setdefault(group_of_column[column], []).append(column)
+    return groups
+
+
+def group_versions(columns: list[str], folder: str = conf.feature_store_folder) -> dict[str, str]:
+    "Version of every group read for columns"
+    manifest = load_manifest(folder)
+    return {name: manifest["groups"][name]["version"] for name in groups_of(manifest, columns)}
+
+
+def read(columns: list[str], folder: str = conf.feature_store_folder) -> pl.DataFrame:
+    """
+    The entity keys and the requested columns of every row, reading only the groups holding them.
+    Raises FileNotFoundError when nothing has been stored, ValueError for unknown columns or misaligned groups.
+    """
+    manifest = load_manifest(folder)
+    if not manifest:
+        raise FileNotFoundError(f"No feature store in {folder}")
+
+    root = Path(folder)
+    frames = [pl.read_parquet(root / manifest["entities"]["file"])]
+    for name, group_columns in groups_of(manifest, columns).items():
+        entry = manifest["groups"][name]
+        if entry["entities"] != manifest["entities"]["fingerprint"]:
+            raise ValueError(f"Feature group {name} is not aligned with the stored entities")
+        logging.info(f"Reading {len(group_columns)} of {len(entry['columns'])} columns of feature group {name} ({entry['version']})")
+        frames.append(pl.read_parquet(root / entry["file"], columns=group_columns))
+
+    df = pl.concat(frames, how="horizontal")
+    return df.select(*conf.feature_store_entity_columns, *(column for column in dict.fromkeys(columns) if column not in conf.feature_store_entity_columns))
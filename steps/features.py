@@ -0,0 +1,78 @@
+"""
+Declarative feature registry, see 03_base.BASE_TRANSFORMS.
+
+Every transform of the base layer declares the columns it reads, the columns it writes and its relative cost.
+Transforms run in the order they are registered, and each one depends on the latest transforms before it writing
+the columns it reads, which gives the dependency DAG. A consumer asking for a list of columns only runs the
+transforms that write them and their ancestors in that DAG, e.g. training skips the rating replays when its
+feature set has no rating. Row filters and orderings write no column and always run, since every column depends
+on the rows they keep.
+"""
+
+import logging
+from collections.abc import Callable
+from typing import NamedTuple
+
+import polars as pl
+
+# Relative costs
+ROW_WISE = 1  # expressions over each row
+WINDOW = 10  # sorts, joins and windows over the whole frame
+REPLAY = 100  # eager sequential replays of the history
+
+
+class Transform(NamedTuple):
+    func: Callable[[pl.LazyFrame], pl.LazyFrame]
+    inputs: list[str]
+    outputs: list[str]  # columns added or overwritten, none for row filters and orderings
+    cost: int
+
+
+def dependencies(transforms: dict[str, Transform], input_columns: list[str]) -> dict[str, set[str]]:
+    """
+    The transforms each transform depends on: the latest ones before it writing each of its inputs.
+    Raises ValueError for an input neither in input_columns nor written by an earlier transform.
+    """
+    writers: dict[str, str] = {}
+    edges = {}
+    for name, transform in transforms.items():
+        unknown = [column for column in transform.inputs if column not in writers and column not in input_columns]
+        if unknown:
+            raise ValueError(f"{name} reads columns that no earlier transform writes: {unknown}")
+        edges[name] = {writers[column] for column in transform.inputs if column in writers}
+        writers.update(dict.fromkeys(transform.outputs, name))
+    return edges
+
+
+def resolve(transforms: dict[str, Transform], input_columns: list[str], columns: list[str]) -> list[str]:
+    """
+    Names of the transforms computing columns, in registration order: the latest writer of each column,
+    the row filters and orderings, and everything they depend on.
+    Raises ValueError for a column neither in input_columns nor written by a transform.
+    """
+    edges = dependencies(transforms, input_columns)
+    writers = {column: name for name, transform in transforms.items() for column in transform.outputs}
+    unknown = [column for column in columns if column not in writers and column not in input_columns]
+    if unknown:
+        raise ValueError(f"Unknown feature columns: {unknown}")
+
+    pending = [writers[column] for column in columns if column in writers] + [name for name, transform in transforms.items() if not transform.outputs]
+    selected: set[str] = set()
+    while pending:
+        name = pending.pop()
+        if name not in selected:
+            selected.add(name)
+            pending.extend(edges[name])
+
+    skipped = [name for name in transforms if name not in selected]
+    skipped_cost, total_cost = sum(transforms[name].cost for name in skipped), sum(transform.cost for transform in transforms.values())
+    logging.info(f"Running {len(selected)} of {len(transforms)} feature transforms, skipping {skipped} (cost {skipped_cost} of {total_cost})")
+    return [name for name in transforms if name in selected]
+
+
+def apply(lf: pl.LazyFrame, transforms: dict[str, Transform], selected: list[str] | None = None) -> pl.LazyFrame:
+    "Pipes lf through the selected transforms (all when None) in registration order"
+    for name, transform in transforms.items():
+        if selected is None or name in selected:
+            lf = lf.pipe(transform.func)
+    return lf
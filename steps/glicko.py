@@ -0,0 +1,283 @@
+"""
+Glicko-2 ratings of lifters (Glickman, "Example of the Glicko-2 system"), see 03_base.add_glicko_rating.
+
+Meets are grouped into rating periods of conf.GLICKO_RATING_PERIOD. Within a period, every lifter plays every other
+lifter of their segment (sex + weight class) at each meet, beating lower totals, and all games are rated from the
+ratings before the period. A period is therefore one batch of vectorized operations over all of its games,
+and the full history a few hundred batches.
+
+Lifters who do not compete see their rating deviation grow every period, up to conf.GLICKO_INITIAL_RD.
+The state of every lifter rated in a period is logged at its end (rating_checkpoints), with a fingerprint of the
+history up to it, so a replay can resume from any period whose history is unchanged.
+Ratings are held on the Glicko-2 scale (mu, phi) internally and in the checkpoints.
+"""
+
+import datetime
+import hashlib
+import itertools
+from typing import NamedTuple
+
+import conf
+import memoize
+import numpy as np
+import polars as pl
+
+# Columns the ratings are computed from, any change in them up to a period invalidates its checkpoint
+GLICKO_INPUT_COLUMNS = ["lifter_id", "meet_name", "date", "sex", "ipf_weight_class", "total"]
+PERIOD_ORIGIN = datetime.date(1900, 1, 1)  # a Monday and a year start, so periods of any usual length start on it
+MAX_VOLATILITY_ITERATIONS = 100
+
+state_schema = {
+    "period": pl.Date,
+    "history_fingerprint": pl.Utf8,
+    "lifter_id": pl.UInt32,
+    "mu": pl.Float64,
+    "phi": pl.Float64,
+    "sigma": pl.Float64,
+}
+
+
+class RatingState(NamedTuple):
+    "Glicko-2 state indexed by lifter_index (see plan_glicko)"
+
+    mu: np.ndarray
+    phi: np.ndarray
+    sigma: np.ndarray
+    last_period: np.ndarray  # period number (see period_numbers) the lifter was last rated in, -1 if never
+
+
+def period_expr() -> pl.Expr:
+    "Start date of the rating period of each row"
+    return pl.col("date").dt.truncate(conf.GLICKO_RATING_PERIOD)
+
+
+def period_numbers(periods: pl.Series) -> np.ndarray:
+    "Number of each period (a period start date) counted from PERIOD_ORIGIN, -1 for nulls"
+    if periods.null_count() == len(periods):
+        return np.full(len(periods), -1, dtype=np.int64)
+    calendar = pl.date_range(PERIOD_ORIGIN, periods.max(), interval=conf.GLICKO_RATING_PERIOD, eager=True)
+    numbers = calendar.search_sorted(periods.fill_null(PERIOD_ORIGIN)).cast(pl.Int64).to_numpy()
+    return np.where(periods.is_null().to_numpy(), -1, numbers)
+
+
+def plan_glicko(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Orders the rows of df by period then game group (meet and segment) and adds the static part of the computation:
+    - row: position in df, lifter_index: dense index of the lifter ID among the lifters of df
+    - period_number: see period_numbers, period_lifter: dense ID of the lifter within the period
+    - group_start, group_size: position of the first row of the game group in the plan and its number of lifters
+    """
+    plan = df.select(
+        pl.int_range(pl.len(), dtype=pl.Int64).alias("row"),
+        (pl.col("lifter_id").rank("dense") - 1).cast(pl.Int64).alias("lifter_index"),
+        period_expr().alias("period"),
+        "date",
+        "meet_name",
+        "sex",
+        "ipf_weight_class",
+        # Missing totals rank as 0
+        pl.col("total").fill_null(0.0).alias("rank_total"),
+    ).sort(["period", "date", "meet_name", "sex", "ipf_weight_class", "row"], nulls_last=True)
+
+    is_new_group = pl.any_horizontal(pl.col(c).ne_missing(pl.col(c).shift(1)) for c in ["date", "meet_name", "sex", "ipf_weight_class"]).fill_null(True)
+    plan = plan.with_columns(pl.when(is_new_group).then(pl.int_range(pl.len(), dtype=pl.Int64)).forward_fill().alias("group_start"))
+
+    return plan.select(
+        "row",
+        "lifter_index",
+        pl.Series("period_number", period_numbers(plan["period"])),
+        (pl.col("lifter_index").rank("dense").over("period") - 1).cast(pl.Int64).alias("period_lifter"),
+        "group_start",
+        pl.len().over("group_start").cast(pl.Int64).alias("group_size"),
+        "rank_total",
+    )
+
+
+def initial_state(lifter_ids: pl.Series, state_df: pl.DataFrame | None = None) -> RatingState:
+    "State to replay from, for the lifters of lifter_ids: from a rating state (see state_as_of) when given, initial for new lifters"
+    lifters = lifter_ids.unique().sort().to_frame("lifter_id")
+    if state_df is None:
+        state_df = pl.DataFrame(schema=state_schema)
+    lifters = lifters.join(state_df.select("lifter_id", "period", "mu", "phi", "sigma"), on="lifter_id", how="left", maintain_order="left")
+
+    return RatingState(
+        mu=lifters["mu"].fill_null(0.0).to_numpy(writable=True),
+        phi=lifters["phi"].fill_null(conf.GLICKO_INITIAL_RD / conf.GLICKO_SCALE).to_numpy(writable=True),
+        sigma=lifters["sigma"].fill_null(conf.GLICKO_INITIAL_VOLATILITY).to_numpy(writable=True),
+        last_period=period_numbers(lifters["period"]),
+    )
+
+
+def update_volatility(phi: np.ndarray, sigma: np.ndarray, v: np.ndarray, delta: np.ndarray) -> np.ndarray:
+    "New volatility of each player (step 5 of Glickman's algorithm), the Illinois iterations run on all players at once"
+    tau, tolerance = conf.GLICKO_TAU, conf.GLICKO_VOLATILITY_TOLERANCE
+    a = np.log(sigma**2)
+    excess = delta**2 - phi**2 - v
+
+    def f(x: np.ndarray) -> np.ndarray:
+        ex = np.exp(x)
+        return ex * (excess - ex) / (2 * (phi**2 + v + ex) ** 2) - (x - a) / tau**2
+
+    A = a
+    B = np.where(excess > 0, np.log(np.where(excess > 0, excess, 1.0)), a - tau)
+    below = (excess <= 0) & (f(B) < 0)
+    for k in itertools.count(2):
+        if not below.any():
+            break
+        B = np.where(below, a - k * tau, B)
+        below &= f(B) < 0
+
+    f_A, f_B = f(A), f(B)
+    for _ in range(MAX_VOLATILITY_ITERATIONS):
+        active = np.abs(B - A) > tolerance
+        if not active.any():
+            break
+        C = A + (A - B) * f_A / np.where(active, f_B - f_A, 1.0)
+        f_C = f(C)
+        swap = f_C * f_B <= 0
+        A, f_A = np.where(active & swap, B, A), np.where(active, np.where(swap, f_B, f_A / 2), f_A)
+        B, f_B = np.where(active, C, B), np.where(active, f_C, f_B)
+
+    return np.exp(A / 2)
+
+
+def replay_glicko(plan: pl.DataFrame, state: RatingState) -> tuple[np.ndarray, np.ndarray, np.ndarray, pl.DataFrame]:
+    """
+    Replays the periods of a plan (see plan_glicko), updating state in place.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray, pl.DataFrame]: Rating, rating deviation and volatility before the
+        period of each row (in the row order of the frame the plan was made from), and the state log:
+        lifter_index, period_number, mu, phi and sigma of every lifter rated in a period, at its end.
+    """
+    n = plan.height
+    rows = plan["row"].to_numpy()
+    lifter_indexes = plan["lifter_index"].to_numpy()
+    row_periods = plan["period_number"].to_numpy()
+    period_lifters = plan["period_lifter"].to_numpy()
+    group_starts = plan["group_start"].to_numpy()
+    group_sizes = plan["group_size"].to_numpy()
+    totals = plan["rank_total"].to_numpy()
+
+    period_bounds = np.append(np.flatnonzero(np.diff(row_periods, prepend=-1)), n)
+    max_phi = conf.GLICKO_INITIAL_RD / conf.GLICKO_SCALE
+
+    rating, rd, volatility = np.empty(n), np.empty(n), np.empty(n)
+    log = []
+
+    for start, end in itertools.pairwise(period_bounds):
+        period = row_periods[start]
+        local = period_lifters[start:end]
+        lifters = np.empty(local.max() + 1, dtype=np.int64)
+        lifters[local] = lifter_indexes[start:end]
+
+        # Ratings before the period, the deviation grows over the periods the lifter was not rated in
+        last = state.last_period[lifters]
+        idle_periods = np.where(last >= 0, period - last - 1, 0)
+        mu, sigma = state.mu[lifters], state.sigma[lifters]
+        phi = np.minimum(np.sqrt(state.phi[lifters] ** 2 + idle_periods * sigma**2), max_phi)
+
+        period_rows = rows[start:end]
+        rating[period_rows] = conf.GLICKO_SCALE * mu[local] + conf.GLICKO_INITIAL_RATING
+        rd[period_rows] = conf.GLICKO_SCALE * phi[local]
+        volatility[period_rows] = sigma[local]
+
+        # Games: every ordered pair of rows of a group, i against j
+        sizes = group_sizes[start:end]
+        players = np.flatnonzero(sizes > 1)
+        if len(players) == 0:
+            continue
+        counts = sizes[players]
+        i = np.repeat(players, counts)
+        j = np.repeat(group_starts[start:end][players] - start, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        i, j = i[i != j], j[i != j]
+
+        score = (totals[start + i] > totals[start + j]) + 0.5 * (totals[start + i] == totals[start + j])
+        player, opponent = local[i], local[j]
+        g = 1 / np.sqrt(1 + 3 * phi[opponent] ** 2 / np.pi**2)
+        expected = 1 / (1 + np.exp(-g * (mu[player] - mu[opponent])))
+
+        n_local = len(lifters)
+        rated = np.bincount(player, minlength=n_local) > 0
+        v = 1 / np.bincount(player, weights=g**2 * expected * (1 - expected), minlength=n_local)[rated]
+        improvement = np.bincount(player, weights=g * (score - expected), minlength=n_local)[rated]
+
+        new_sigma = update_volatility(phi[rated], sigma[rated], v, v * improvement)
+        new_phi = 1 / np.sqrt(1 / (phi[rated] ** 2 + new_sigma**2) + 1 / v)
+        new_mu = mu[rated] + new_phi**2 * improvement
+
+        rated_lifters = lifters[rated]
+        state.mu[rated_lifters], state.phi[rated_lifters], state.sigma[rated_lifters] = new_mu, new_phi, new_sigma
+        state.last_period[rated_lifters] = period
+        log.append((rated_lifters, np.full(len(rated_lifters), period), new_mu, new_phi, new_sigma))
+
+    columns = ["lifter_index", "period_number", "mu", "phi", "sigma"]
+    log_df = pl.DataFrame(dict(zip(columns, map(np.concatenate, zip(*log, strict=True)), strict=True)) if log else {c: [] for c in columns})
+    return rating, rd, volatility, log_df.cast({"lifter_index": pl.Int64, "period_number": pl.Int64, "mu": pl.Float64, "phi": pl.Float64, "sigma": pl.Float64})
+
+
+def glicko_ratings(df: pl.DataFrame, state_df: pl.DataFrame | None = None) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """
+    Glicko-2 ratings of the rows of df, starting from a rating state (see state_as_of) when given.
+
+    Returns:
+        tuple[pl.DataFrame, pl.DataFrame]: glicko_rating, glicko_rd and glicko_volatility before the period of each row,
+        in the row order of df, and the state log of the periods of df (state_schema without the fingerprint).
+    """
+    lifters = df["lifter_id"].unique().sort()
+    rating, rd, volatility, log_df = replay_glicko(plan_glicko(df), initial_state(lifters, state_df))
+
+    periods = df.select(period_expr().alias("period")).unique()
+    periods = periods.with_columns(pl.Series("period_number", period_numbers(periods["period"])))
+
+    features_df = pl.DataFrame({"glicko_rating": rating, "glicko_rd": rd, "glicko_volatility": volatility})
+    log_df = log_df.with_columns(lifters.gather(log_df["lifter_index"]).alias("lifter_id")).join(periods, on="period_number", how="left", maintain_order="left")
+    return features_df, log_df.select("period", "lifter_id", "mu", "phi", "sigma")
+
+
+def period_fingerprints(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Fingerprint of the history up to each period of df: the Glicko inputs of its rows (in any order), chained period
+    by period, and the Glicko code and constants. Two frames share the fingerprint of a period only if all their rows
+    up to it are the same.
+    """
+    row_hashes = df.select(period_expr().alias("period"), pl.struct(GLICKO_INPUT_COLUMNS).hash(seed=0).alias("row_hash")).group_by("period").agg(pl.col("row_hash").sort()).sort("period")
+
+    digest = hashlib.sha256("".join(memoize.code_fingerprint(func) for func in [plan_glicko, replay_glicko, initial_state]).encode())
+    fingerprints = []
+    for period, hashes in row_hashes.iter_rows():
+        digest.update(f"{period}:".encode())
+        digest.update(np.array(hashes, dtype=np.uint64).tobytes())
+        fingerprints.append(digest.hexdigest())
+
+    return row_hashes.select("period", pl.Series("history_fingerprint", fingerprints, dtype=pl.Utf8))
+
+
+def latest_valid_period(checkpoints_df: pl.DataFrame, fingerprints_df: pl.DataFrame) -> datetime.date | None:
+    "Latest period of checkpoints_df (see rating_checkpoints) with the same history as the frame of fingerprints_df (see period_fingerprints)"
+    matching = checkpoints_df.select("period", "history_fingerprint").unique().join(fingerprints_df, on=["period", "history_fingerprint"])
+    return matching["period"].max()
+
+
+def state_as_of(checkpoints_df: pl.DataFrame, period: datetime.date) -> pl.DataFrame:
+    "State of every lifter rated up to period: their row of the latest period they were rated in"
+    return checkpoints_df.filter(pl.col("period") <= period).sort("period").group_by("lifter_id", maintain_order=True).last()
+
+
+def rating_checkpoints(df: pl.DataFrame, previous_checkpoints_df: pl.DataFrame | None = None) -> pl.DataFrame:
+    """
+    State log of the periods of df (state_schema): every lifter rated in a period with their state at its end,
+    and the fingerprint of the history up to it.
+    The periods of previous_checkpoints_df still valid for df are reused, only the ones after them are replayed.
+    """
+    fingerprints_df = period_fingerprints(df)
+    resume_period = None if previous_checkpoints_df is None else latest_valid_period(previous_checkpoints_df, fingerprints_df)
+
+    if resume_period is None:
+        kept_df = pl.DataFrame(schema=state_schema).drop("history_fingerprint")
+        _, log_df = glicko_ratings(df)
+    else:
+        kept_df = previous_checkpoints_df.filter(pl.col("period") <= resume_period).drop("history_fingerprint")
+        _, log_df = glicko_ratings(df.filter(period_expr() > resume_period), state_as_of(previous_checkpoints_df, resume_period))
+
+    return pl.concat([kept_df, log_df], how="vertical_relaxed").join(fingerprints_df, on="period", how="left").select(state_schema.keys()).cast(state_schema)
@@ -0,0 +1,157 @@
+"""
+Identity resolution of lifters, see 03_raw.add_primary_key.
+
+OpenPowerlifting has no lifter identifier, a lifter is a name (lifters of the same name are only sometimes told apart
+with a "#2" suffix) and an age at each meet, which gives an interval of possible birth years (03_raw.add_birth_year).
+Rows are blocked on their normalized name and sex, names being normalized once per distinct name (see blocks), and
+within a block the rows of one lifter share a birth year: a lifter is a group of rows whose birth-year intervals
+intersect.
+
+Lifters are found by a sweep of the rows of each block in order of interval start: a row joins the current lifter
+while it starts before every interval of the lifter ends, i.e. while their intersection keeps a non-zero width, and
+starts the next lifter otherwise. After a single sort, every block is swept at once, one vectorized step per lifter
+rank within a block (sweep_lifters), instead of comparing the lifters of a block pairwise.
+
+Rows without an age join the lifter of their block when it has only one, otherwise they form a lifter of their own.
+The confidence of a lifter is how far its birth years are from those of the nearest other lifter of its block
+(see lifter_confidence).
+
+Test cases:
+- Elizabeth Nguyen for three different lifters
+- Joshua Luu for ages recorded inconsistently across meets
+"""
+
+from typing import NamedTuple
+
+import conf
+import numpy as np
+import polars as pl
+import strings
+
+
+def normalized_name(names: pl.Expr) -> pl.Expr:
+    "Lowercase names with spaces as dashes, e.g. john-paul-cauchi"
+    return names.str.strip_chars().str.to_lowercase().str.replace_all(" ", "-", literal=True)
+
+
+class Blocks(NamedTuple):
+    "Blocking key of the rows of a frame, see blocks"
+
+    codes: pl.Series  # Int64 code of the block of each row, null without a name or sex
+    names: pl.Series  # normalized name of each name code
+    sexes: pl.Series  # lowercase sex of each sex code
+
+    def keys(self, codes: pl.Series) -> pl.Series:
+        "Block key of block codes, normalized name and lowercase sex, e.g. john-paul-cauchi-m"
+        return self.names.gather(codes // len(self.sexes)) + "-" + self.sexes.gather(codes % len(self.sexes))
+
+
+def blocks(df: pl.DataFrame) -> Blocks:
+    """
+    Blocks of the rows of df (name, sex), as integer codes: names are normalized once per distinct name and encoded
+    by their normalized name (see strings.py), the block code combines that code with the one of the sex.
+    """
+    encoded = df.select(strings.dictionary_encode(pl.col("name")), strings.dictionary_encode(pl.col("sex").cast(pl.Utf8)))
+    normalized = pl.select(strings.dictionary_encode(normalized_name(pl.lit(encoded["name"].cat.get_categories())))).to_series()
+    sexes = encoded["sex"].cat.get_categories().str.to_lowercase()
+    name_codes = normalized.to_physical().gather(encoded["name"].to_physical()).cast(pl.Int64)
+    return Blocks(name_codes * len(sexes) + encoded["sex"].to_physical(), normalized.cat.get_categories(), sexes)
+
+
+def sweep_lifters(block_codes: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """
+    Lifter rank within its block (in order of birth years) of each interval, the intervals sorted by block (integer
+    codes), start then end.
+
+    An interval joins the lifter of the intervals before it when it starts before the least end among them.
+    Starts only grow and that least end only shrinks along a block, so the intervals joining the first lifter of a
+    block are a prefix of it: each step takes that prefix from every block and sweeps the intervals left.
+    """
+    lifters = np.empty(len(block_codes), dtype=np.uint32)
+    remaining = np.arange(len(block_codes))
+    # Each block is shifted below the ones before it, so one running minimum restarts at every block
+    span = ends.max() - ends.min() + 1 if len(ends) else 0
+    rank = 0
+    while len(remaining):
+        block, start, end = block_codes[remaining], starts[remaining], ends[remaining]
+        is_block_start = np.diff(block, prepend=-1) != 0
+        least_end = np.minimum.accumulate(end - block * span) + block * span
+        least_end_before = np.where(is_block_start, np.inf, np.roll(least_end, 1))
+        failures = np.cumsum(start >= least_end_before)
+        in_prefix = failures == np.maximum.accumulate(np.where(is_block_start, failures, 0))
+        lifters[remaining[in_prefix]] = rank
+        remaining = remaining[~in_prefix]
+        rank += 1
+    return lifters
+
+
+def lifter_confidence(separation_years: float = conf.IDENTITY_SEPARATION_YEARS) -> pl.Expr:
+    """
+    Confidence of each lifter of a frame sorted by block_code and lifter (birth_year_low, birth_year_high: intersection
+    of its intervals) from the gap to the birth years of the lifters before and after it in its block, 0 when it
+    could be either of them, 1 from separation_years apart and for the only lifter of a block.
+    """
+    gap_before = pl.when(pl.col("block_code") == pl.col("block_code").shift(1)).then(pl.col("birth_year_low") - pl.col("birth_year_high").shift(1))
+    gap_after = pl.when(pl.col("block_code") == pl.col("block_code").shift(-1)).then(pl.col("birth_year_low").shift(-1) - pl.col("birth_year_high"))
+    return (pl.min_horizontal(gap_before, gap_after) / separation_years).clip(0.0, 1.0).fill_null(1.0)
+
+
+def resolve_identities(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Lifter of each row of df (name, sex, date, birth_year, min_birth_year, max_birth_year), see the module docstring.
+
+    Returns:
+        pl.DataFrame: one row per row of df, in its order, with
+        - primary_key: block key and the birth year estimate of the lifter's first meet, e.g. john-paul-cauchi-m-1996,
+          the block key alone for a lifter without any age. Later meets only narrow the lifter's birth years, so the
+          key is kept as its history grows.
+        - identity_confidence: confidence of the lifter, see lifter_confidence, 0 for the rows without an age of a
+          block with several lifters.
+    """
+    block = blocks(df)
+    rows = df.select(
+        pl.int_range(pl.len(), dtype=pl.UInt32).alias("row"),
+        pl.lit(block.codes).alias("block_code"),
+        "date",
+        "birth_year",
+        pl.col("min_birth_year").alias("start"),
+        pl.col("max_birth_year").alias("end"),
+    )
+
+    blocked = rows.drop_nulls("block_code").sort("block_code", "start", "end", nulls_last=True, maintain_order=True)
+    dated = blocked.drop_nulls("start")
+    dated = dated.with_columns(pl.Series("lifter", sweep_lifters(dated["block_code"].to_numpy(), dated["start"].to_numpy(), dated["end"].to_numpy())))
+    # Ranks only grow along a block, so the rows of a lifter are consecutive: lifters are numbered in that order,
+    # and their columns are computed once per lifter and gathered back to the rows by that number
+    is_new_lifter = (pl.col("block_code") != pl.col("block_code").shift(1)) | (pl.col("lifter") != pl.col("lifter").shift(1))
+    dated = dated.with_columns((is_new_lifter.fill_null(True).cum_sum() - 1).cast(pl.UInt32).alias("lifter_index"))
+    lifters = (
+        dated.group_by("lifter_index")
+        .agg(
+            pl.col("block_code").first(),
+            pl.col("start").max().alias("birth_year_low"),
+            pl.col("end").min().alias("birth_year_high"),
+            # Ties on the date of the first meet are broken by the sweep order, the same in every build
+            pl.col("birth_year").get(pl.col("date").arg_min()).alias("key_birth_year"),
+        )
+        .sort("lifter_index")
+        .with_columns(lifter_confidence().alias("identity_confidence"))
+    )
+    lifters = lifters.with_columns((block.keys(lifters["block_code"]) + "-" + lifters["key_birth_year"].cast(pl.Utf8)).alias("primary_key"))
+
+    # Rows without an age: the lifter of their block when it is the only one, otherwise a lifter of their own
+    block_lifters = lifters.group_by("block_code").agg(pl.len().alias("block_lifters"), pl.col("lifter_index").first())
+    undated = blocked.filter(pl.col("start").is_null()).select("row", "block_code").join(block_lifters, on="block_code", how="left")
+    sole_df = undated.filter(pl.col("block_lifters") == 1)
+    own_df = undated.filter(pl.col("block_lifters").is_null() | (pl.col("block_lifters") > 1))
+    own_confidence = pl.when(pl.col("block_lifters").is_null()).then(1.0).otherwise(0.0)
+    own_df = own_df.with_columns(block.keys(own_df["block_code"]).alias("primary_key"), own_confidence.alias("identity_confidence"))
+
+    lifter_of_row = pl.repeat(None, df.height, dtype=pl.UInt32, eager=True)
+    lifter_of_row = lifter_of_row.scatter(dated["row"], dated["lifter_index"]).scatter(sole_df["row"], sole_df["lifter_index"])
+    return pl.DataFrame(
+        [
+            lifters["primary_key"].gather(lifter_of_row).scatter(own_df["row"], own_df["primary_key"]),
+            lifters["identity_confidence"].gather(lifter_of_row).scatter(own_df["row"], own_df["identity_confidence"]),
+        ]
+    )
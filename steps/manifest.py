@@ -0,0 +1,64 @@
+"""
+Content-addressed manifest of the artifacts written to S3.
+
+Each entry records the checksum, row count and schema hash of an artifact, plus the checksums of the
+upstream artifacts it was built from. Uploads whose checksum matches the manifest are skipped, and
+scripts/download-data.sh uses it to tell stale local files from fresh ones.
+"""
+
+import datetime
+import hashlib
+import json
+from pathlib import Path
+
+import conf
+import polars as pl
+
+HASH_BLOCK_SIZE_BYTES = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with Path(path).open("rb") as f:
+        while block := f.read(HASH_BLOCK_SIZE_BYTES):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def bytes_sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def schema_hash(schema: pl.Schema) -> str:
+    "Hash of the column names and dtypes, changes whenever a column is added, dropped, renamed or retyped"
+    return bytes_sha256(json.dumps([[name, str(dtype)] for name, dtype in schema.items()]).encode())
+
+
+def upstream_keys(s3_key: str) -> list[str]:
+    "Looks up the upstream artifacts of an S3 key in conf.artifact_upstreams, matching files under a partitioned prefix too"
+    for artifact_key, upstreams in conf.artifact_upstreams.items():
+        if s3_key == artifact_key or s3_key.startswith(f"{artifact_key}/"):
+            return upstreams
+    return []
+
+
+def is_unchanged(manifest: dict, s3_key: str, sha256: str) -> bool:
+    return manifest.get("artifacts", {}).get(s3_key, {}).get("sha256") == sha256
+
+
+def record_artifact(manifest: dict, s3_key: str, sha256: str, parquet_source) -> dict:
+    """
+    Adds or replaces the manifest entry of an artifact.
+    parquet_source is anything pl.scan_parquet accepts (a path or an in-memory buffer), only its metadata is read.
+    """
+    parquet_lf = pl.scan_parquet(parquet_source)
+    artifacts = manifest.setdefault("artifacts", {})
+    artifacts[s3_key] = {
+        "sha256": sha256,
+        "row_count": parquet_lf.select(pl.len()).collect().item(),
+        "schema_hash": schema_hash(parquet_lf.collect_schema()),
+        "upstream": {key: artifacts.get(key, {}).get("sha256") for key in upstream_keys(s3_key)},
+        "updated_at": datetime.datetime.now(datetime.UTC).isoformat(timespec="seconds"),
+    }
+    manifest["updated_at"] = artifacts[s3_key]["updated_at"]
+    return manifest
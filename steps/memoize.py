@@ -0,0 +1,141 @@
+"""
+On-disk memoization of pipeline stages, enabled with STAGE_CACHE=1.
+
+A stage output is keyed on the content of its input frame (row count, schema and row hashes) and on the code
+that produced it: the source of the stage, of every function in its module it calls (transitively) or holds in a
+registry it reads and in the pipeline modules it uses, the values of the conf constants they read, and the
+reference tables (e.g. the meet types of 03_base.add_meet_type).
+Rerunning after a failure or a tweak to one transform therefore resumes from the last stage whose inputs and code are unchanged.
+Entries live in conf.stage_cache_folder and the least recently used ones are evicted above conf.STAGE_CACHE_MAX_BYTES.
+"""
+
+import functools
+import hashlib
+import inspect
+import logging
+import os
+import types
+from pathlib import Path
+
+import conf
+import polars as pl
+
+
+def frame_fingerprint(df: pl.DataFrame) -> str:
+    "Hash of the row count, schema and content of a frame, row order included"
+    digest = hashlib.sha256(f"{df.height}:{[(name, str(dtype)) for name, dtype in df.schema.items()]}".encode())
+    digest.update(df.hash_rows(seed=0).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _code_objects(code: types.CodeType):
+    "A code object and the nested ones of its comprehensions, lambdas and inner functions"
+    yield code
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            yield from _code_objects(const)
+
+
+def _functions_in(value) -> list[types.FunctionType]:
+    "Functions held in a registry, e.g. a dict of NamedTuples whose fields include functions"
+    if isinstance(value, types.FunctionType):
+        return [value]
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        return [fn for item in value for fn in _functions_in(item)]
+    return []
+
+
+def code_fingerprint(func) -> str:
+    """
+    Hash of the source of a function, of the functions of its module and of the pipeline modules it references
+    (transitively) and of the conf constants any of them read, including default argument values.
+    """
+    digest = hashlib.sha256()
+    seen: set[tuple[str, str]] = set()
+    pending = [func]
+
+    while pending:
+        fn = inspect.unwrap(pending.pop())
+        if (fn.__module__, fn.__qualname__) in seen:
+            continue
+        seen.add((fn.__module__, fn.__qualname__))
+
+        digest.update(inspect.getsource(fn).encode())
+        digest.update(repr(fn.__defaults__).encode())
+
+        for code in _code_objects(fn.__code__):
+            for name in code.co_names:
+                value = fn.__globals__.get(name)
+                if isinstance(value, types.FunctionType) and inspect.unwrap(value).__module__ == fn.__module__:
+                    pending.append(value)
+                elif isinstance(value, (dict, list, tuple)) and (registered := [f for f in _functions_in(value) if inspect.unwrap(f).__module__ == fn.__module__]):
+                    # A registry of the module's functions (e.g. 03_base.LIFTER_TRANSFORMS), applied by name
+                    pending.extend(registered)
+                elif isinstance(value, types.ModuleType) and value is not conf and Path(getattr(value, "__file__", "")).parent == Path(__file__).parent:
+                    # Another pipeline module (e.g. elo), any of its functions may be called
+                    pending.extend(member for member in vars(value).values() if isinstance(member, types.FunctionType) and member.__module__ == value.__name__)
+                elif not name.startswith("_") and hasattr(conf, name) and not callable(getattr(conf, name)) and not isinstance(getattr(conf, name), types.ModuleType):
+                    digest.update(f"{name}={getattr(conf, name)!r}".encode())
+
+    return digest.hexdigest()
+
+
+def reference_tables_fingerprint(folder: str = conf.reference_tables_local_folder_name) -> str:
+    "Hash of the names and content of the reference tables, which transforms read like conf constants"
+    digest = hashlib.sha256()
+    for path in sorted(Path(folder).glob("*.csv")):
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def evict_least_recently_used(folder: Path, max_bytes: int) -> None:
+    "Deletes the entries read or written longest ago until the cache fits in max_bytes"
+    entries = sorted(folder.glob("*.parquet"), key=lambda path: path.stat().st_mtime)
+    total_bytes = sum(path.stat().st_size for path in entries)
+
+    for path in entries:
+        if total_bytes <= max_bytes:
+            break
+        total_bytes -= path.stat().st_size
+        path.unlink()
+        logging.info(f"Evicted stage cache entry: {path.name}")
+
+
+def stage(func):
+    """
+    Memoizes a LazyFrame -> LazyFrame stage on disk when conf.STAGE_CACHE is set.
+    The input and output are materialized at the stage boundary, disabled the stage stays part of the lazy plan.
+    """
+
+    @functools.wraps(func)
+    def wrapper(lf: pl.LazyFrame, *args, **kwargs) -> pl.LazyFrame:
+        if not conf.STAGE_CACHE:
+            return func(lf, *args, **kwargs)
+
+        input_df = lf.collect()
+        key = hashlib.sha256(
+            f"{func.__qualname__}:{pl.__version__}:{frame_fingerprint(input_df)}:{code_fingerprint(func)}:{reference_tables_fingerprint()}:{args!r}:{sorted(kwargs.items())!r}".encode()
+        ).hexdigest()
+
+        folder = Path(conf.stage_cache_folder)
+        path = folder / f"{func.__name__}-{key[:16]}.parquet"
+        if path.exists():
+            logging.info(f"Stage cache hit: {func.__name__}")
+            os.utime(path)  # marks the entry as recently used
+            return pl.read_parquet(path).lazy()
+
+        logging.info(f"Stage cache miss: {func.__name__}")
+        output_df = func(input_df.lazy(), *args, **kwargs).collect()
+
+        folder.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        output_df.write_parquet(tmp_path)
+        tmp_path.replace(path)
+        evict_least_recently_used(folder, conf.STAGE_CACHE_MAX_BYTES)
+
+        return output_df.lazy()
+
+    return wrapper
@@ -0,0 +1,96 @@
+"""
+Runs the pipeline steps in a single process as a DAG.
+
+Each stage hands its output (Arrow-backed polars frames) to its downstream stages in memory,
+instead of them re-reading it from S3. Independent branches run concurrently, e.g. describe and analyses.
+Persistence is a background side effect of each stage (see common_io.io_run_in_background),
+and is only waited on once every stage has finished.
+
+Usage:
+    uv run python steps/pipeline.py [--skip extract load] [--with-train]
+"""
+
+import argparse
+import importlib
+import logging
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import NamedTuple
+
+import common_io
+import conf
+
+
+class Stage(NamedTuple):
+    module: str  # step module exposing run(*upstream_outputs)
+    upstream: list[str]
+
+
+STAGES = {
+    "extract": Stage("01_extract", []),
+    "load": Stage("02_load", []),
+    "raw": Stage("03_raw", ["extract"]),
+    "base": Stage("03_base", ["raw"]),
+    "describe": Stage("04_describe", ["base"]),
+    "analyses": Stage("04_analyses", ["base"]),
+    "train": Stage("05_train", ["base"]),
+}
+
+
+def run_pipeline(stages: dict[str, Stage], skip: set[str] | None = None) -> dict[str, object]:
+    """
+    Runs every stage once all of its upstream stages have finished, passing their outputs as arguments.
+    A skipped stage outputs None, so its downstream stages fall back to reading from storage.
+
+    Returns:
+        dict[str, object]: Output of every stage, keyed by stage name.
+    """
+    skip = skip or set()
+    outputs: dict[str, object] = {}
+    pending = dict(stages)
+    running: dict[Future, str] = {}
+
+    with ThreadPoolExecutor(max_workers=conf.PIPELINE_MAX_WORKERS, thread_name_prefix="stage") as executor:
+        while pending or running:
+            ready = [name for name, stage in pending.items() if all(upstream in outputs for upstream in stage.upstream)]
+            for name in ready:
+                stage = pending.pop(name)
+                if name in skip:
+                    logging.info(f"Skipping stage: {name}")
+                    outputs[name] = None
+                    continue
+
+                logging.info(f"Starting stage: {name}")
+                step = importlib.import_module(stage.module)
+                running[executor.submit(step.run, *[outputs[upstream] for upstream in stage.upstream])] = name
+
+            if not running:
+                if pending and not ready:
+                    raise ValueError(f"Stages with unknown upstream stages: {sorted(pending)}")
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                outputs[name] = future.result()
+                logging.info(f"Finished stage: {name}")
+
+    return outputs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the pipeline steps in a single process")
+    parser.add_argument("--skip", nargs="*", default=[], choices=list(STAGES), help="stages to skip, downstream stages read their output from storage instead")
+    parser.add_argument("--with-train", action="store_true", help="also train the model (requires the MLflow / MinIO setup)")
+    args = parser.parse_args()
+
+    stages = STAGES if args.with_train else {name: stage for name, stage in STAGES.items() if name != "train"}
+
+    # 05_train swaps the AWS credentials for the MinIO ones on import,
+    # create the shared S3 client first so uploads keep using the real ones
+    common_io.get_s3_client()
+
+    run_pipeline(stages, skip=set(args.skip))
+
+    logging.info("Waiting for background uploads")
+    common_io.io_wait_for_uploads()
+    logging.info("Pipeline finished")
@@ -0,0 +1,210 @@
+"""
+Point-in-time features of a single lifter, see lifter_features.
+
+Scores a lifter's next meet without rebuilding the base layer:
+- the lifter's own features come from the lifter transforms of 03_base, run on their history and the meet only
+- the segment features are looked up in per-segment tables of the base layer (SegmentHistory)
+- the ratings are replayed by the Elo and Glicko-2 engines for that one row, from the lifter's persisted ratings:
+  the Elo columns of their base layer rows and the Glicko-2 checkpoints (glicko.rating_checkpoints)
+The result is the modelling vector of 05_train (feature_set.modelling_features), with the columns computed from the
+meet's own outcome (OUTCOME_COLUMNS) null since it has not happened yet. check_parity compares it with the base layer.
+
+Usage:
+    uv run python steps/point_in_time.py --primary-key <primary key> --meet '{"date": "2026-11-14", "bodyweight": 82.4}'
+    uv run python steps/point_in_time.py --check 200
+"""
+
+import argparse
+import datetime
+import importlib
+import json
+import logging
+import time
+from typing import NamedTuple
+
+import conf
+import elo
+import feature_set
+import features
+import glicko
+import numpy as np
+import polars as pl
+from polars.testing import assert_frame_equal
+
+base = importlib.import_module("03_base")
+
+# Computed from the result of the meet itself
+OUTCOME_COLUMNS = [feature_set.TARGET, "elo_change"]
+RESULT_COLUMNS = ["place", "squat", "bench", "deadlift", "total", "wilks"]
+# Every lifter transform but the lifter filters, which would drop the meet of a new lifter
+LIFTER_TRANSFORMS = [name for name in base.LIFTER_TRANSFORMS if name not in ("filter_ambiguous_identities", "filter_minimum_competitions")]
+
+
+class SegmentHistory(NamedTuple):
+    "Totals of the rows of a segment of the base layer, in segment order (03_base.SEGMENT_ORDER_COLUMNS)"
+
+    days: np.ndarray  # date, in days since the epoch
+    lifter_ids: list[int]
+    meet_names: list[str]
+    totals: np.ndarray  # NaN for missing totals
+    total_sums: np.ndarray  # sum and count of the totals before each position, one more entry than rows
+    total_counts: np.ndarray
+
+
+class FeatureContext(NamedTuple):
+    segments: dict[tuple, SegmentHistory]
+    ratings_df: pl.DataFrame  # Elo columns of every row of the base layer, by lifter ID
+    glicko_state_df: pl.DataFrame  # Glicko-2 checkpoints, by lifter ID
+
+
+def build_context(base_df: pl.DataFrame, glicko_state_df: pl.DataFrame) -> FeatureContext:
+    "Segment tables and persisted ratings of a base layer, see FeatureContext"
+    segments = {}
+    segment_rows = base_df.select(*base.SEGMENT_ORDER_COLUMNS, "total").sort(base.SEGMENT_ORDER_COLUMNS)
+    for key, segment_df in segment_rows.partition_by(base.SEGMENT_COLUMNS, as_dict=True, maintain_order=True).items():
+        totals = segment_df["total"].cast(pl.Float64).fill_null(np.nan).to_numpy()
+        is_total = ~np.isnan(totals)
+        segments[key] = SegmentHistory(
+            days=segment_df["date"].cast(pl.Int32).to_numpy(),
+            lifter_ids=segment_df["lifter_id"].to_list(),
+            meet_names=segment_df["meet_name"].to_list(),
+            totals=totals,
+            total_sums=np.concatenate([[0.0], np.cumsum(np.where(is_total, totals, 0.0))]),
+            total_counts=np.concatenate([[0], np.cumsum(is_total)]),
+        )
+
+    return FeatureContext(
+        segments,
+        base_df.select("lifter_id", "date", "meet_name", *base.ELO_COLUMNS).sort("lifter_id", maintain_order=True),
+        glicko_state_df.sort("lifter_id", maintain_order=True),
+    )
+
+
+def lifter_rows(df: pl.DataFrame, lifter_id: int) -> pl.DataFrame:
+    "Rows of a frame sorted by lifter ID for one lifter, by binary search"
+    keys = df["lifter_id"]
+    start, end = keys.search_sorted(lifter_id, side="left"), keys.search_sorted(lifter_id, side="right")
+    return df.slice(start, end - start)
+
+
+def segment_position(segment: SegmentHistory, day: int, lifter_id: int, meet_name: str) -> int:
+    "Number of rows of the segment before a row in segment order"
+    start, end = np.searchsorted(segment.days, day, side="left"), np.searchsorted(segment.days, day, side="right")
+    return int(start) + sum((segment.lifter_ids[i], segment.meet_names[i]) < (lifter_id, meet_name) for i in range(start, end))
+
+
+def segment_features(row: dict, segment: SegmentHistory | None) -> dict:
+    "03_base.add_segment_averages and add_asof_percentile_ranks for one row, from its segment table"
+    features = {"segment_mean_total": None, **dict.fromkeys(base.ASOF_PERCENTILE_COLUMNS.values())}
+    if segment is None:
+        return features
+
+    day = (row["date"] - datetime.date(1970, 1, 1)).days
+    position = segment_position(segment, day, row["lifter_id"], row["meet_name"])
+    # Null after a missing total, like the cumulative sum of the batch computation
+    if position > 0 and not np.isnan(segment.totals[position - 1]):
+        features["segment_mean_total"] = segment.total_sums[position] / segment.total_counts[position]
+
+    earlier = segment.totals[: np.searchsorted(segment.days, day, side="left")]
+    earlier = earlier[~np.isnan(earlier)]
+    for column, name in base.ASOF_PERCENTILE_COLUMNS.items():
+        value = row[column]
+        if value is not None and len(earlier):
+            features[name] = (np.count_nonzero(earlier < value) + 0.5 * np.count_nonzero(earlier == value)) / len(earlier) * 100
+    return features
+
+
+def lifter_features(history_df: pl.DataFrame, meet: dict, context: FeatureContext) -> pl.DataFrame:
+    """
+    Modelling vector (see feature_set.modelling_features) of a lifter at an upcoming meet.
+
+    Args:
+        history_df: the lifter's previous meets, with the base input columns (03_base.BASE_INPUT_COLUMNS).
+        meet: base input columns of the upcoming meet, at least its date. The lifter's columns default to their
+            latest meet, the event to a tested raw SBD one and its results to null. A lifter without any
+            previous meet needs at least their lifter_id, their ratings are looked up by it.
+
+    Raises:
+        ValueError: if history_df is empty and meet has no lifter_id.
+    """
+    if not history_df.height and meet.get("lifter_id") is None:
+        raise ValueError("A lifter without previous meets needs the lifter_id of the upcoming meet")
+
+    lifter = history_df.sort("date").row(-1, named=True) if history_df.height else {}
+    meet_row = {
+        **{column: lifter.get(column) for column in ["lifter_id", "name", "sex", "birth_year", "identity_confidence", "origin_country", "country", "state"]},
+        "event": "SBD",
+        "tested": "Yes",
+        "equipment": "Raw",
+        **meet,
+        **{column: None for column in RESULT_COLUMNS},
+    }
+    rows_df = pl.concat([history_df.select(base.BASE_INPUT_COLUMNS), pl.DataFrame([meet_row], schema=history_df.select(base.BASE_INPUT_COLUMNS).schema)])
+    rows_df = rows_df.with_columns((pl.int_range(pl.len()) == pl.len() - 1).alias("is_scored_meet"))
+
+    # Each stage computes in Float64 and stores in Float32 like the batch ones, see 03_base.narrow_floats
+    features_lf = features.apply(rows_df.lazy().pipe(base.widen_floats), base.LIFTER_TRANSFORMS, LIFTER_TRANSFORMS).pipe(base.narrow_floats)
+    features_df = features_lf.filter("is_scored_meet").drop("is_scored_meet").collect()
+    row = features_df.row(0, named=True)
+    segment = context.segments.get((row["sex"], row["ipf_weight_class"]))
+    features_df = features_df.with_columns(pl.lit(value, dtype=pl.Float64).cast(pl.Float32).alias(name) for name, value in segment_features(row, segment).items())
+
+    # Ratings before the meet, replayed for this row alone
+    elo_state = elo.rating_state(lifter_rows(context.ratings_df, row["lifter_id"]), row["date"] - datetime.timedelta(days=1))
+    period_start = features_df.select(glicko.period_expr()).item()
+    glicko_state = glicko.state_as_of(lifter_rows(context.glicko_state_df, row["lifter_id"]), period_start - datetime.timedelta(days=1))
+    features_df = base.compute_glicko_rating(base.compute_elo_rating(features_df, elo_state), glicko_state)
+
+    # The field of the meet is unknown, so is meet_field_elo, which the vector does not hold
+    features_df = features_df.lazy().pipe(base.widen_floats).pipe(base.add_interaction_features).pipe(base.narrow_floats).collect()
+    return feature_set.modelling_features(features_df).with_columns(pl.lit(None).cast(features_df.schema[column]).alias(column) for column in OUTCOME_COLUMNS)
+
+
+def check_parity(base_df: pl.DataFrame, glicko_state_df: pl.DataFrame, n_rows: int = 100, seed: int = 0) -> None:
+    """
+    Checks lifter_features against the base layer on a sample of its rows, each scored from the rows of its lifter
+    before it, without its results. Raises AssertionError on any difference but in OUTCOME_COLUMNS.
+    Rows of lifters with another meet the same day are left out: the batch orders such meets by the whole field.
+    """
+    context = build_context(base_df, glicko_state_df)
+    candidates_df = base_df.filter(pl.len().over("lifter_id", "date") == 1)
+    timings = []
+    for row in candidates_df.sample(min(n_rows, candidates_df.height), seed=seed).iter_rows(named=True):
+        history_df = base_df.filter((pl.col("lifter_id") == row["lifter_id"]) & (pl.col("date") < row["date"]))
+        meet = {column: row[column] for column in base.BASE_INPUT_COLUMNS if column not in RESULT_COLUMNS}
+
+        start = time.perf_counter()
+        features_df = lifter_features(history_df, meet, context)
+        timings.append(time.perf_counter() - start)
+
+        expected_df = feature_set.modelling_features(pl.DataFrame([row], schema=base_df.schema))
+        assert_frame_equal(features_df.drop(OUTCOME_COLUMNS), expected_df.drop(OUTCOME_COLUMNS))
+
+    logging.info(f"Point-in-time features match the base layer on {len(timings)} rows, median {np.median(timings) * 1000:.1f} ms per lifter")
+
+
+def load_context() -> tuple[pl.DataFrame, FeatureContext]:
+    "The local base layer and the context built from it and the Glicko-2 checkpoints"
+    base_df = pl.read_parquet(conf.base_local_file_path)
+    return base_df, build_context(base_df, pl.read_parquet(conf.glicko_state_local_file_path))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Modelling features of a lifter at an upcoming meet, from the local base layer")
+    parser.add_argument("--primary-key", help="lifter to score, their history is read from the base layer through the lifter ID lookup")
+    parser.add_argument("--meet", type=json.loads, help="base input columns of the upcoming meet as JSON, at least its date")
+    parser.add_argument("--check", type=int, metavar="N", help="check the features against the base layer on N of its rows instead")
+    args = parser.parse_args()
+
+    if args.check:
+        check_parity(pl.read_parquet(conf.base_local_file_path), pl.read_parquet(conf.glicko_state_local_file_path), args.check)
+    else:
+        base_df, context = load_context()
+        meet = {**args.meet, "date": datetime.date.fromisoformat(args.meet["date"])}
+        lifter_ids = pl.read_parquet(conf.lifter_ids_local_file_path).filter(pl.col("primary_key") == args.primary_key)["lifter_id"]
+        if lifter_ids.is_empty():
+            parser.error(f"Unknown primary key {args.primary_key}, it is not in {conf.lifter_ids_local_file_path}")
+        meet = {"lifter_id": lifter_ids[0], **meet}
+        history_df = base_df.filter((pl.col("lifter_id") == meet["lifter_id"]) & (pl.col("date") < meet["date"]))
+        with pl.Config(tbl_rows=-1):
+            logging.info(f"Features of {args.primary_key} at {meet['date']}:\n{lifter_features(history_df, meet, context).transpose(include_header=True, column_names=['value'])}")
@@ -0,0 +1,167 @@
+"""
+Per-transform performance metrics, enabled with PIPELINE_PROFILE=1.
+
+Every transform decorated with conf.debug is profiled on materialized inputs: its lazy inputs are collected first,
+then the transform is timed up to its collected output. This gives up fusion between transforms, so profiled runs
+are slower overall, but each row of the metrics is the cost of that transform alone.
+Metrics of a run are appended to conf.run_metrics_local_file_path when the process exits.
+
+Usage:
+    uv run python steps/profiling.py [--threshold 0.2]
+"""
+
+import argparse
+import atexit
+import datetime
+import logging
+import resource
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import conf
+import polars as pl
+
+RUN_ID = uuid.uuid4().hex[:12]
+RUN_STARTED_AT = datetime.datetime.now(datetime.UTC)
+
+_metrics: list[dict] = []
+_metrics_lock = threading.Lock()
+
+run_metrics_schema = {
+    "run_id": pl.Utf8,
+    "run_started_at": pl.Datetime("us", "UTC"),
+    "sequence": pl.Int64,
+    "module": pl.Utf8,
+    "transform": pl.Utf8,
+    "wall_time_s": pl.Float64,
+    "cpu_time_s": pl.Float64,
+    "peak_rss_delta_mb": pl.Float64,
+    "rows_in": pl.Int64,
+    "rows_out": pl.Int64,
+    "size_in_mb": pl.Float64,
+    "size_out_mb": pl.Float64,
+    "columns_added": pl.List(pl.Utf8),
+}
+
+
+def _collect(value):
+    return value.collect() if isinstance(value, pl.LazyFrame) else value
+
+
+def _peak_rss_mb() -> float:
+    "Peak resident set size of the process so far (ru_maxrss is in kilobytes on Linux)"
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def profile_transform(func, *args, **kwargs):
+    """
+    Runs a transform on collected inputs and records its metrics.
+    The output is returned in the kind of frame the transform returns, so the chain around it is unchanged.
+    """
+    collected_args = [_collect(arg) for arg in args]
+    frames_in = [arg for arg in collected_args if isinstance(arg, pl.DataFrame)]
+    # Lazy inputs are handed back as lazy frames over the collected data
+    call_args = [collected.lazy() if isinstance(arg, pl.LazyFrame) else arg for arg, collected in zip(args, collected_args, strict=True)]
+
+    peak_rss_before = _peak_rss_mb()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+
+    result = func(*call_args, **kwargs)
+    is_lazy = isinstance(result, pl.LazyFrame)
+    result_df = _collect(result)
+
+    wall_time, cpu_time = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    df_in = frames_in[0] if frames_in else pl.DataFrame()
+
+    with _metrics_lock:
+        if not _metrics:
+            atexit.register(write_run_metrics)
+        _metrics.append(
+            {
+                "run_id": RUN_ID,
+                "run_started_at": RUN_STARTED_AT,
+                "sequence": len(_metrics),
+                "module": func.__module__,
+                "transform": func.__name__,
+                "wall_time_s": wall_time,
+                "cpu_time_s": cpu_time,
+                "peak_rss_delta_mb": _peak_rss_mb() - peak_rss_before,
+                "rows_in": df_in.height,
+                "rows_out": result_df.height,
+                "size_in_mb": df_in.estimated_size("mb"),
+                "size_out_mb": result_df.estimated_size("mb"),
+                "columns_added": [column for column in result_df.columns if column not in df_in.columns],
+            }
+        )
+
+    return result_df.lazy() if is_lazy else result_df
+
+
+def take_metrics() -> pl.DataFrame:
+    "Returns the metrics recorded so far and clears them, so they are not written to the run-metrics table"
+    with _metrics_lock:
+        metrics_df = pl.DataFrame(_metrics, schema=run_metrics_schema)
+        _metrics.clear()
+    return metrics_df
+
+
+def write_run_metrics() -> None:
+    "Appends the metrics of this run to the run-metrics table"
+    with _metrics_lock:
+        if not _metrics:
+            return
+        run_df = pl.DataFrame(_metrics, schema=run_metrics_schema)
+        _metrics.clear()
+
+    path = Path(conf.run_metrics_local_file_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        run_df = pl.concat([pl.read_parquet(path), run_df], how="diagonal_relaxed")
+
+    run_df.write_parquet(path)
+    logging.info(f"Run metrics written: {path} (run {RUN_ID})")
+
+
+def report(metrics_df: pl.DataFrame, threshold: float = conf.PROFILE_REGRESSION_THRESHOLD) -> pl.DataFrame:
+    """
+    Ranks the transforms of the latest run by wall time and compares them with the previous run.
+    A transform is flagged as a regression when its wall time grew by more than threshold (relative)
+    and conf.PROFILE_REGRESSION_MIN_SECONDS (absolute), so millisecond transforms do not flag on noise.
+    """
+    runs = metrics_df.select("run_id", "run_started_at").unique().sort("run_started_at", descending=True)["run_id"]
+    totals = ["wall_time_s", "cpu_time_s", "rows_out", "size_out_mb"]
+
+    def per_transform(run_id: str) -> pl.DataFrame:
+        return metrics_df.filter(pl.col("run_id") == run_id).group_by("module", "transform").agg(pl.col(totals).sum(), pl.col("peak_rss_delta_mb").max(), pl.len().alias("calls"))
+
+    latest_df = per_transform(runs[0]).with_columns((pl.col("wall_time_s") / pl.col("wall_time_s").sum() * 100).alias("wall_time_pct"))
+
+    if len(runs) > 1:
+        previous_df = per_transform(runs[1]).select("module", "transform", pl.col("wall_time_s").alias("previous_wall_time_s"))
+        latest_df = latest_df.join(previous_df, on=["module", "transform"], how="left")
+    else:
+        latest_df = latest_df.with_columns(pl.lit(None, dtype=pl.Float64).alias("previous_wall_time_s"))
+
+    change = pl.col("wall_time_s") - pl.col("previous_wall_time_s")
+    return latest_df.with_columns(
+        (change / pl.col("previous_wall_time_s")).alias("wall_time_change"),
+        ((change > pl.col("previous_wall_time_s") * threshold) & (change > conf.PROFILE_REGRESSION_MIN_SECONDS)).fill_null(False).alias("regression"),
+    ).sort("wall_time_s", descending=True)
+
+
+def log_report(report_df: pl.DataFrame) -> None:
+    with pl.Config(tbl_rows=-1, tbl_cols=-1, tbl_width_chars=200):
+        logging.info(f"\n{report_df}")
+
+    for row in report_df.filter(pl.col("regression")).iter_rows(named=True):
+        logging.warning(f"Regression: {row['module']}.{row['transform']} {row['previous_wall_time_s']:.3f}s -> {row['wall_time_s']:.3f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rank the transforms of the latest profiled run and flag regressions against the previous one")
+    parser.add_argument("--threshold", type=float, default=conf.PROFILE_REGRESSION_THRESHOLD, help="relative wall time increase flagged as a regression")
+    args = parser.parse_args()
+
+    log_report(report(pl.read_parquet(conf.run_metrics_local_file_path), threshold=args.threshold))
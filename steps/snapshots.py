@@ -0,0 +1,150 @@
+"""
+As-of snapshots of the base layer for backtesting, see snapshots.
+
+The snapshot at a cutoff date is the base layer a build on that date would have produced: 03_base run on the rows
+dated up to the cutoff. Instead of one build per cutoff, the snapshots share their computation:
+- Lifter features only look back in each lifter's history, so they are computed once over the whole history, sorted
+  by lifter and date, and a snapshot takes its rows up to the cutoff. Only the lifter filters looking at a lifter's
+  whole history (HISTORY_FILTERS) are evaluated per cutoff, on the keys of the rows up to it.
+- Segment features rank and average over the rows of the snapshot, so they are recomputed for each one.
+- Elo and Glicko-2 are replays in date order, so cutoffs are processed in date order and each snapshot keeps the
+  ratings of the previous one up to the earliest row they differ in: only the meets after it are replayed, see
+  replay_ratings. Snapshots differ before their previous cutoff when a lifter's earlier meets enter with their
+  MIN_COMPETITIONS-th meet.
+
+Usage:
+    uv run python steps/snapshots.py --cutoffs 2016-01-01 2018-01-01 2020-01-01 [--verify]
+"""
+
+import argparse
+import datetime
+import importlib
+import logging
+from collections.abc import Iterator
+from pathlib import Path
+
+import conf
+import elo
+import glicko
+import polars as pl
+from polars.testing import assert_frame_equal
+
+base = importlib.import_module("03_base")
+
+# Lifter transforms whose rows depend on the lifter's whole history rather than on the meets up to each row,
+# evaluated per cutoff by admitted_lifters
+HISTORY_FILTERS = ["filter_minimum_competitions"]
+
+
+def admitted_lifters(input_df: pl.DataFrame) -> pl.DataFrame:
+    "Lifter IDs the lifter filters keep among the lifters of a renamed base input"
+    lf = input_df.lazy().select("lifter_id", "identity_confidence").pipe(base.filter_ambiguous_identities)
+    return lf.pipe(base.filter_minimum_competitions).select("lifter_id").unique().collect()
+
+
+def changed_since(df: pl.DataFrame, previous_df: pl.DataFrame) -> datetime.date | None:
+    "Earliest date of the rows in only one of two snapshots, None when they have the same rows"
+    keys = conf.base_sort_columns
+    changed = pl.concat([df.join(previous_df, on=keys, how="anti", nulls_equal=True).select("date"), previous_df.join(df, on=keys, how="anti", nulls_equal=True).select("date")])
+    return changed["date"].min()
+
+
+def replay_ratings(df: pl.DataFrame, previous_df: pl.DataFrame | None, glicko_log_df: pl.DataFrame | None) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """
+    Elo and Glicko-2 columns of the rows of a snapshot (see 03_base.add_rating_features), and its Glicko-2 state log
+    (see glicko.glicko_ratings). The rows before the earliest row the previous snapshot differs in (changed_since)
+    keep their ratings from it, the meets from that row on, or its rating period for Glicko-2, are replayed from
+    the ratings before them. Every meet is replayed without a previous snapshot.
+    """
+    if previous_df is None:
+        elo_df = base.compute_elo_rating(df)
+        glicko_features_df, glicko_log_df = glicko.glicko_ratings(elo_df)
+        return elo_df.hstack(glicko_features_df), glicko_log_df
+
+    changed = changed_since(df, previous_df)
+    if changed is None:
+        return df.join(previous_df.select(*conf.base_sort_columns, *base.ELO_COLUMNS, *base.GLICKO_COLUMNS), on=conf.base_sort_columns, how="left", maintain_order="left"), glicko_log_df
+
+    df = df.with_row_index("snapshot_row")
+    is_replayed = pl.col("date") >= changed
+    elo_df = pl.concat(
+        [
+            df.filter(~is_replayed).join(previous_df.select(*conf.base_sort_columns, *base.ELO_COLUMNS), on=conf.base_sort_columns, how="left", maintain_order="left"),
+            base.compute_elo_rating(df.filter(is_replayed), elo.rating_state(previous_df, changed - datetime.timedelta(days=1))),
+        ]
+    ).sort("snapshot_row")
+
+    period = pl.select(pl.lit(changed).alias("date")).select(glicko.period_expr()).item()
+    is_replayed = glicko.period_expr() >= period
+    replayed_df = elo_df.filter(is_replayed)
+    glicko_features_df, replayed_log_df = glicko.glicko_ratings(replayed_df, glicko.state_as_of(glicko_log_df, period - datetime.timedelta(days=1)))
+    logging.info(f"Replaying ratings from {changed}: Elo for {df.filter(pl.col('date') >= changed).height} and Glicko-2 for {replayed_df.height} of {df.height} rows")
+
+    rating_df = pl.concat(
+        [
+            elo_df.filter(~is_replayed).join(previous_df.select(*conf.base_sort_columns, *base.GLICKO_COLUMNS), on=conf.base_sort_columns, how="left", maintain_order="left"),
+            replayed_df.hstack(glicko_features_df),
+        ]
+    ).sort("snapshot_row")
+    return rating_df.drop("snapshot_row"), pl.concat([glicko_log_df.filter(pl.col("period") < period), replayed_log_df])
+
+
+def snapshots(input_df: pl.DataFrame, cutoffs: list[datetime.date]) -> Iterator[tuple[datetime.date, pl.DataFrame]]:
+    """
+    Base layer snapshot at each cutoff date, see the module docstring.
+
+    Args:
+        input_df: the base input (see 03_base.select_base_input) of the whole history.
+        cutoffs: dates the snapshots are taken at, in any order.
+
+    Yields:
+        tuple[datetime.date, pl.DataFrame]: (cutoff, snapshot), in date order.
+    """
+    base_columns = base.plan_base(input_df.clear().lazy()).collect_schema().names()
+    renamed_df = input_df.rename(conf.base_renamed_columns)
+    cutoffs = sorted(set(cutoffs))
+    admitted = {cutoff: admitted_lifters(renamed_df.filter(pl.col("date") <= cutoff)) for cutoff in cutoffs}
+
+    # Lifter features of the lifters of any snapshot, the others are never needed
+    history_transforms = [name for name in base.LIFTER_TRANSFORMS if name not in HISTORY_FILTERS]
+    lifters_df = pl.concat(admitted.values()).unique()
+    lifter_df = base.add_lifter_features(input_df.lazy().join(lifters_df.lazy(), on="lifter_id", how="semi"), history_transforms).collect()
+
+    previous_df, glicko_log_df = None, None
+    for cutoff, admitted_df in admitted.items():
+        snapshot_lf = lifter_df.filter(pl.col("date") <= cutoff).join(admitted_df, on="lifter_id", how="semi", maintain_order="left").lazy()
+        snapshot_df, glicko_log_df = replay_ratings(base.add_segment_features(snapshot_lf).collect(), previous_df, glicko_log_df)
+        snapshot_lf = snapshot_df.lazy().pipe(base.widen_floats).pipe(base.add_interaction_features).pipe(base.add_elo_gap_vs_field).pipe(base.narrow_floats)
+        snapshot_df = snapshot_lf.select(base_columns).collect()
+        logging.info(f"Snapshot at {cutoff}: {snapshot_df.height} rows of {snapshot_df['lifter_id'].n_unique()} lifters")
+        yield cutoff, snapshot_df
+        previous_df = snapshot_df
+
+
+def verify_snapshot(snapshot_df: pl.DataFrame, input_df: pl.DataFrame, cutoff: datetime.date) -> None:
+    "Checks a snapshot against a full build from the input rows up to its cutoff, raises AssertionError on any difference"
+    full_df = base.build_base(input_df.lazy().filter(pl.col("date") <= cutoff))
+    assert_frame_equal(snapshot_df, full_df)
+    logging.info(f"Snapshot at {cutoff} matches a full build")
+
+
+def run(cutoffs: list[datetime.date], raw_df: pl.DataFrame | None = None, verify: bool = False) -> None:
+    "Writes the snapshot at each cutoff to conf.snapshots_folder, named after it. Raw is read from S3 unless handed in."
+    raw_lf = base.scan_raw() if raw_df is None else raw_df.lazy()
+    input_df = base.select_base_input(raw_lf).collect()
+
+    folder = Path(conf.snapshots_folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    for cutoff, snapshot_df in snapshots(input_df, cutoffs):
+        if verify:
+            verify_snapshot(snapshot_df, input_df, cutoff)
+        snapshot_df.write_parquet(folder / f"{cutoff}.parquet")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build as-of snapshots of the base layer for backtesting")
+    parser.add_argument("--cutoffs", nargs="+", type=datetime.date.fromisoformat, required=True, help="cutoff dates, YYYY-MM-DD")
+    parser.add_argument("--verify", action="store_true", help="check each snapshot against a full build from the rows up to its cutoff")
+    args = parser.parse_args()
+
+    run(args.cutoffs, verify=args.verify)
@@ -0,0 +1,22 @@
+"""
+String transforms over the distinct values of a column, see per_distinct.
+
+Lifter and meet names repeat across millions of rows but only take a small fraction of distinct values. A column is
+encoded once in a categorical of its own, a dictionary of its distinct values and a code per row, the string kernels
+run over the dictionary only and their results are gathered back to the rows by code.
+"""
+
+from collections.abc import Callable
+
+import polars as pl
+
+
+def dictionary_encode(values: pl.Expr) -> pl.Expr:
+    "values in a categorical of their own, whose categories are their distinct values rather than the global ones"
+    return values.cast(pl.Categorical(pl.Categories.random()))
+
+
+def per_distinct(values: pl.Expr, transform: Callable[[pl.Expr], pl.Expr]) -> pl.Expr:
+    "transform of the strings values, evaluated once per distinct value and gathered back to the rows, null rows stay null"
+    encoded = dictionary_encode(values)
+    return transform(encoded.cat.get_categories()).gather(encoded.to_physical())
@@ -0,0 +1,267 @@
+"""
+Synthetic OpenPowerlifting data in the landing schema, for benchmarking the pipeline offline.
+
+Lifters have multi-meet careers at shared meets, in date order, with bodyweight drifting across weight classes
+and totals progressing with experience. Names are drawn from skewed pools, so common names collide between
+different lifters, including ones with the same birth year.
+Rows are generated in independent chunks (each with its own meets), so 100x the real ~3M rows stays within memory.
+
+Usage:
+    uv run python steps/synthetic_data.py --scale 1 [--seed 0] [--output data/synthetic/landing-1x.parquet]
+"""
+
+import argparse
+import datetime
+import logging
+import math
+import shutil
+from pathlib import Path
+
+import conf
+import numpy as np
+import polars as pl
+
+SYLLABLES = ["an", "be", "ca", "da", "el", "fi", "ga", "ha", "is", "jo", "ka", "li", "ma", "ne", "ol", "pa", "ri", "sa", "ta", "un", "vi", "wa", "xe", "yo", "zu", "mor", "len", "tin", "son", "ra"]
+
+# (federation, parent federation, country, tested)
+FEDERATIONS = [
+    ("USAPL", "IPF", "USA", "Yes"),
+    ("USPA", "IPL", "USA", None),
+    ("CPU", "IPF", "Canada", "Yes"),
+    ("BP", "IPF", "UK", "Yes"),
+    ("PA", "IPF", "Australia", "Yes"),
+    ("APL", "IPL", "Australia", None),
+    ("NZPF", "IPF", "New Zealand", "Yes"),
+    ("FFForce", "IPF", "France", "Yes"),
+    ("WRPF", "WRPF", "Russia", None),
+    ("RPS", None, "USA", None),
+    ("GPC-AUS", "GPC", "Australia", None),
+]
+FEDERATION_WEIGHTS = [0.3, 0.15, 0.08, 0.07, 0.06, 0.05, 0.03, 0.06, 0.08, 0.07, 0.05]
+
+# Meet name suffixes, which 03_base.add_meet_type classifies
+MEET_KINDS = ["Open", "Classic", "Invitational", "State Championships", "National Championships", "World Championships", "Commonwealth Championships"]
+MEET_KIND_WEIGHTS = [0.35, 0.15, 0.1, 0.2, 0.12, 0.05, 0.03]
+
+EVENTS = ["SBD", "B", "D", "BD", "SB", "S"]
+EVENT_WEIGHTS = [0.8, 0.12, 0.04, 0.02, 0.01, 0.01]
+EQUIPMENT = ["Raw", "Single-ply", "Wraps", "Multi-ply", "Unlimited"]
+EQUIPMENT_WEIGHTS = [0.62, 0.2, 0.12, 0.04, 0.02]
+
+# Wilks coefficients (a to f) of the 5th degree polynomial in bodyweight
+WILKS_COEFFICIENTS = {
+    "M": [-216.0475144, 16.2606339, -0.002388645, -0.00113732, 7.01863e-06, -1.291e-08],
+    "F": [594.31747775582, -27.23842536447, 0.82112226871, -0.00930733913, 4.731582e-05, -9.054e-08],
+}
+AGE_CLASSES = [
+    (13, "5-12"),
+    (16, "13-15"),
+    (18, "16-17"),
+    (20, "18-19"),
+    (24, "20-23"),
+    (35, "24-34"),
+    (40, "35-39"),
+    (45, "40-44"),
+    (50, "45-49"),
+    (55, "50-54"),
+    (60, "55-59"),
+    (65, "60-64"),
+    (70, "65-69"),
+    (75, "70-74"),
+    (80, "75-79"),
+]
+
+FIRST_MEET_DATE = datetime.date(1980, 1, 1)
+LAST_MEET_DATE = datetime.date(2025, 12, 31)
+
+
+def _name_pool(syllables_per_name: int) -> np.ndarray:
+    names = [""]
+    for _ in range(syllables_per_name):
+        names = [name + syllable for name in names for syllable in SYLLABLES]
+    return np.array([name.capitalize() for name in names])
+
+
+def _zipf_choice(rng: np.random.Generator, pool: np.ndarray, size: int, exponent: float) -> np.ndarray:
+    "Draws from a pool with Zipf-like popularity, so a few names are very common"
+    weights = 1.0 / np.arange(1, len(pool) + 1) ** exponent
+    return rng.choice(pool, size=size, p=weights / weights.sum())
+
+
+def _ipf_weight_class(sex: np.ndarray, bodyweight: np.ndarray) -> np.ndarray:
+    "Weight class label as published by OpenPowerlifting, e.g. 83 or 120+ (Mx lifters use the men's classes)"
+    labels = np.empty(len(bodyweight), dtype=object)
+    for sex_key, boundaries in conf.IPF_WEIGHT_CLASSES.items():
+        mask = (sex == sex_key) | ((sex == "Mx") & (sex_key == "M"))
+        idx = np.minimum(np.searchsorted(boundaries, bodyweight[mask]), len(boundaries) - 1)
+        class_labels = np.array([str(int(upper)) if upper != float("inf") else f"{boundaries[i - 1]}+" for i, upper in enumerate(boundaries)], dtype=object)
+        labels[mask] = class_labels[idx]
+    return labels
+
+
+def _wilks(sex: np.ndarray, bodyweight: np.ndarray, total: np.ndarray) -> np.ndarray:
+    coefficients = np.where((sex == "F")[:, None], WILKS_COEFFICIENTS["F"], WILKS_COEFFICIENTS["M"])
+    denominator = sum(coefficients[:, i] * bodyweight**i for i in range(6))
+    return np.round(total * 500 / denominator, 2)
+
+
+def _age_class(age: np.ndarray) -> np.ndarray:
+    upper_bounds = np.array([upper for upper, _ in AGE_CLASSES])
+    labels = np.array([label for _, label in AGE_CLASSES] + ["80-999"], dtype=object)
+    return labels[np.searchsorted(upper_bounds, age, side="right")]
+
+
+def generate_meets(rng: np.random.Generator, n_meets: int, chunk_index: int) -> pl.DataFrame:
+    "Meets in date order, more of them in recent years like the real data"
+    span_days = (LAST_MEET_DATE - FIRST_MEET_DATE).days
+    days = np.sort((np.sqrt(rng.random(n_meets)) * span_days).astype(np.int64))
+    federation_idx = rng.choice(len(FEDERATIONS), size=n_meets, p=FEDERATION_WEIGHTS)
+    kinds = rng.choice(MEET_KINDS, size=n_meets, p=MEET_KIND_WEIGHTS)
+
+    federations = pl.DataFrame(FEDERATIONS, schema=["federation", "parent_federation", "meet_country", "tested"], orient="row")
+    return (
+        pl.DataFrame({"meet_idx": np.arange(n_meets), "federation_idx": federation_idx, "kind": kinds, "days": days})
+        .with_columns((pl.lit(FIRST_MEET_DATE) + pl.duration(days=pl.col("days"))).alias("meet_date"))
+        .join(federations.with_row_index("federation_idx").with_columns(pl.col("federation_idx").cast(pl.Int64)), on="federation_idx")
+        .with_columns(
+            pl.format("{} {} {} #{}", pl.col("meet_date").dt.year(), pl.col("federation"), pl.col("kind"), pl.lit(chunk_index)).alias("meet_name"),
+        )
+        .sort("meet_idx")
+    )
+
+
+def generate_landing_chunk(n_rows: int, rng: np.random.Generator, chunk_index: int = 0) -> pl.DataFrame:
+    "About n_rows landing rows (careers running past the last meet are cut short), with snake case column names"
+    meets = generate_meets(rng, max(1, n_rows // conf.SYNTHETIC_MEAN_MEET_SIZE), chunk_index)
+    n_meets = meets.height
+
+    # Careers: number of meets per lifter, then meet indices increasing by a random gap
+    comps = rng.geometric(1 / conf.SYNTHETIC_MEAN_COMPS_PER_LIFTER, size=math.ceil(n_rows / conf.SYNTHETIC_MEAN_COMPS_PER_LIFTER * 1.2))
+    n_lifters = int(np.searchsorted(np.cumsum(comps), n_rows)) + 1
+    comps = comps[:n_lifters]
+    lifter = np.repeat(np.arange(n_lifters), comps)
+    lifter_start = np.cumsum(comps) - comps
+    comp_number = np.arange(len(lifter)) - lifter_start[lifter]
+
+    mean_gap_meets = max(1.0, n_meets * conf.SYNTHETIC_MEAN_DAYS_BETWEEN_MEETS / (LAST_MEET_DATE - FIRST_MEET_DATE).days)
+    gaps = np.where(comp_number == 0, 0, rng.geometric(1 / mean_gap_meets, size=len(lifter)))
+    career_offset = np.cumsum(gaps) - np.cumsum(gaps)[lifter_start][lifter]
+    first_meet = rng.integers(0, n_meets, size=n_lifters)
+    meet_idx = first_meet[lifter] + career_offset
+    in_range = meet_idx < n_meets
+    lifter, comp_number, meet_idx = lifter[in_range], comp_number[in_range], meet_idx[in_range]
+    n = len(lifter)
+
+    # Lifters
+    sex = rng.choice(np.array(["M", "F", "Mx"]), size=n_lifters, p=[0.68, 0.3, 0.02])
+    names = np.char.add(np.char.add(_zipf_choice(rng, _name_pool(2), n_lifters, exponent=0.6), " "), _zipf_choice(rng, _name_pool(3), n_lifters, exponent=0.5))
+    age_at_first_meet = 14 + rng.gamma(2.0, 6.0, size=n_lifters)
+    base_bodyweight = np.where(sex == "F", rng.normal(68, 13, n_lifters), rng.normal(88, 16, n_lifters)).clip(40, 180)
+    bodyweight_trend = rng.normal(0, 0.6, n_lifters)
+    strength_ratio = np.where(sex == "F", rng.normal(4.2, 0.8, n_lifters), rng.normal(5.5, 1.0, n_lifters)).clip(2.0, 10.0)
+    squat_share = rng.normal(0.36, 0.03, n_lifters)
+    bench_share = rng.normal(0.24, 0.03, n_lifters)
+    equipment = rng.choice(EQUIPMENT, size=n_lifters, p=EQUIPMENT_WEIGHTS)
+
+    meet_days = meets["days"].to_numpy()[meet_idx]
+    first_meet_days = meets["days"].to_numpy()[first_meet]
+    birth_days = first_meet_days[lifter] - age_at_first_meet[lifter] * 365.25
+    exact_age = (meet_days - birth_days) / 365.25
+    # OpenPowerlifting ages are exact years, or x.5 when only the age class or birth year is known
+    age = np.where(rng.random(n) < 0.8, np.floor(exact_age), np.floor(exact_age) + 0.5)
+    age = np.where(rng.random(n) < conf.SYNTHETIC_NULL_AGE_RATE, np.nan, age)
+
+    # Bodyweight drifts over a career, so lifters move across weight classes
+    bodyweight = (base_bodyweight[lifter] + bodyweight_trend[lifter] * comp_number + rng.normal(0, 1.5, n)).clip(35, 200).round(1)
+    lifter_sex = sex[lifter]
+
+    progress = 1 + 0.08 * np.log1p(comp_number) + rng.normal(0, 0.03, n)
+    total = np.round(strength_ratio[lifter] * bodyweight * progress / 2.5) * 2.5
+    squat = np.round(total * squat_share[lifter] / 2.5) * 2.5
+    bench = np.round(total * bench_share[lifter] / 2.5) * 2.5
+    deadlift = total - squat - bench
+
+    event = rng.choice(EVENTS, size=n, p=EVENT_WEIGHTS)
+    squat = np.where(np.char.find(event.astype(str), "S") >= 0, squat, np.nan)
+    bench = np.where(np.char.find(event.astype(str), "B") >= 0, bench, np.nan)
+    deadlift = np.where(np.char.find(event.astype(str), "D") >= 0, deadlift, np.nan)
+    total = np.nansum([squat, bench, deadlift], axis=0)
+    bombed = rng.random(n) < conf.SYNTHETIC_DQ_RATE
+    total = np.where(bombed, np.nan, total)
+
+    row_equipment = np.where(rng.random(n) < 0.1, rng.choice(EQUIPMENT, size=n, p=EQUIPMENT_WEIGHTS), equipment[lifter])
+
+    df = pl.DataFrame(
+        {
+            "name": names[lifter],
+            "sex": lifter_sex,
+            "event": event,
+            "equipment": row_equipment,
+            "age": age,
+            "age_class": _age_class(np.nan_to_num(age, nan=-1.0)),
+            "bodyweight_kg": bodyweight,
+            "weight_class_kg": _ipf_weight_class(lifter_sex, bodyweight),
+            "best3_squat_kg": squat,
+            "best3_bench_kg": bench,
+            "best3_deadlift_kg": deadlift,
+            "total_kg": total,
+            "wilks": _wilks(lifter_sex, bodyweight, total),
+            "bombed": bombed,
+            "lifter": lifter,
+            "meet_idx": meet_idx,
+        },
+        nan_to_null=True,
+    ).join(meets.select("meet_idx", "meet_date", "meet_name", "meet_country", "federation", "parent_federation", "tested"), on="meet_idx", how="left", maintain_order="left")
+
+    # Lifters are from the country of their first meet
+    df = df.with_columns(pl.col("meet_country").first().over("lifter").alias("country"))
+
+    # Place within each meet division, DQ for bombed out lifters
+    division = ["meet_idx", "sex", "weight_class_kg", "equipment", "event"]
+    df = df.with_columns(
+        pl.when(pl.col("bombed")).then(pl.lit("DQ")).otherwise(pl.col("total_kg").rank("ordinal", descending=True).over(division).cast(pl.Utf8)).alias("place"),
+        pl.col("meet_date").dt.strftime("%Y-%m-%d").alias("date"),
+        pl.when(pl.col("age").is_null()).then(None).otherwise(pl.col("age_class")).alias("age_class"),
+    )
+
+    landing_columns = {conf.camel_to_snake(column): dtype for column, dtype in conf.landing_schema.items()}
+    return df.select(pl.col(column).cast(dtype) if column in df.columns else pl.lit(None, dtype=dtype).alias(column) for column, dtype in landing_columns.items())
+
+
+def generate_landing(scale: float, output_path: str, seed: int = 0) -> str:
+    """
+    Writes a synthetic landing parquet file of scale times conf.SYNTHETIC_ROWS_1X rows.
+    Chunks are written as parts and streamed into a single file, like 01_extract does with the real CSV.
+    """
+    n_rows = int(scale * conf.SYNTHETIC_ROWS_1X)
+    parts_dir = Path(f"{output_path}.parts")
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    parts_dir.mkdir(parents=True)
+
+    for chunk_index, chunk_start in enumerate(range(0, n_rows, conf.SYNTHETIC_CHUNK_ROWS)):
+        rng = np.random.default_rng([seed, chunk_index])
+        chunk_df = generate_landing_chunk(min(conf.SYNTHETIC_CHUNK_ROWS, n_rows - chunk_start), rng, chunk_index)
+        chunk_df.write_parquet(parts_dir / f"part-{chunk_index:05d}.parquet")
+        logging.info(f"Generated chunk {chunk_index}: {chunk_df.height} rows")
+
+    pl.scan_parquet(f"{parts_dir}/*.parquet").sink_parquet(output_path)
+    shutil.rmtree(parts_dir)
+    logging.info(f"Synthetic landing data written to {output_path}")
+
+    return output_path
+
+
+def synthetic_landing_path(scale: float, seed: int = 0) -> str:
+    return f"{conf.synthetic_data_folder}/landing-{scale:g}x-seed{seed}.parquet"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic landing data")
+    parser.add_argument("--scale", type=float, default=1, help=f"multiple of the real data size ({conf.SYNTHETIC_ROWS_1X:,} rows), e.g. 1, 10 or 100")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="parquet file to write, defaults to data/synthetic/landing-<scale>x-seed<seed>.parquet")
+    args = parser.parse_args()
+
+    output_path = args.output or synthetic_landing_path(args.scale, args.seed)
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    generate_landing(args.scale, output_path, seed=args.seed)
@@ -0,0 +1,84 @@
+"""
+Weight class assignment under the schemes of conf.WEIGHT_CLASS_SCHEMES, see 03_base.add_weight_classes.
+
+A scheme is a sorted list of class upper bounds per sex: a bodyweight falls in the first class whose upper bound
+it does not exceed, the last class is open ended. The bounds of every (scheme, sex) pair are laid out in one sorted
+array, each pair in its own block of BLOCK_WIDTH kg, so classifying a row is one binary search of its bodyweight
+shifted into the block of its scheme and sex, and a gather of the label of the class found. Rows under different
+schemes, e.g. the scheme of each meet's federation, are therefore classified in the same single search.
+The scheme of a meet is the one its federation, or else its parent federation, used at its date
+(conf.FEDERATION_WEIGHT_CLASS_SCHEMES).
+"""
+
+from typing import NamedTuple
+
+import conf
+import polars as pl
+
+UNKNOWN_CLASS = "unknown"
+BLOCK_WIDTH = 10_000  # kg, above any bodyweight, bodyweights are clipped to the block so they never reach the next one
+
+
+class ClassTable(NamedTuple):
+    "Sorted class bounds of every (scheme, sex) block and the label of each class, see class_table"
+
+    bounds: pl.Series
+    labels: pl.Series  # an Enum of every label, in lexical order like the strings they replace
+    sexes: list[str]  # block of a scheme and sex: scheme number * len(sexes) + position of the sex
+
+
+def class_labels(boundaries: list[float]) -> list[str]:
+    "Label of each class: its upper bound, e.g. '83' or '67.5', and the bound below it with a '+' for the open class"
+    labels = [f"{upper:g}" for upper in boundaries[:-1]]
+    return [*labels, f"{labels[-1]}+"]
+
+
+def class_table() -> ClassTable:
+    "Bounds of the classes of every scheme and sex, the open class bounded by the end of its block, then an unknown class for rows without a block"
+    sexes = list(dict.fromkeys(sex for classes in conf.WEIGHT_CLASS_SCHEMES.values() for sex in classes))
+    bounds, labels = [], []
+    for scheme_number, classes in enumerate(conf.WEIGHT_CLASS_SCHEMES.values()):
+        for sex_number, sex in enumerate(sexes):
+            block = scheme_number * len(sexes) + sex_number
+            # A sex without classes in the scheme is a single unknown class
+            boundaries = classes.get(sex, [float("inf")])
+            bounds += [block * BLOCK_WIDTH + upper for upper in boundaries[:-1]] + [block * BLOCK_WIDTH + BLOCK_WIDTH - 1]
+            labels += class_labels(boundaries) if sex in classes else [UNKNOWN_CLASS]
+    bounds.append(float("inf"))
+    labels.append(UNKNOWN_CLASS)
+    return ClassTable(pl.Series("bounds", bounds, dtype=pl.Float64), pl.Series("labels", labels, dtype=pl.Enum(sorted(set(labels)))), sexes)
+
+
+def classify_expr(scheme_number: pl.Expr) -> pl.Expr:
+    "Weight class label of each row under its scheme (a number, see scheme_number_expr), 'unknown' without sex or bodyweight"
+    table = class_table()
+    sex_initial = pl.col("sex").cast(pl.Utf8).str.slice(0, 1).str.to_uppercase()
+    sex_number = pl.when(sex_initial == table.sexes[0]).then(0)
+    for number, sex in enumerate(table.sexes[1:], start=1):
+        sex_number = sex_number.when(sex_initial == sex).then(number)
+
+    position = (scheme_number * len(table.sexes) + sex_number) * BLOCK_WIDTH + pl.col("bodyweight").clip(0, BLOCK_WIDTH - 1)
+    # The first bound not below the position, i.e. right-closed classes. Rows without sex or bodyweight find the last one
+    return pl.lit(table.labels).gather(pl.lit(table.bounds).search_sorted(position.fill_null(float("inf")), side="left"))
+
+
+def scheme_number(scheme: str) -> int:
+    "Position of a scheme in conf.WEIGHT_CLASS_SCHEMES"
+    return list(conf.WEIGHT_CLASS_SCHEMES).index(scheme)
+
+
+def scheme_number_expr() -> pl.Expr:
+    "Scheme of each row (see scheme_number): the latest one its federation, or else its parent federation, adopted by the meet date"
+    scheme = pl.when(pl.col("date").is_null()).then(scheme_number(conf.DEFAULT_WEIGHT_CLASS_SCHEME))
+
+    for column in ["federation", "parent_federation"]:
+        for federation, periods in conf.FEDERATION_WEIGHT_CLASS_SCHEMES.items():
+            for valid_from, federation_scheme in sorted(periods, reverse=True):
+                scheme = scheme.when((pl.col(column) == federation) & (pl.col("date") >= valid_from)).then(scheme_number(federation_scheme))
+
+    return scheme.otherwise(scheme_number(conf.DEFAULT_WEIGHT_CLASS_SCHEME))
+
+
+def weight_class_exprs(schemes: list[str]) -> list[pl.Expr]:
+    "One <scheme>_weight_class column per scheme, 'federation' for the scheme of each row's federation at its date"
+    return [classify_expr(scheme_number_expr() if scheme == "federation" else pl.lit(scheme_number(scheme))).alias(f"{scheme}_weight_class") for scheme in schemes]
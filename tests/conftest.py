@@ -0,0 +1,30 @@
+"""
+Layers built from a small synthetic landing (see synthetic_data.py), shared by the tests of the base layer.
+"""
+
+import importlib
+
+import polars as pl
+import pytest
+import synthetic_data
+
+raw = importlib.import_module("03_raw")
+base = importlib.import_module("03_base")
+
+SCALE = 0.01
+
+
+@pytest.fixture(scope="session")
+def raw_df(tmp_path_factory) -> pl.DataFrame:
+    landing_path = synthetic_data.generate_landing(SCALE, str(tmp_path_factory.mktemp("landing") / "landing.parquet"))
+    return raw.build_raw(pl.scan_parquet(landing_path))
+
+
+@pytest.fixture(scope="session")
+def base_input_df(raw_df) -> pl.DataFrame:
+    return base.select_base_input(raw_df.lazy()).collect()
+
+
+@pytest.fixture(scope="session")
+def base_df(base_input_df) -> pl.DataFrame:
+    return base.build_base(base_input_df.lazy())
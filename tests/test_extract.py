@@ -0,0 +1,134 @@
+"""
+Download and extract against a local stand-in for the OpenPowerlifting file server, see 01_extract.run.
+"""
+
+import importlib
+import io
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import ClassVar
+
+import common_io
+import conf
+import polars as pl
+import pytest
+import requests
+
+extract = importlib.import_module("01_extract")
+
+CSV = b"Name,Sex,Date\n" + b"".join(f"Lifter {i},M,2024-01-{i % 28 + 1:02d}\n".encode() for i in range(500))
+
+
+def zipped(csv: bytes) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as zip_ref:
+        zip_ref.writestr("openpowerlifting.csv", csv)
+    return buffer.getvalue()
+
+
+class FileServer(BaseHTTPRequestHandler):
+    "Serves one file with an ETag, honouring If-None-Match and If-Range / Range like the upstream server"
+
+    content = zipped(CSV)
+    etag = '"v1"'
+    truncate_after: int | None = None  # drops the connection after this many bytes of the next response
+    received: ClassVar[list[dict]] = []
+
+    def do_GET(self):
+        type(self).received.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body, status = self.content, 200
+        if (byte_range := self.headers.get("Range")) and self.headers.get("If-Range") == self.etag:
+            start = int(byte_range.removeprefix("bytes=").removesuffix("-"))
+            if start >= len(self.content):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(self.content)}")
+                self.end_headers()
+                return
+            body, status = self.content[start:], 206
+
+        self.send_response(status)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(body)))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {len(self.content) - len(body)}-{len(self.content) - 1}/{len(self.content)}")
+        self.end_headers()
+
+        if self.truncate_after is not None:
+            body = body[: self.truncate_after]
+            type(self).truncate_after = None
+            self.close_connection = True
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch, tmp_path):
+    "Local file server as conf.zip_url, the data folder in tmp_path and uploads / README updates as no-ops"
+    FileServer.received = []
+    FileServer.truncate_after = None
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), FileServer)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(conf, "zip_url", f"http://127.0.0.1:{httpd.server_port}/openpowerlifting-latest.zip")
+    monkeypatch.setattr(conf, "DOWNLOAD_CHUNK_SIZE_BYTES", 256)
+    monkeypatch.setattr(common_io, "io_upload_to_s3", lambda *args, **kwargs: None)
+    monkeypatch.setattr(common_io, "io_run_in_background", lambda fn, *args, **kwargs: fn(*args, **kwargs))
+    monkeypatch.setattr(extract, "update_readme", lambda: None)
+    yield FileServer
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_unchanged_upstream_skips_extract(server):
+    assert extract.run().collect().height == 500
+    assert extract.read_download_state()["landing_written"]
+
+    assert extract.run() is None
+    assert server.received[-1]["If-None-Match"] == server.etag
+
+
+def test_interrupted_download_resumes_with_range(server):
+    server.truncate_after = len(server.content) // 2
+    with pytest.raises(requests.exceptions.RequestException):
+        extract.download_zip(conf.zip_url)
+    part_size = Path(f"{conf.zip_local_file_path}.part").stat().st_size
+    assert part_size > 0
+
+    assert extract.download_zip(conf.zip_url)
+    assert server.received[-1]["Range"] == f"bytes={part_size}-"
+    assert server.received[-1]["If-Range"] == server.etag
+    assert Path(conf.zip_local_file_path).read_bytes() == server.content
+
+
+def test_unsatisfiable_range_restarts_download(server):
+    extract.write_download_state({"url": conf.zip_url, "etag": server.etag, "complete": False})
+    Path(f"{conf.zip_local_file_path}.part").write_bytes(server.content + b"stale")
+
+    assert extract.download_zip(conf.zip_url)
+    assert "Range" not in server.received[-1]
+    assert Path(conf.zip_local_file_path).read_bytes() == server.content
+
+
+def test_failed_extract_is_rebuilt_on_unchanged_upstream(server, monkeypatch):
+    def fail(csv_chunk):
+        raise pl.exceptions.ComputeError("conversion failed")
+
+    with monkeypatch.context() as failing:
+        failing.setattr(extract, "read_landing_csv", fail)
+        with pytest.raises(pl.exceptions.ComputeError):
+            extract.run()
+    assert not extract.read_download_state()["landing_written"]
+
+    assert extract.run().collect().height == 500
+    assert server.received[-1]["If-None-Match"] == server.etag
+    assert extract.read_download_state()["landing_written"]
@@ -0,0 +1,65 @@
+"""
+Identity resolution of same-name lifters, see identity.py.
+"""
+
+import datetime
+
+import conf
+import identity
+import polars as pl
+import pytest
+
+
+def meets_df(meets: list[tuple]) -> pl.DataFrame:
+    "Rows of (name, sex, year, age) with the birth-year interval of 03_raw.add_birth_year, ages already rounded up to the half year"
+    df = pl.DataFrame(meets, schema={"name": pl.Utf8, "sex": pl.Utf8, "year": pl.Int32, "age": pl.Float64}, orient="row")
+    return df.with_columns(
+        pl.col("year").map_elements(lambda year: datetime.date(year, 6, 1), return_dtype=pl.Date).alias("date"),
+        (pl.col("year") - (pl.col("age") + conf.AGE_TOLERANCE_YEARS)).alias("min_birth_year"),
+        (pl.col("year") - (pl.col("age") - conf.AGE_TOLERANCE_YEARS)).alias("max_birth_year"),
+    ).with_columns(((pl.col("min_birth_year") + pl.col("max_birth_year")) / 2).floor().cast(pl.Int32).alias("birth_year"))
+
+
+@pytest.fixture
+def elizabeth_nguyens() -> pl.DataFrame:
+    "Three different lifters named Elizabeth Nguyen, born around 1995, 1975 and 1989, and a meet without an age"
+    return meets_df(
+        [
+            ("Elizabeth Nguyen", "F", 2015, 19.5),
+            ("Elizabeth Nguyen", "F", 2016, 40.5),
+            ("elizabeth nguyen", "F", 2017, 21.5),
+            ("Elizabeth Nguyen", "F", 2018, 23.5),
+            ("Elizabeth Nguyen", "F", 2019, 43.5),
+            ("Elizabeth Nguyen", "F", 2020, 30.5),
+            ("Elizabeth Nguyen", "F", 2021, None),
+        ]
+    )
+
+
+def test_overlapping_intervals_merge(elizabeth_nguyens):
+    keys = identity.resolve_identities(elizabeth_nguyens)["primary_key"]
+    # Born 1993.5-1996.5 from three meets, keyed on the birth year estimate of the first one
+    assert keys.gather([0, 2, 3]).to_list() == ["elizabeth-nguyen-f-1995"] * 3
+    assert keys.gather([1, 4]).to_list() == ["elizabeth-nguyen-f-1975"] * 2
+
+
+def test_disjoint_intervals_stay_separate(elizabeth_nguyens):
+    keys = identity.resolve_identities(elizabeth_nguyens)["primary_key"]
+    assert keys[5] == "elizabeth-nguyen-f-1989"
+    # A meet without an age cannot be told apart between several lifters
+    assert keys[6] == "elizabeth-nguyen-f"
+    assert keys.n_unique() == 4
+
+
+def test_identity_confidence(elizabeth_nguyens):
+    confidence = identity.resolve_identities(elizabeth_nguyens)["identity_confidence"]
+    # The 1995 and 1989 lifters are two years apart (1991.5 to 1993.5), half of IDENTITY_SEPARATION_YEARS
+    assert confidence.to_list() == [0.5, 1.0, 0.5, 0.5, 1.0, 0.5, 0.0]
+
+
+def test_single_lifter_takes_undated_meets():
+    df = meets_df([("Joshua Luu", "M", 2015, 20.5), ("Joshua Luu", "M", 2016, 23.5), ("Joshua Luu", "M", 2017, None), ("Joshua Luu", "F", 2017, None)])
+    resolved_df = identity.resolve_identities(df)
+    # Ages recorded inconsistently across meets still overlap
+    assert resolved_df["primary_key"].to_list() == ["joshua-luu-m-1994"] * 3 + ["joshua-luu-f"]
+    assert resolved_df["identity_confidence"].to_list() == [1.0] * 4
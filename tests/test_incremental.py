@@ -0,0 +1,26 @@
+"""
+Incremental builds of the base layer against full builds, see 03_base.build_base_incremental.
+"""
+
+import importlib
+
+import conf
+import elo
+import glicko
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+base = importlib.import_module("03_base")
+
+
+@pytest.mark.parametrize("from_checkpoints", [False, True], ids=["full-replay", "checkpoints"])
+def test_appended_meets_match_full_build(base_input_df, base_df, from_checkpoints):
+    # The latest fifth of the meets arrives in a new release
+    cutoff = base_input_df["date"].sort()[int(base_input_df.height * 0.8)]
+    previous_input_df = base_input_df.filter(pl.col("date") < cutoff)
+    previous_base_df = base.build_base(previous_input_df.lazy())
+    states = {"elo_state_df": elo.rating_checkpoints(previous_base_df), "glicko_state_df": glicko.rating_checkpoints(previous_base_df)} if from_checkpoints else {}
+
+    incremental_df = base.build_base_incremental(base_input_df, previous_input_df, previous_base_df, **states)
+    assert_frame_equal(incremental_df.sort(conf.base_sort_columns), base_df.sort(conf.base_sort_columns))
@@ -0,0 +1,45 @@
+"""
+Point-in-time features of a single lifter against the batch base layer, see point_in_time.py.
+"""
+
+import glicko
+import point_in_time
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+
+@pytest.fixture(scope="module")
+def glicko_state_df(base_df) -> pl.DataFrame:
+    return glicko.rating_checkpoints(base_df)
+
+
+@pytest.fixture(scope="module")
+def context(base_df, glicko_state_df) -> point_in_time.FeatureContext:
+    return point_in_time.build_context(base_df, glicko_state_df)
+
+
+def upcoming_meet(row: dict) -> dict:
+    "Base input columns of a row of the base layer, without its results"
+    return {column: row[column] for column in point_in_time.base.BASE_INPUT_COLUMNS if column not in point_in_time.RESULT_COLUMNS}
+
+
+def test_parity_with_base_layer(base_df, glicko_state_df):
+    point_in_time.check_parity(base_df, glicko_state_df, n_rows=20)
+
+
+def test_lifter_without_history_needs_lifter_id(base_df, context):
+    meet = upcoming_meet(base_df.row(0, named=True))
+    del meet["lifter_id"]
+    with pytest.raises(ValueError, match="lifter_id"):
+        point_in_time.lifter_features(base_df.clear(), meet, context)
+
+
+def test_known_lifter_without_earlier_meets(base_df, context):
+    # First meet of a lifter with a single meet that day, scored from an empty history
+    first_meets_df = base_df.filter((pl.col("date") == pl.col("date").min().over("lifter_id")) & (pl.len().over("lifter_id", "date") == 1))
+    row = first_meets_df.row(0, named=True)
+
+    features_df = point_in_time.lifter_features(base_df.clear(), upcoming_meet(row), context)
+    expected_df = point_in_time.feature_set.modelling_features(pl.DataFrame([row], schema=base_df.schema))
+    assert_frame_equal(features_df.drop(point_in_time.OUTCOME_COLUMNS), expected_df.drop(point_in_time.OUTCOME_COLUMNS))
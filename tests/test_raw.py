@@ -0,0 +1,27 @@
+"""
+Raw layer transformations, see 03_raw.py.
+"""
+
+import datetime
+import importlib
+
+import polars as pl
+from polars.testing import assert_frame_equal
+
+raw = importlib.import_module("03_raw")
+
+
+def test_duplicates_keep_first_in_landing_order():
+    df = pl.DataFrame(
+        {
+            "primary_key": ["a-m-1990", "b-f-1985", "a-m-1990", "a-m-1990"],
+            "date": [datetime.date(2020, 1, 1)] * 3 + [datetime.date(2021, 1, 1)],
+            "meet_name": ["open"] * 4,
+            "total": [500.0, 300.0, 510.0, 520.0],
+        }
+    )
+
+    unique_df = raw.filter_for_unique_primary_key(df.lazy()).collect()
+    assert_frame_equal(unique_df, df[[0, 1, 3]])
+    # Independent of the order of the other rows
+    assert_frame_equal(raw.filter_for_unique_primary_key(df[[1, 3, 0, 2]].lazy()).collect(), df[[1, 3, 0]])